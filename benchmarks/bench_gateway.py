@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+"""
+    benchmarks/bench_gateway.py - end-to-end load test against the gateway simulator
+
+    Starts a GatewaySimulator, drives get_tradfri_devices, get_tradfri_groups and the tradfriActions
+    commands against it and reports throughput and tail latency of the single requests per phase.
+    --transport udp uses the in-process UdpTransport, --transport coap-client spawns simulator/coap-client
+    for every request like the libcoap setup does.
+    run from the repository root: python -m benchmarks.bench_gateway --bulbs 500 --latency 20 --jitter 10
+"""
+
+import os
+import time
+import argparse
+import threading
+
+from coap.coap import Coap
+from coap.coap_transport import CoapTransport, CoapClientTransport, UdpTransport
+from config.config import Config
+from simulator.gateway_simulator import GatewaySimulator
+from tradfri import tradfriActions
+from tradfri.tradfri_device import get_tradfri_devices, get_tradfri_devices_parallel
+from tradfri.tradfri_group import get_tradfri_groups, get_tradfri_groups_parallel
+
+_COAP_CLIENT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'simulator', 'coap-client')
+
+
+class _TimedTransport(CoapTransport):
+    """ records the duration of every request of the wrapped transport """
+    def __init__(self, transport: CoapTransport):
+        self.transport = transport
+        self.scheme    = transport.scheme
+        self.port      = transport.port
+        self.samples   = []
+        self.errors    = 0
+
+        self._lock = threading.Lock()
+
+    def request(self, method: str, uri: str, api_config: Config, payload=None, timeout=None):
+        start = time.perf_counter()
+
+        try:
+            return self.transport.request(method, uri, api_config, payload, timeout)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.samples.append(time.perf_counter() - start)
+
+    def close(self):
+        self.transport.close()
+
+    def reset(self):
+        with self._lock:
+            samples, errors = self.samples, self.errors
+            self.samples    = []
+            self.errors     = 0
+
+        return samples, errors
+
+
+def _percentile(samples: list, percentile: float):
+    if not samples:
+        return 0.0
+
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))]
+
+
+def _run_phase(name: str, transport: _TimedTransport, function):
+    """ runs function and returns the report line of the phase """
+    failed = 0
+    start  = time.perf_counter()
+
+    try:
+        items = function()
+    except Exception as e:
+        items  = 0
+        failed = 1
+        print(f'[-] {name}: {e}')
+
+    elapsed         = time.perf_counter() - start
+    samples, errors = transport.reset()
+
+    return (name, items, len(samples), errors + failed, elapsed, len(samples) / elapsed if elapsed else 0.0,
+            *[_percentile(samples, percentile) * 1000 for percentile in (50, 95, 99, 100)])
+
+
+def _commands(config: Config, device_ids: list, group_ids: list, count: int):
+    """ sends count power/dim commands to lights and groups in turn, returns the number of commands """
+    failed = 0
+
+    for index in range(count):
+        value = 'on' if index % 2 == 0 else 'off'
+
+        try:
+            if index % 4 < 2:
+                id = device_ids[index % len(device_ids)]
+
+                if index % 4 == 0:
+                    tradfriActions.tradfri_power_light(config.hubip, config.apiuser, config.apikey, id, value)
+                else:
+                    tradfriActions.tradfri_dim_light(config.hubip, config.apiuser, config.apikey, id, index % 101)
+            else:
+                id = group_ids[index % len(group_ids)]
+
+                if index % 4 == 2:
+                    tradfriActions.tradfri_power_group(config.hubip, config.apiuser, config.apikey, id, value)
+                else:
+                    tradfriActions.tradfri_dim_group(config.hubip, config.apiuser, config.apikey, id, index % 101)
+        except Exception:
+            failed += 1
+
+    return count - failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='load test of the framework against the gateway simulator')
+    parser.add_argument('--transport', choices=['udp', 'coap-client'], default='udp')
+    parser.add_argument('--bulbs', type=int, default=100)
+    parser.add_argument('--color-bulbs', type=int, default=0)
+    parser.add_argument('--remotes', type=int, default=0)
+    parser.add_argument('--groups', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0, help='response latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='latency jitter in milliseconds')
+    parser.add_argument('--loss', type=float, default=0, help='probability a datagram gets lost')
+    parser.add_argument('--reject', type=float, default=0, help='probability a request is rejected with 5.03')
+    parser.add_argument('--flood-limit', type=float, help='requests per second above which requests are rejected')
+    parser.add_argument('--commands', type=int, default=100, help='number of tradfriActions commands')
+    parser.add_argument('--parallel', action='store_true', help='fetch devices and groups concurrently')
+    parser.add_argument('--max-in-flight', type=int, help='concurrent requests with --parallel')
+    parser.add_argument('--no-rate-limit', action='store_true', help='disable the adaptive rate limiter')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    simulator = GatewaySimulator('127.0.0.1', 0, args.bulbs, args.color_bulbs, args.remotes, args.groups,
+                                 args.latency / 1000, args.jitter / 1000, args.loss, args.reject, args.flood_limit,
+                                 args.seed)
+
+    if args.transport == 'udp':
+        transport = _TimedTransport(UdpTransport(simulator.port))
+    else:
+        # coap-client builds coaps://127.0.0.1:5684 uris, the fake binary is pointed to the simulator instead
+        os.environ['TRADFRI_SIMULATOR'] = f'127.0.0.1:{simulator.port}'
+        transport = _TimedTransport(CoapClientTransport(_COAP_CLIENT))
+
+    config = Config('127.0.0.1', 'user', 'key', args.max_in_flight)
+
+    Coap.set_transport(transport)
+
+    if args.no_rate_limit:
+        Coap.set_rate_limiter(None)
+
+    if args.parallel:
+        devices = lambda: len(get_tradfri_devices_parallel(config, args.max_in_flight).items)
+        groups  = lambda: len(get_tradfri_groups_parallel(config, args.max_in_flight).items)
+    else:
+        devices = lambda: len(get_tradfri_devices(config))
+        groups  = lambda: len(get_tradfri_groups(config))
+
+    lights = simulator.device_ids[:args.bulbs + args.color_bulbs] or simulator.device_ids
+
+    with simulator:
+        results = [
+            _run_phase('devices', transport, devices),
+            _run_phase('groups', transport, groups),
+            _run_phase('commands', transport, lambda: _commands(config, lights, simulator.group_ids, args.commands)),
+        ]
+
+    Coap.set_transport(None)
+
+    print(f'{len(simulator.device_ids)} devices, {len(simulator.group_ids)} groups, {args.transport} transport, '
+          f'latency {args.latency:g}±{args.jitter:g} ms, loss {args.loss:g}, reject {args.reject:g}')
+    print(f'{"phase":<10}{"items":>7}{"requests":>10}{"errors":>8}{"seconds":>9}{"req/s":>9}'
+          f'{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}')
+
+    for name, items, requests, errors, elapsed, throughput, p50, p95, p99, maximum in results:
+        print(f'{name:<10}{items:>7}{requests:>10}{errors:>8}{elapsed:>9.2f}{throughput:>9.1f}'
+              f'{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}{maximum:>9.1f}')
+
+    print(f'simulator: {simulator.requests} requests, {simulator.rejected} rejected, {simulator.dropped} dropped')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+    benchmarks/bench_memory.py - bytes per device of the model classes
+
+    Compares the __slots__ based models with interned product infos against dict backed models which
+    hold their own product info (the layout before the models became slotted).
+    run from the repository root: python -m benchmarks.bench_memory [count]
+"""
+
+import sys
+import gc
+import colorsys
+import tracemalloc
+
+from config.config import Config
+from tradfri.tradfri_device import parse_tradfri_device
+from tradfri.tradfri_group import TradfriGroup
+from tradfri.tradfri_schema import COLOR_LIGHT_BULB_SCHEMA, LIGHT_BULB_SCHEMA, GROUP_SCHEMA
+
+
+class _DictProductInfo:
+    def __init__(self, description, manufacturer, version):
+        self.description  = description
+        self.manufacturer = manufacturer
+        self.version      = version
+
+
+class _DictLightBulb:
+    def __init__(self, fields, api_config):
+        product_info = fields['product_info']
+
+        self.id                = fields['id']
+        self.name              = fields['name']
+        self.creation_date     = fields['creation_date']
+        self.product_info      = _DictProductInfo(product_info['description'], product_info['manufacturer'],
+                                                  product_info['version'])
+        self.api_config        = api_config
+        self.brightness        = fields['brightness']
+        self.color             = fields['color']
+        self.color_description = fields['color']
+        self.status            = fields['status']
+
+
+class _DictColorLightBulb(_DictLightBulb):
+    def __init__(self, fields, api_config):
+        super().__init__(fields, api_config)
+
+        self.hue        = round(fields['hue'], 2)
+        self.saturation = round(fields['saturation'], 2)
+
+        r, g, b = colorsys.hsv_to_rgb(self.hue / 360, self.saturation / 100, self.brightness / 100)
+
+        self.color             = f'{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}'
+        self.color_description = self.color
+
+
+class _DictGroup:
+    def __init__(self, fields, api_config):
+        self.id            = fields['id']
+        self.name          = fields['name']
+        self.creation_date = fields['creation_date']
+        self.state         = fields['state']
+        self.brightness    = fields['brightness']
+        self.device_ids    = fields['device_ids']
+        self.api_config    = api_config
+
+
+def _payloads(count):
+    devices = []
+
+    for index in range(count):
+        entry = {'5850': index % 2, '5851': index % 255, '5706': 'f1e0b5'}
+
+        if index % 3 == 0:
+            entry.update({'5707': (index * 97) % 65536, '5708': (index * 31) % 65536})
+
+        devices.append({'9001': f'bulb {index}', '9002': 1500000000 + index, '9003': 65537 + index,
+                        '3': {'0': 'IKEA of Sweden', '1': 'TRADFRI bulb E27 WS opal 980lm', '3': '1.2.214'},
+                        '3311': [entry]})
+
+    groups = [{'9001': f'group {index}', '9002': 1500000000, '9003': 131073 + index, '5850': 1, '5851': 254,
+               '9018': {'15002': {'9003': [65537 + index * 10 + member for member in range(10)]}}}
+              for index in range(max(1, count // 10))]
+
+    return devices, groups
+
+
+def _measure(build, payloads):
+    gc.collect()
+    tracemalloc.start()
+
+    before  = tracemalloc.take_snapshot()
+    objects = [build(payload) for payload in payloads]
+    after   = tracemalloc.take_snapshot()
+
+    tracemalloc.stop()
+
+    # the payloads themselves are allocated beforehand, only the model objects are counted
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return size / len(objects), objects
+
+
+def _dict_device(payload, api_config):
+    if '5707' in payload['3311'][0]:
+        return _DictColorLightBulb(COLOR_LIGHT_BULB_SCHEMA.decode(payload), api_config)
+
+    return _DictLightBulb(LIGHT_BULB_SCHEMA.decode(payload), api_config)
+
+
+def main():
+    count      = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    api_config = Config('127.0.0.1', 'user', 'key')
+
+    devices, groups = _payloads(count)
+
+    dict_devices, _ = _measure(lambda payload: _dict_device(payload, api_config), devices)
+    slot_devices, _ = _measure(lambda payload: parse_tradfri_device(payload, api_config), devices)
+    dict_groups, _  = _measure(lambda payload: _DictGroup(GROUP_SCHEMA.decode(payload), api_config), groups)
+    slot_groups, _  = _measure(lambda payload: TradfriGroup.from_json(payload, api_config), groups)
+
+    print(f'{count} devices, {len(groups)} groups')
+    print(f'{"":<8}{"dict backed":>14}{"__slots__":>14}{"saving":>10}')
+    print(f'{"device":<8}{dict_devices:>12.0f} B{slot_devices:>12.0f} B{1 - slot_devices / dict_devices:>10.1%}')
+    print(f'{"group":<8}{dict_groups:>12.0f} B{slot_groups:>12.0f} B{1 - slot_groups / dict_groups:>10.1%}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""
+    benchmarks/bench_parsing.py - ops/sec and allocations of the parsing and model hot paths
+
+    Runs offline against the gateway responses in benchmarks/fixtures/gateway.json and compares the results
+    with benchmarks/baseline.json. the timings depend on the machine and vary by about 30% between runs, so
+    --check only fails on allocations (bytes and blocks per operation), which are stable across runs and
+    machines; --timing also fails on slower timings, re-record the baseline with --save before using it.
+    run from the repository root: python -m benchmarks.bench_parsing [--save] [--check [--timing]] [--filter NAME]
+"""
+
+import os
+import gc
+import sys
+import json
+import timeit
+import statistics
+import argparse
+import tracemalloc
+
+from coap.coap import Coap
+from common.helper import json_helper
+from config.config import Config
+from tradfri import tradfriActions
+from tradfri.tradfri_device import parse_tradfri_device, parse_tradfri_devices, TradfriDevice, TradfriLightBulb, \
+                                   TradfriColorLightBulb, TradfriRemote
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_group import TradfriGroup
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+_FIXTURES  = os.path.join(_DIRECTORY, 'fixtures', 'gateway.json')
+_BASELINE  = os.path.join(_DIRECTORY, 'baseline.json')
+
+_REPEAT = 5
+
+
+def load_fixtures(path: str=_FIXTURES):
+    """ returns the raw responses (as coap-client prints them) per kind: bulbs, color_bulbs, remotes, groups """
+    with open(path) as file:
+        return json.load(file)
+
+
+def _cases(fixtures: dict):
+    """ returns (name, function, operations per call), every function runs over a whole fixture list """
+    api_config = Config('192.168.1.10', 'user', 'key')
+    devices    = fixtures['bulbs'] + fixtures['color_bulbs'] + fixtures['remotes']
+    everything = devices + fixtures['groups']
+
+    decoded = {kind: [json.loads(payload) for payload in payloads] for kind, payloads in fixtures.items()}
+
+    bulbs       = decoded['bulbs']
+    color_bulbs = decoded['color_bulbs']
+    remotes     = decoded['remotes']
+    groups      = decoded['groups']
+
+    hex_colors    = ['f1e0b5', 'efd275', 'f5faf6', 'e0c090']
+    color_values  = [('dc4b31', 6.32, 75.67), ('4a418a', 230.71, 91.55), ('7f2a19', 10.0, 80.0)]
+    ids           = [None, 65537, 131073]
+    powers        = ['on', 'off']
+    dims          = ['0', '50', '100']
+    temperatures  = ['warm', 'normal', 'cold']
+
+    return [
+        ('json_helper',                   lambda: [json_helper(payload) for payload in everything], len(everything)),
+        ('parse_tradfri_device bulb',     lambda: [parse_tradfri_device(json, api_config) for json in bulbs], len(bulbs)),
+        ('parse_tradfri_device color',    lambda: [parse_tradfri_device(json, api_config) for json in color_bulbs],
+                                          len(color_bulbs)),
+        ('parse_tradfri_device remote',   lambda: [parse_tradfri_device(json, api_config) for json in remotes],
+                                          len(remotes)),
+        ('parse_tradfri_devices',         lambda: parse_tradfri_devices(bulbs + color_bulbs + remotes, api_config),
+                                          len(devices)),
+        ('TradfriDevice.from_json',       lambda: [TradfriDevice.from_json(json, api_config) for json in remotes],
+                                          len(remotes)),
+        ('TradfriLightBulb.from_json',    lambda: [TradfriLightBulb.from_json(json, api_config) for json in bulbs],
+                                          len(bulbs)),
+        ('TradfriColorLightBulb.from_json', lambda: [TradfriColorLightBulb.from_json(json, api_config)
+                                                     for json in color_bulbs], len(color_bulbs)),
+        ('TradfriRemote.from_json',       lambda: [TradfriRemote.from_json(json, api_config) for json in remotes],
+                                          len(remotes)),
+        ('TradfriGroup.from_json',        lambda: [TradfriGroup.from_json(json, api_config) for json in groups],
+                                          len(groups)),
+        ('TradfriLightBulb._map_color_value', lambda: [TradfriLightBulb._map_color_value(color) for color in hex_colors],
+                                              len(hex_colors)),
+        ('TradfriColorLightBulb._map_color_value', lambda: [TradfriColorLightBulb._map_color_value(*value)
+                                                            for value in color_values], len(color_values)),
+        ('Coap._build_tradri_hub',        lambda: [Coap._build_tradri_hub(api_config.hubip, endpoint, id)
+                                                   for endpoint in (TradfriEndpoint.DEVICE, TradfriEndpoint.GROUP)
+                                                   for id in ids], 2 * len(ids)),
+        ('tradfriActions light payloads', lambda: [tradfriActions._power_light_payload(value) for value in powers] +
+                                                  [tradfriActions._dim_light_payload(value) for value in dims],
+                                          len(powers) + len(dims)),
+        ('tradfriActions color payloads', lambda: [tradfriActions._color_light_payload(value) for value in temperatures],
+                                          len(temperatures)),
+        ('tradfriActions group payloads', lambda: [tradfriActions._power_group_payload(value) for value in powers] +
+                                                  [tradfriActions._dim_group_payload(value) for value in dims],
+                                          len(powers) + len(dims)),
+    ]
+
+
+def _time(function, operations):
+    """ median of _REPEAT runs, in operations per second """
+    timer     = timeit.Timer(function)
+    number, _ = timer.autorange()
+    median    = statistics.median(timer.repeat(_REPEAT, number))
+
+    return operations * number / median
+
+
+def _allocations(function, operations):
+    """ returns (peak bytes, retained bytes, retained blocks) per operation, the result of the call is kept alive
+        for the latter two """
+    function()
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        snapshot  = tracemalloc.take_snapshot()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+        result        = function()
+        current, peak = tracemalloc.get_traced_memory()
+        blocks        = sum(stat.count_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, 'filename'))
+    finally:
+        tracemalloc.stop()
+
+    del result
+    return (peak - before) / operations, (current - before) / operations, blocks / operations
+
+
+def run(fixtures: dict, filter: str=None):
+    """ returns {name: {'ops': ops/sec, 'peak': bytes/op, 'retained': bytes/op, 'blocks': blocks/op}} """
+    results = {}
+
+    for name, function, operations in _cases(fixtures):
+        if filter is not None and filter.lower() not in name.lower():
+            continue
+
+        peak, retained, blocks = _allocations(function, operations)
+        results[name]          = {'ops': round(_time(function, operations)), 'peak': round(peak),
+                                  'retained': round(retained), 'blocks': round(blocks, 1)}
+
+    return results
+
+
+def load_baseline(path: str=_BASELINE):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_baseline(results: dict, path: str=_BASELINE):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=4, sort_keys=True)
+        file.write('\n')
+
+
+def compare(results: dict, baseline: dict, tolerance: float, timing_tolerance: float=None):
+    """ returns the names of all cases which allocate more than the baseline allows, with timing_tolerance also
+        the ones which are slower """
+    regressions = []
+
+    for name, result in results.items():
+        reference = baseline.get(name)
+
+        if reference is None:
+            continue
+
+        allocates = any(result[key] > reference[key] * (1 + tolerance) + slack
+                        for key, slack in (('peak', 16), ('retained', 16), ('blocks', 1)) if key in reference)
+        slower    = timing_tolerance is not None and result['ops'] < reference['ops'] * (1 - timing_tolerance)
+
+        if allocates or slower:
+            regressions.append(name)
+
+    return regressions
+
+
+def _report(results: dict, baseline: dict, regressions: list):
+    width = max(len(name) for name in results) + 2
+
+    print(f'{"":<{width}}{"ops/sec":>12}{"baseline":>12}{"change":>9}{"peak B/op":>11}{"kept B/op":>11}'
+          f'{"blocks/op":>11}')
+
+    for name, result in results.items():
+        reference = baseline.get(name)
+        marker    = '  <- regression' if name in regressions else ''
+
+        if reference is not None:
+            change = f'{result["ops"] / reference["ops"] - 1:+.1%}'
+            print(f'{name:<{width}}{result["ops"]:>12,}{reference["ops"]:>12,}{change:>9}'
+                  f'{result["peak"]:>11,}{result["retained"]:>11,}{result["blocks"]:>11,}{marker}')
+        else:
+            print(f'{name:<{width}}{result["ops"]:>12,}{"-":>12}{"":>9}{result["peak"]:>11,}{result["retained"]:>11,}'
+                  f'{result["blocks"]:>11,}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='microbenchmarks of the parsing and model hot paths')
+    parser.add_argument('--save', action='store_true', help='record the results as new baseline')
+    parser.add_argument('--check', action='store_true',
+                        help='exit with 1 if a case allocates more than the baseline')
+    parser.add_argument('--timing', action='store_true',
+                        help='with --check also exit with 1 if a case is slower than the baseline')
+    parser.add_argument('--tolerance', type=float, default=.25, help='allowed allocation regression, default 0.25')
+    parser.add_argument('--timing-tolerance', type=float, default=.5,
+                        help='allowed timing regression with --timing, default 0.5')
+    parser.add_argument('--filter', help='only run cases containing this text')
+    parser.add_argument('--baseline', default=_BASELINE, help='baseline file')
+    args = parser.parse_args()
+
+    results     = run(load_fixtures(), args.filter)
+    baseline    = load_baseline(args.baseline)
+    regressions = compare(results, baseline, args.tolerance, args.timing_tolerance if args.timing else None)
+
+    _report(results, baseline, regressions)
+
+    if args.save:
+        if args.filter is not None:
+            # keep the cases which have not been run
+            baseline.update(results)
+            results = baseline
+
+        save_baseline(results, args.baseline)
+        print(f'[+] baseline written to {args.baseline}')
+    elif args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+import os
+import json
+import time
+import random
+import socket
+import asyncio
+
+from urllib.parse import urlsplit
+
+from coap.coap import Coap, CoapAttempts
+from config.config import Config
+from coap.coap_message import CoapMessage
+from coap.coap_policy import CoapRequestPolicy
+from coap.coap_state_filter import CoapStateFilter, active as active_state_filter
+from coap.coap_transport import CoapTransport, CoapClientTransport, DtlsTransport, CoapError, \
+                                CoapTimeoutError
+from tradfri.tradfri_endpoint import TradfriEndpoint
+
+
+class AsyncCoapTransport:
+    """ base class of all transports which are able to carry a CoAP request without blocking the event loop """
+    scheme = 'coaps'
+    port   = 5684
+
+    async def request(self, method: str, uri: str, api_config: Config, payload=None, timeout=None):
+        raise NotImplementedError()
+
+    async def close(self):
+        pass
+
+
+class AsyncCoapClientTransport(AsyncCoapTransport):
+    """ spawns coap-client as asyncio subprocess, the process gets killed if the request is cancelled """
+    def __init__(self, path: str=None):
+        self._transport = CoapClientTransport(path)
+
+    async def request(self, method: str, uri: str, api_config: Config, payload=None, timeout=None):
+        if not self._transport.is_available():
+            raise CoapError(f'could not find libcoap ({self._transport.path})')
+
+        call = ['-m', method, '-u', api_config.apiuser, '-k', api_config.apikey]
+
+        if payload is not None:
+            call += ['-e', payload]
+
+        if timeout is not None:
+            call += ['-B', str(int(timeout))]
+
+        process = await asyncio.create_subprocess_exec(self._transport.path, *call, uri,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.DEVNULL)
+        try:
+            stdout, _ = await process.communicate()
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+        return stdout.decode('utf-8', 'replace').strip('\n').split('\n')[-1]
+
+
+class AsyncTransportAdapter(AsyncCoapTransport):
+    """ runs a synchronous transport (e.g. the shared DTLS sessions) in the default executor """
+    def __init__(self, transport: CoapTransport):
+        self.transport = transport
+        self.scheme    = transport.scheme
+        self.port      = transport.port
+
+    async def request(self, method: str, uri: str, api_config: Config, payload=None, timeout=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.transport.request, method, uri, api_config, payload, timeout)
+
+    async def close(self):
+        self.transport.close()
+
+
+class AsyncCoapSession(asyncio.DatagramProtocol):
+    """ asyncio CoAP endpoint bound to a single gateway over plain UDP """
+    __ACK_TIMEOUT       = 2.0
+    __ACK_RANDOM_FACTOR = 1.5
+    __DEFAULT_TIMEOUT   = 5
+
+    def __init__(self, host: str, port: int):
+        self.host        = host
+        self.port        = port
+        self.closed      = False
+        self.loop        = None
+        self._socket     = None
+        self._transport  = None
+        self._pending    = {}
+        self._message_id = random.randint(0, 0xffff)
+
+    async def open(self):
+        self.loop    = asyncio.get_running_loop()
+        self._socket = socket.socket(socket.AF_INET6 if ':' in self.host else socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._socket.connect((self.host, self.port))
+
+        await self.loop.create_datagram_endpoint(lambda: self, sock=self._socket)
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def connection_lost(self, exc):
+        self.closed = True
+
+    def error_received(self, exc):
+        # e.g. ICMP port unreachable, pending requests are retransmitted until their timeout
+        pass
+
+    def close(self):
+        self.closed = True
+
+        if self._transport is None:
+            return
+
+        if self.loop.is_closed():
+            # e.g. after asyncio.run, the transport of a closed loop can't be closed anymore
+            self._socket.close()
+        else:
+            self._transport.close()
+
+    def datagram_received(self, data, address):
+        try:
+            message = CoapMessage.decode(data)
+        except ValueError:
+            return
+
+        if message.type == CoapMessage.TYPE_CON:
+            self._transport.sendto(CoapMessage(CoapMessage.TYPE_ACK, CoapMessage.CODE_EMPTY, message.message_id).encode())
+
+        pending = self._pending.get(message.token)
+
+        if pending is None:
+            return
+
+        future, state = pending
+
+        if message.type == CoapMessage.TYPE_ACK and message.code == CoapMessage.CODE_EMPTY:
+            state['acknowledged'] = True
+        elif not future.done():
+            future.set_result(message)
+
+    async def _exchange(self, message: CoapMessage, timeout):
+        future = asyncio.get_running_loop().create_future()
+        state  = {'acknowledged': False}
+        self._pending[message.token] = (future, state)
+
+        data           = message.encode()
+        retransmission = AsyncCoapSession.__ACK_TIMEOUT * random.uniform(1, AsyncCoapSession.__ACK_RANDOM_FACTOR)
+        remaining      = timeout
+
+        try:
+            self._transport.sendto(data)
+
+            while remaining > 0:
+                wait = remaining if state['acknowledged'] else min(retransmission, remaining)
+
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+                remaining -= wait
+
+                if not state['acknowledged']:
+                    retransmission *= 2
+                    self._transport.sendto(data)
+
+        finally:
+            del self._pending[message.token]
+            future.cancel()
+
+        raise CoapTimeoutError(f'no response from {self.host}:{self.port} for {message.uri_path}')
+
+    async def request(self, method: str, path: str, payload=None, timeout=None, options=None):
+        timeout = timeout if timeout is not None else AsyncCoapSession.__DEFAULT_TIMEOUT
+        body    = b''
+        block   = 0
+
+        while True:
+            self._message_id = (self._message_id + 1) & 0xffff
+
+            message = CoapMessage(CoapMessage.TYPE_CON, CoapMessage.METHODS[method], self._message_id,
+                                  os.urandom(4), list(options or []), payload or b'')
+            message.uri_path = path
+
+            if block > 0:
+                message.add_option(CoapMessage.OPTION_BLOCK2, CoapMessage.encode_block2(block, False, size))
+
+            response = await self._exchange(message, timeout)
+            body    += response.payload
+            block2   = response.block2
+
+            if block2 is None or not block2[1] or not response.is_success:
+                response.payload = body
+                return response
+
+            block = block2[0] + 1
+            size  = block2[2]
+
+
+class AsyncUdpTransport(AsyncCoapTransport):
+    """ native asyncio transport over plain UDP, keeps one session per gateway (e.g. for the CoapServer stand-in) """
+    scheme = 'coap'
+    port   = 5683
+
+    def __init__(self, port: int=None):
+        if port is not None:
+            self.port = port
+
+        self._sessions = {}
+
+    async def get_session(self, host: str, port: int):
+        session = self._sessions.get((host, port))
+
+        if session is not None and not session.closed and session.loop is not asyncio.get_running_loop():
+            # sessions are bound to the loop which opened them
+            session.close()
+
+        if session is None or session.closed:
+            session = AsyncCoapSession(host, port)
+            await session.open()
+            self._sessions[(host, port)] = session
+
+        return session
+
+    async def request(self, method: str, uri: str, api_config: Config, payload=None, timeout=None):
+        parts   = urlsplit(uri)
+        session = await self.get_session(parts.hostname, parts.port or self.port)
+
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+
+        response = await session.request(method, parts.path, payload, timeout)
+
+        if not response.is_success:
+            raise CoapError(f'{method.upper()} {uri} failed with {response.code_string}', response.code)
+
+        return response.payload.decode('utf-8')
+
+    async def close(self):
+        for session in self._sessions.values():
+            session.close()
+
+        self._sessions.clear()
+
+
+class AsyncCoap:
+    """ non-blocking counterpart of Coap, the request policy (timeouts, deadline, retries, hedging), the cache,
+        the rate limiter, the metrics and the state filter are the ones of Coap, so both clients behave the same.
+        the metrics can't attribute phases other than pace and parse to a request, see _execute """
+    __transport = None
+    __closing   = set()
+
+    @staticmethod
+    def get_transport() -> AsyncCoapTransport:
+        """ returns the active transport, the shared in-process DTLS sessions are preferred over coap-client """
+        if AsyncCoap.__transport is None:
+            if DtlsTransport.is_available():
+                AsyncCoap.__transport = AsyncTransportAdapter(DtlsTransport())
+            else:
+                AsyncCoap.__transport = AsyncCoapClientTransport()
+
+        return AsyncCoap.__transport
+
+    @staticmethod
+    def set_transport(transport: AsyncCoapTransport):
+        """ replaces the active transport, the previous one gets closed """
+        previous, AsyncCoap.__transport = AsyncCoap.__transport, transport
+
+        if previous is None or previous is transport:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(previous.close())
+        else:
+            # closing must not block the loop, the task is kept until it is done
+            task = loop.create_task(previous.close())
+            AsyncCoap.__closing.add(task)
+            task.add_done_callback(AsyncCoap.__closing.discard)
+
+    @staticmethod
+    async def _hedge(policy: CoapRequestPolicy, request, delay: float):
+        """ like CoapRequestPolicy.hedge, the request which loses is cancelled """
+        pending = {asyncio.ensure_future(request())}
+        done, _ = await asyncio.wait(pending, timeout=delay)
+
+        if not done:
+            policy.count_hedge()
+            pending.add(asyncio.ensure_future(request()))
+
+        error = None
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+
+                    error = task.exception()
+
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    async def _request(policy: CoapRequestPolicy, transport: AsyncCoapTransport, method: str, uri: str,
+                       api_config: Config, payload, timeout):
+        """ sends a single attempt, a GET is hedged once it takes longer than the policy's hedge delay """
+        delay   = policy.hedge_delay(api_config.hubip) if method == 'get' else None
+        start   = time.perf_counter()
+        request = lambda: asyncio.wait_for(transport.request(method, uri, api_config, payload, timeout), timeout)
+
+        if delay is None or delay >= timeout:
+            received_data = await request()
+        else:
+            received_data = await AsyncCoap._hedge(policy, request, delay)
+
+        policy.record_latency(api_config.hubip, time.perf_counter() - start)
+        return received_data
+
+    @staticmethod
+    async def _execute(method: str, api_config: Config, endpoint: TradfriEndpoint, id=None, payload=None,
+                       return_json: bool=True, timeout=None):
+        """ the retry loop of Coap._execute, timeout (if given) can only shorten the policy's timeout """
+        transport = AsyncCoap.get_transport()
+        uri       = Coap._build_tradri_hub(api_config.hubip, endpoint, id, transport.scheme, transport.port)
+
+        # concurrent requests share the thread, so the transports can't attribute phases to the events
+        attempts  = CoapAttempts(method, api_config, endpoint, uri, payload, return_json, Coap.get_policy(),
+                                 Coap.get_rate_limiter(), Coap.get_metrics(), bind=False)
+
+        while True:
+            limit = attempts.begin(timeout)
+            await asyncio.sleep(attempts.pace())
+
+            try:
+                received_data = await AsyncCoap._request(attempts.policy, transport, method, uri, api_config,
+                                                         payload, limit)
+            except asyncio.TimeoutError:
+                attempts.failed(CoapTimeoutError(f'{method.upper()} {uri} timed out after {limit}s'))
+            except Exception as e:
+                attempts.failed(e)
+            else:
+                done, result = attempts.received(received_data)
+
+                if done:
+                    return result
+
+            await asyncio.sleep(attempts.retry())
+
+    @staticmethod
+    async def _is_unchanged(state_filter: CoapStateFilter, payload, api_config: Config, endpoint: TradfriEndpoint,
+                            id) -> bool:
+        """ like Coap._is_unchanged, but source 'read' reads the resource with the asynchronous client """
+        if state_filter.source != CoapStateFilter.SOURCE_READ:
+            return Coap._is_unchanged(state_filter, payload, api_config, endpoint, id)
+
+        try:
+            changes = json.loads(payload)
+            current = await AsyncCoap.get(api_config, endpoint, id)
+
+            if endpoint != TradfriEndpoint.GROUP or current is None:
+                return CoapStateFilter.is_unchanged(changes, current)
+
+            # the members are read concurrently, the group resource only holds its last command
+            members = await asyncio.gather(*(AsyncCoap.get(api_config, TradfriEndpoint.DEVICE, member)
+                                             for member in CoapStateFilter.member_ids(current)))
+
+            return CoapStateFilter.is_unchanged(changes, current, members)
+        except Exception:
+            return False
+
+    @staticmethod
+    async def put(payload, api_config: Config, endpoint: TradfriEndpoint, id=None, return_json: bool=True,
+                  timeout=None):
+        cache        = Coap.get_cache()
+        state_filter = active_state_filter() or Coap.get_state_filter()
+
+        if state_filter is not None:
+            skipped = await AsyncCoap._is_unchanged(state_filter, payload, api_config, endpoint, id)
+            state_filter.count(skipped)
+
+            if skipped:
+                return None if return_json else ''
+
+        try:
+            return await AsyncCoap._execute('put', api_config, endpoint, id, payload, return_json, timeout)
+        finally:
+            # the cache is shared with the synchronous Coap class, also a failed PUT might have changed the state
+            if cache is not None:
+                cache.invalidate(api_config.hubip, endpoint, id)
+
+    @staticmethod
+    async def get(api_config: Config, endpoint: TradfriEndpoint, id=None, timeout=None):
+        cache = Coap.get_cache()
+
+        if cache is not None:
+            json_obj = cache.get(api_config.hubip, endpoint, id)
+
+            if json_obj is not None:
+                return json_obj
+
+        json_obj = await AsyncCoap._execute('get', api_config, endpoint, id, timeout=timeout)
+
+        if cache is not None:
+            cache.set(api_config.hubip, endpoint, id, json_obj)
+
+        return json_obj
@@ -1,40 +1,301 @@
-import os
-import sys
 import json
+import time
 
 from config.config import Config
 from tradfri.tradfri_endpoint import TradfriEndpoint
+from coap.coap_cache import CoapCache
+from coap.coap_message import CoapMessage
+from coap.coap_metrics import CoapMetrics, CoapRequestEvent
+from coap.coap_policy import CoapRequestPolicy
+from coap.coap_rate_limiter import CoapRateLimiter
+from coap.coap_state_filter import CoapStateFilter, active as active_state_filter
+from coap.coap_transport import CoapTransport, CoapClientTransport, DtlsTransport, CoapObservation, CoapError, \
+                                CoapTimeoutError, CoapConnectionError, CoapResponseError
+
+
+class CoapAttempts:
+    """ the attempts of a single request: deadline, pacing, metrics and the handling of their outcomes. shared by
+        the retry loops of Coap and AsyncCoap, which only differ in how they send and wait """
+    __REJECTION_CODES = (CoapMessage.CODE_SERVICE_UNAVAILABLE, CoapMessage.CODE_TOO_MANY_REQUESTS)
+
+    def __init__(self, method: str, api_config: Config, endpoint: TradfriEndpoint, uri: str, payload=None,
+                 return_json: bool=True, policy: CoapRequestPolicy=None, limiter: CoapRateLimiter=None,
+                 metrics: CoapMetrics=None, bind: bool=True):
+        """ bind=False for requests which share their thread (asyncio), the transports can't attribute phases
+            to their events then """
+        self.method      = method
+        self.api_config  = api_config
+        self.endpoint    = endpoint
+        self.uri         = uri
+        self.payload     = payload
+        self.return_json = return_json
+        self.policy      = policy if policy is not None else CoapRequestPolicy()
+        self.limiter     = limiter
+        self.metrics     = metrics
+        self.attempt     = 0
+        self.event       = None
+
+        self._bind     = bind
+        self._rejected = None
+
+    @staticmethod
+    def is_rejection(method: str, error: CoapError=None, received_data: str=None):
+        """ the gateway's flood protection either rejects requests or drops them (empty response) """
+        if error is not None:
+            return error.code in CoapAttempts.__REJECTION_CODES
+
+        return method == 'get' and not received_data.strip()
+
+    def _finish(self, outcome: str, received_data=None, error=None):
+        if self.metrics is not None:
+            self.metrics.end(self.event, outcome, received_data, error)
+
+    def _add_phase(self, phase: str, seconds: float):
+        if self.event is not None:
+            self.event.add_phase(phase, seconds)
+
+    def begin(self, timeout=None) -> float:
+        """ starts an attempt and returns its timeout, timeout (if given) can only shorten the policy's one;
+            raises CoapTimeoutError once the deadline has passed, also between retries """
+        limit = self.policy.attempt_timeout(f'{self.method.upper()} {self.uri}')
+
+        if self.metrics is not None:
+            self.event = self.metrics.begin(self.api_config.hubip, self.endpoint, self.method, self.uri,
+                                            self.payload, self._bind)
+
+        return limit if timeout is None else min(timeout, limit)
+
+    def pace(self) -> float:
+        """ takes a token of the rate limiter, returns the seconds the attempt has to wait before it is sent """
+        if self.limiter is None:
+            return 0.0
+
+        wait = self.limiter.reserve(self.api_config.hubip)
+        self._add_phase('pace', wait)
+        return wait
+
+    def failed(self, error: Exception):
+        """ handles an attempt which raised error, returns if the request can be sent again and raises otherwise """
+        self._rejected = None
+
+        if isinstance(error, (CoapTimeoutError, CoapConnectionError)):
+            outcome = CoapRequestEvent.OUTCOME_TIMEOUT if isinstance(error, CoapTimeoutError) else \
+                      CoapRequestEvent.OUTCOME_ERROR
+            self._finish(outcome, error=error)
+
+            if self.limiter is not None:
+                self.limiter.report_failure(self.api_config.hubip)
+
+            if not self.policy.can_retry(self.method, self.attempt):
+                raise error
+        elif isinstance(error, CoapError) and CoapAttempts.is_rejection(self.method, error):
+            self._finish(CoapRequestEvent.OUTCOME_REJECTED, error=error)
+            self._rejected = error
+        else:
+            self._finish(CoapRequestEvent.OUTCOME_ERROR, error=error)
+            raise error
+
+    def received(self, received_data: str):
+        """ handles the response of an attempt, returns (True, result) if the request is done and (False, None)
+            if it has to be sent again; raises if it can't """
+        self._rejected = None
+
+        if CoapAttempts.is_rejection(self.method, received_data=received_data):
+            self._rejected = CoapError(f'{self.method.upper()} {self.uri} got an empty response')
+            self._finish(CoapRequestEvent.OUTCOME_REJECTED, received_data, self._rejected)
+            return False, None
+
+        if self.limiter is not None:
+            self.limiter.report_success(self.api_config.hubip)
+
+        if not self.return_json:
+            self._finish(CoapRequestEvent.OUTCOME_OK, received_data)
+            return True, received_data
+
+        start = time.perf_counter()
+
+        try:
+            json_obj = json.loads(received_data)
+        except ValueError as e:
+            error = CoapResponseError(f'{self.method.upper()} {self.uri} returned an invalid payload: '
+                                      f'{received_data[:64]!r}')
+            self._finish(CoapRequestEvent.OUTCOME_ERROR, received_data, error)
+
+            if not self.policy.can_retry(self.method, self.attempt):
+                raise error from e
+
+            return False, None
+
+        self._add_phase('parse', time.perf_counter() - start)
+        self._finish(CoapRequestEvent.OUTCOME_OK, received_data)
+        return True, json_obj
+
+    def retry(self) -> float:
+        """ returns the seconds to wait before the next attempt, raises the error of a request which has been
+            rejected too often """
+        if self._rejected is not None:
+            # rejected requests have not been processed, so they can be sent again after slowing down
+            if self.limiter is not None:
+                self.limiter.report_failure(self.api_config.hubip)
+
+            if self.attempt == self.policy.retries:
+                raise self._rejected
+
+            delay = 0.0
+        else:
+            delay = self.policy.retry_backoff(self.attempt)
+
+        self.attempt += 1
+        return delay
 
 
 class Coap:
-    __PATH_COAP_BIN = '/usr/local/bin/coap-client'
-    __GET_TEMPLATE  = '{} -m get -u "{}" -k "{}" "{}" -B {} 2> /dev/null'
-    __PUT_TEMPLATE  = '{} -m put -u "{}" -k "{}" -e \'{}\' "{}"'
-    __TIMEOUT       = 5
+    __policy       = CoapRequestPolicy()
+    __transport    = None
+    __cache        = None
+    __rate_limiter = CoapRateLimiter()
+    __metrics      = CoapMetrics()
+    __state_filter = None
+
+    @staticmethod
+    def get_transport() -> CoapTransport:
+        """ returns the active transport, the in-process DTLS transport is preferred over coap-client """
+        if Coap.__transport is None:
+            Coap.__transport = DtlsTransport() if DtlsTransport.is_available() else CoapClientTransport()
+
+        return Coap.__transport
+
+    @staticmethod
+    def set_transport(transport: CoapTransport):
+        """ replaces the active transport, the previous one gets closed """
+        if Coap.__transport is not None and Coap.__transport is not transport:
+            Coap.__transport.close()
+
+        Coap.__transport = transport
+
+    @staticmethod
+    def get_policy() -> CoapRequestPolicy:
+        return Coap.__policy
+
+    @staticmethod
+    def set_policy(policy: CoapRequestPolicy):
+        """ replaces the timeouts, retries and hedging of all requests, None restores the defaults """
+        Coap.__policy = policy if policy is not None else CoapRequestPolicy()
+
+    @staticmethod
+    def get_cache() -> CoapCache:
+        return Coap.__cache
+
+    @staticmethod
+    def set_cache(cache: CoapCache):
+        """ enables caching of GET responses, None disables it """
+        Coap.__cache = cache
+
+    @staticmethod
+    def get_rate_limiter() -> CoapRateLimiter:
+        return Coap.__rate_limiter
+
+    @staticmethod
+    def set_rate_limiter(rate_limiter: CoapRateLimiter):
+        """ replaces the per-gateway rate limiter, None disables pacing """
+        Coap.__rate_limiter = rate_limiter
+
+    @staticmethod
+    def get_metrics() -> CoapMetrics:
+        return Coap.__metrics
+
+    @staticmethod
+    def set_metrics(metrics: CoapMetrics):
+        """ replaces the request instrumentation, None disables it """
+        Coap.__metrics = metrics
+
+    @staticmethod
+    def get_state_filter() -> CoapStateFilter:
+        return Coap.__state_filter
+
+    @staticmethod
+    def set_state_filter(state_filter: CoapStateFilter):
+        """ skips PUTs which would not change the last known state, None sends all of them """
+        Coap.__state_filter = state_filter
+
+    @staticmethod
+    def _last_known(state_filter: CoapStateFilter, api_config: Config, endpoint: TradfriEndpoint, id):
+        if state_filter.source == CoapStateFilter.SOURCE_READ:
+            return Coap.get(api_config, endpoint, id)
+
+        cache = Coap.__cache
+        return cache.get(api_config.hubip, endpoint, id) if cache is not None else None
+
+    @staticmethod
+    def _is_unchanged(state_filter: CoapStateFilter, payload, api_config: Config, endpoint: TradfriEndpoint, id):
+        """ compares a PUT with the last known state, the PUT is sent if the state can't be determined """
+        try:
+            changes = json.loads(payload)
+            current = Coap._last_known(state_filter, api_config, endpoint, id)
+
+            if endpoint != TradfriEndpoint.GROUP:
+                return CoapStateFilter.is_unchanged(changes, current)
+
+            if current is None:
+                return False
+
+            members = (Coap._last_known(state_filter, api_config, TradfriEndpoint.DEVICE, member)
+                       for member in CoapStateFilter.member_ids(current))
+
+            return CoapStateFilter.is_unchanged(changes, current, members)
+        except Exception:
+            return False
 
     @staticmethod
-    def _execute(call, return_json: bool=True):
-        if os.path.exists(Coap.__PATH_COAP_BIN):
-            result = os.popen(call)
+    def _request(policy: CoapRequestPolicy, transport: CoapTransport, method: str, uri: str, api_config: Config,
+                 payload, timeout):
+        """ sends a single attempt, a GET is hedged once it takes longer than the policy's hedge delay """
+        delay = policy.hedge_delay(api_config.hubip) if method == 'get' else None
+        start = time.perf_counter()
+
+        if delay is None or delay >= timeout:
+            received_data = transport.request(method, uri, api_config, payload, timeout)
         else:
-            sys.stderr.write('[-] libcoap: could not find libcoap.\n')
-            sys.exit(1)
+            received_data = policy.hedge(lambda: transport.request(method, uri, api_config, payload, timeout),
+                                         delay, timeout, f'{method.upper()} {uri}')
+
+        policy.record_latency(api_config.hubip, time.perf_counter() - start)
+        return received_data
+
+    @staticmethod
+    def _execute(method: str, api_config: Config, endpoint: TradfriEndpoint, id=None, payload=None,
+                 return_json: bool=True):
+        transport = Coap.get_transport()
+        uri       = Coap._build_tradri_hub(api_config.hubip, endpoint, id, transport.scheme, transport.port)
+        attempts  = CoapAttempts(method, api_config, endpoint, uri, payload, return_json, Coap.__policy,
+                                 Coap.__rate_limiter, Coap.__metrics)
 
-        received_data = result.read()
+        while True:
+            timeout = attempts.begin()
+            time.sleep(attempts.pace())
 
-        if return_json:
-            result = json.loads(received_data.strip('\n').split('\n')[-1])
+            try:
+                received_data = Coap._request(attempts.policy, transport, method, uri, api_config, payload, timeout)
+            except Exception as e:
+                attempts.failed(e)
+            else:
+                done, result = attempts.received(received_data)
 
-        return result
+                if done:
+                    return result
+
+            time.sleep(attempts.retry())
 
     @staticmethod
-    def _build_tradri_hub(hubip, endpoint: TradfriEndpoint, id=None):
-        url = f'coaps://{hubip}:5684/'
+    def _build_tradri_hub(hubip, endpoint: TradfriEndpoint, id=None, scheme: str='coaps', port: int=5684):
+        url = f'{scheme}://{hubip}:{port}/'
 
         if endpoint == TradfriEndpoint.DEVICE:
             url += '15001'
         elif endpoint == TradfriEndpoint.GROUP:
             url += '15004'
+        elif endpoint == TradfriEndpoint.SCENE:
+            url += '15005'
 
         if id is not None:
             url += f'/{id}'
@@ -43,14 +304,64 @@ class Coap:
 
     @staticmethod
     def put(payload, api_config: Config, endpoint: TradfriEndpoint, id=None, return_json: bool=True):
-        call = Coap.__PUT_TEMPLATE.format(Coap.__PATH_COAP_BIN, api_config.apiuser, api_config.apikey, payload,
-                                          Coap._build_tradri_hub(api_config.hubip, endpoint, id))
+        cache        = Coap.__cache
+        state_filter = active_state_filter() or Coap.__state_filter
+
+        if state_filter is not None:
+            skipped = Coap._is_unchanged(state_filter, payload, api_config, endpoint, id)
+            state_filter.count(skipped)
+
+            if skipped:
+                return None if return_json else ''
+
+        try:
+            return Coap._execute('put', api_config, endpoint, id, payload, return_json)
+        finally:
+            # also a failed PUT might have changed the state
+            if cache is not None:
+                cache.invalidate(api_config.hubip, endpoint, id)
+
+    @staticmethod
+    def post(payload, api_config: Config, endpoint: TradfriEndpoint, id=None, return_json: bool=True):
+        """ creates a resource below endpoint/id (e.g. a scene) """
+        cache = Coap.__cache
 
-        return Coap._execute(call, return_json)
+        try:
+            return Coap._execute('post', api_config, endpoint, id, payload, return_json)
+        finally:
+            if cache is not None:
+                cache.invalidate(api_config.hubip, endpoint, id)
 
     @staticmethod
     def get(api_config: Config, endpoint: TradfriEndpoint, id=None):
-        call = Coap.__GET_TEMPLATE.format(Coap.__PATH_COAP_BIN, api_config.apiuser, api_config.apikey,
-                                          Coap._build_tradri_hub(api_config.hubip, endpoint, id),
-                                          Coap.__TIMEOUT)
-        return Coap._execute(call)
+        cache = Coap.__cache
+
+        if cache is not None:
+            json_obj = cache.get(api_config.hubip, endpoint, id)
+
+            if json_obj is not None:
+                return json_obj
+
+        json_obj = Coap._execute('get', api_config, endpoint, id)
+
+        if cache is not None:
+            cache.set(api_config.hubip, endpoint, id, json_obj)
+
+        return json_obj
+
+    @staticmethod
+    def observe(api_config: Config, endpoint: TradfriEndpoint, id=None, callback=None, timeout=None) -> CoapObservation:
+        """ subscribes to a resource, callback(json) is called with the decoded state on every notification """
+        def on_payload(payload):
+            try:
+                json_obj = json.loads(payload)
+            except ValueError:
+                return
+
+            callback(json_obj)
+
+        transport = Coap.get_transport()
+        uri       = Coap._build_tradri_hub(api_config.hubip, endpoint, id, transport.scheme, transport.port)
+
+        return transport.observe(uri, api_config, on_payload,
+                                 timeout if timeout is not None else Coap.__policy.attempt_timeout(f'GET {uri}'))
@@ -0,0 +1,150 @@
+import time
+import threading
+
+from collections import OrderedDict
+
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_schema import TradfriKey
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits          = 0
+        self.misses        = 0
+        self.expirations   = 0
+        self.evictions     = 0
+        self.invalidations = 0
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self):
+        return {
+            'hits':          self.hits,
+            'misses':        self.misses,
+            'expirations':   self.expirations,
+            'evictions':     self.evictions,
+            'invalidations': self.invalidations,
+            'hit_ratio':     round(self.hit_ratio, 4),
+        }
+
+
+class CoapCache:
+    """ bounded LRU cache of decoded GET responses keyed by gateway, endpoint and id with per-endpoint TTLs,
+        cached values are shared and must not be modified by the caller """
+    DEFAULT_TTL      = 2
+    DEFAULT_MAX_SIZE = 1024
+
+    def __init__(self, ttls: dict=None, default_ttl: float=None, max_size: int=None):
+        self.ttls        = dict(ttls or {})
+        self.default_ttl = default_ttl if default_ttl is not None else CoapCache.DEFAULT_TTL
+        self.max_size    = max_size if max_size is not None else CoapCache.DEFAULT_MAX_SIZE
+
+        self._entries = OrderedDict()
+        self._lock    = threading.Lock()
+        self._stats   = {}
+
+    def ttl(self, endpoint: TradfriEndpoint):
+        return self.ttls.get(endpoint, self.default_ttl)
+
+    def stats(self, endpoint: TradfriEndpoint=None) -> CacheStats:
+        """ returns the statistics of an endpoint or the sum of all endpoints """
+        if endpoint is not None:
+            return self._stats.setdefault(endpoint, CacheStats())
+
+        total = CacheStats()
+
+        for stats in list(self._stats.values()):
+            for name, value in vars(stats).items():
+                setattr(total, name, getattr(total, name) + value)
+
+        return total
+
+    def get(self, hubip, endpoint: TradfriEndpoint, id=None):
+        """ returns the cached value or None if it is missing or expired """
+        key   = CoapCache._key(hubip, endpoint, id)
+        stats = self.stats(endpoint)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                stats.misses += 1
+                return None
+
+            expires, value = entry
+
+            if expires < time.monotonic():
+                del self._entries[key]
+                stats.expirations += 1
+                stats.misses      += 1
+                return None
+
+            self._entries.move_to_end(key)
+            stats.hits += 1
+
+        return value
+
+    def set(self, hubip, endpoint: TradfriEndpoint, id, value):
+        ttl = self.ttl(endpoint)
+
+        if ttl <= 0:
+            return
+
+        key = CoapCache._key(hubip, endpoint, id)
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self.stats(evicted[1]).evictions += 1
+
+    def invalidate(self, hubip, endpoint: TradfriEndpoint, id=None):
+        """ drops all entries a PUT to the resource affects: the resource itself, the members of a group (all
+            devices of the gateway if the group is not cached) and the cached groups containing a device (their
+            state is derived from the members) """
+        with self._lock:
+            keys = {CoapCache._key(hubip, endpoint, id)}
+
+            if endpoint == TradfriEndpoint.GROUP:
+                members = self._group_members(hubip, id)
+
+                if members is None:
+                    keys.update(key for key in self._entries if key[0] == hubip and key[1] == TradfriEndpoint.DEVICE)
+                else:
+                    keys.update(CoapCache._key(hubip, TradfriEndpoint.DEVICE, device_id) for device_id in members)
+            elif endpoint == TradfriEndpoint.DEVICE:
+                keys.update(key for key in list(self._entries)
+                            if key[0] == hubip and key[1] == TradfriEndpoint.GROUP and key[2] is not None and
+                            str(id) in (self._group_members(hubip, key[2]) or ()))
+
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.stats(key[1]).invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _key(hubip, endpoint: TradfriEndpoint, id):
+        # ids are passed as int (from the id lists) as well as str (from the command line)
+        return hubip, endpoint, None if id is None else str(id)
+
+    def _group_members(self, hubip, id):
+        """ returns the member ids of a cached group, None if the members are not known """
+        entry = self._entries.get(CoapCache._key(hubip, TradfriEndpoint.GROUP, id))
+
+        try:
+            members = entry[1][TradfriKey.GROUP_MEMBERS][TradfriKey.GROUP_MEMBERS_ENDPOINT][TradfriKey.INSTANCE_ID]
+        except (TypeError, KeyError):
+            return None
+
+        return [str(member) for member in members]
+
+    def __len__(self):
+        return len(self._entries)
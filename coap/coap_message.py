@@ -0,0 +1,229 @@
+import struct
+
+
+class CoapMessage:
+    """ minimal RFC 7252 CoAP message encoder/decoder used by the in-process transports """
+    VERSION = 1
+
+    TYPE_CON = 0
+    TYPE_NON = 1
+    TYPE_ACK = 2
+    TYPE_RST = 3
+
+    CODE_EMPTY  = 0x00
+    CODE_GET    = 0x01
+    CODE_POST   = 0x02
+    CODE_PUT    = 0x03
+    CODE_DELETE = 0x04
+
+    CODE_CREATED = 0x41
+    CODE_DELETED = 0x42
+    CODE_VALID   = 0x43
+    CODE_CHANGED = 0x44
+    CODE_CONTENT = 0x45
+
+    CODE_BAD_REQUEST        = 0x80
+    CODE_UNAUTHORIZED       = 0x81
+    CODE_NOT_FOUND          = 0x84
+    CODE_METHOD_NOT_ALLOWED = 0x85
+    CODE_TOO_MANY_REQUESTS  = 0x9d
+
+    CODE_INTERNAL_ERROR      = 0xa0
+    CODE_SERVICE_UNAVAILABLE = 0xa3
+
+    OPTION_OBSERVE        = 6
+    OPTION_URI_PATH       = 11
+    OPTION_CONTENT_FORMAT = 12
+    OPTION_MAX_AGE        = 14
+    OPTION_URI_QUERY      = 15
+    OPTION_BLOCK2         = 23
+
+    METHODS = {'get': CODE_GET, 'post': CODE_POST, 'put': CODE_PUT, 'delete': CODE_DELETE}
+
+    __PAYLOAD_MARKER = 0xff
+
+    def __init__(self, type=TYPE_CON, code=CODE_EMPTY, message_id=0, token=b'', options=None, payload=b''):
+        self.type       = type
+        self.code       = code
+        self.message_id = message_id
+        self.token      = token
+        self.options    = options if options is not None else []
+        self.payload    = payload
+
+    @property
+    def is_request(self):
+        return 0x01 <= self.code <= 0x1f
+
+    @property
+    def is_response(self):
+        return self.code >= 0x40
+
+    @property
+    def is_success(self):
+        return 0x40 <= self.code < 0x80
+
+    @property
+    def code_string(self):
+        return f'{self.code >> 5}.{self.code & 0x1f:02d}'
+
+    def add_option(self, number, value):
+        self.options.append((number, value))
+
+    def get_options(self, number):
+        return [value for option, value in self.options if option == number]
+
+    def get_option(self, number, default=None):
+        values = self.get_options(number)
+        return values[0] if values else default
+
+    @property
+    def uri_path(self):
+        return '/'.join(value.decode('utf-8') for value in self.get_options(CoapMessage.OPTION_URI_PATH))
+
+    @uri_path.setter
+    def uri_path(self, path):
+        self.options = [(option, value) for option, value in self.options if option != CoapMessage.OPTION_URI_PATH]
+
+        for segment in path.strip('/').split('/'):
+            if segment:
+                self.add_option(CoapMessage.OPTION_URI_PATH, segment.encode('utf-8'))
+
+    @property
+    def observe(self):
+        value = self.get_option(CoapMessage.OPTION_OBSERVE)
+        return None if value is None else CoapMessage.decode_uint(value)
+
+    @property
+    def max_age(self):
+        value = self.get_option(CoapMessage.OPTION_MAX_AGE)
+        return 60 if value is None else CoapMessage.decode_uint(value)
+
+    @property
+    def block2(self):
+        """ returns (block number, more flag, block size) or None """
+        value = self.get_option(CoapMessage.OPTION_BLOCK2)
+
+        if value is None:
+            return None
+
+        raw = CoapMessage.decode_uint(value)
+        return raw >> 4, bool(raw & 0x08), 2 ** ((raw & 0x07) + 4)
+
+    @staticmethod
+    def encode_block2(number, more, size):
+        szx = max(0, min(6, size.bit_length() - 5))
+        return CoapMessage.encode_uint((number << 4) | (int(more) << 3) | szx)
+
+    @staticmethod
+    def encode_uint(value: int):
+        if value == 0:
+            return b''
+        return value.to_bytes((value.bit_length() + 7) // 8, 'big')
+
+    @staticmethod
+    def decode_uint(value: bytes):
+        return int.from_bytes(value, 'big')
+
+    @staticmethod
+    def _encode_option_nibble(value):
+        if value < 13:
+            return value, b''
+        elif value < 269:
+            return 13, bytes([value - 13])
+        else:
+            return 14, struct.pack('!H', value - 269)
+
+    def encode(self):
+        """ serializes the message into its wire format """
+        if len(self.token) > 8:
+            raise ValueError('CoAP token must not be longer than 8 bytes')
+
+        data = bytearray(struct.pack('!BBH', (CoapMessage.VERSION << 6) | (self.type << 4) | len(self.token),
+                                     self.code, self.message_id))
+        data += self.token
+
+        last_number = 0
+
+        # options have to be sent in ascending order, the order of equal numbers is preserved
+        for number, value in sorted(self.options, key=lambda option: option[0]):
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+
+            delta, delta_ext   = CoapMessage._encode_option_nibble(number - last_number)
+            length, length_ext = CoapMessage._encode_option_nibble(len(value))
+
+            data.append((delta << 4) | length)
+            data += delta_ext
+            data += length_ext
+            data += value
+
+            last_number = number
+
+        if self.payload:
+            payload = self.payload.encode('utf-8') if isinstance(self.payload, str) else self.payload
+
+            data.append(CoapMessage.__PAYLOAD_MARKER)
+            data += payload
+
+        return bytes(data)
+
+    @staticmethod
+    def decode(data: bytes):
+        """ parses a datagram into a CoapMessage, raises ValueError on malformed input """
+        if len(data) < 4:
+            raise ValueError('CoAP message too short')
+
+        first, code, message_id = struct.unpack('!BBH', data[:4])
+
+        if first >> 6 != CoapMessage.VERSION:
+            raise ValueError('unsupported CoAP version')
+
+        token_length = first & 0x0f
+
+        if token_length > 8:
+            raise ValueError('invalid CoAP token length')
+
+        position = 4 + token_length
+        token    = bytes(data[4:position])
+        options  = []
+        number   = 0
+        payload  = b''
+
+        while position < len(data):
+            header = data[position]
+            position += 1
+
+            if header == CoapMessage.__PAYLOAD_MARKER:
+                payload = bytes(data[position:])
+                break
+
+            delta  = header >> 4
+            length = header & 0x0f
+
+            if delta == 13:
+                delta = data[position] + 13
+                position += 1
+            elif delta == 14:
+                delta = struct.unpack('!H', data[position:position + 2])[0] + 269
+                position += 2
+            elif delta == 15:
+                raise ValueError('invalid CoAP option delta')
+
+            if length == 13:
+                length = data[position] + 13
+                position += 1
+            elif length == 14:
+                length = struct.unpack('!H', data[position:position + 2])[0] + 269
+                position += 2
+            elif length == 15:
+                raise ValueError('invalid CoAP option length')
+
+            number += delta
+            options.append((number, bytes(data[position:position + length])))
+            position += length
+
+        return CoapMessage((first >> 4) & 0x03, code, message_id, token, options, payload)
+
+    def __repr__(self):
+        return f'CoapMessage(type={self.type}, code={self.code_string}, mid={self.message_id}, ' \
+               f'token={self.token.hex()}, path={self.uri_path!r}, payload={len(self.payload)} bytes)'
@@ -0,0 +1,243 @@
+import json
+import time
+import threading
+
+from tradfri.tradfri_endpoint import TradfriEndpoint
+
+_active = threading.local()
+
+
+def record_phase(phase: str, seconds: float):
+    """ adds the duration of a phase (spawn, handshake, wait, ...) to the request running on this thread,
+        called by the transports; does nothing if metrics are disabled """
+    event = getattr(_active, 'event', None)
+
+    if event is not None:
+        event.add_phase(phase, seconds)
+
+
+class Histogram:
+    """ cumulative histogram in the Prometheus layout, the buckets are upper bounds in seconds """
+    DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets if buckets is not None else Histogram.DEFAULT_BUCKETS)
+        self.counts  = [0] * len(self.buckets)
+        self.count   = 0
+        self.sum     = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum   += value
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def cumulative(self):
+        """ returns [(upper bound, count of values <= bound)] including +Inf """
+        result, total = [], 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+
+        result.append((float('inf'), self.count))
+        return result
+
+    def as_dict(self):
+        buckets = {('+Inf' if bound == float('inf') else f'{bound:g}'): count for bound, count in self.cumulative()}
+        return {'count': self.count, 'sum': round(self.sum, 6), 'buckets': buckets}
+
+
+class CoapRequestEvent:
+    """ a single request (one attempt, retried requests are separate events) as passed to the hooks """
+    OUTCOME_OK       = 'ok'
+    OUTCOME_ERROR    = 'error'
+    OUTCOME_TIMEOUT  = 'timeout'
+    OUTCOME_REJECTED = 'rejected'
+
+    def __init__(self, hubip, endpoint: TradfriEndpoint, method: str, uri: str, payload=None):
+        self.hubip     = hubip
+        self.endpoint  = endpoint
+        self.method    = method
+        self.uri       = uri
+        self.start     = time.time()
+        self.duration  = None
+        self.phases    = {}
+        self.bytes_out = len(payload.encode('utf-8') if isinstance(payload, str) else payload or b'')
+        self.bytes_in  = 0
+        self.outcome   = None
+        self.error     = None
+
+        self._started = time.perf_counter()
+
+    def add_phase(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def as_dict(self):
+        return {
+            'hubip':     self.hubip,
+            'endpoint':  _endpoint_label(self.endpoint),
+            'method':    self.method,
+            'uri':       self.uri,
+            'start':     self.start,
+            'duration':  self.duration,
+            'phases':    dict(self.phases),
+            'bytes_out': self.bytes_out,
+            'bytes_in':  self.bytes_in,
+            'outcome':   self.outcome,
+            'error':     None if self.error is None else str(self.error),
+        }
+
+
+def _endpoint_label(endpoint):
+    return endpoint.name.lower() if isinstance(endpoint, TradfriEndpoint) else str(endpoint)
+
+
+class _RequestStats:
+    def __init__(self, buckets):
+        self.latency   = Histogram(buckets)
+        self.outcomes  = {}
+        self.bytes_out = 0
+        self.bytes_in  = 0
+
+
+class CoapMetrics:
+    """ request level instrumentation of Coap: latency histograms per endpoint and method, outcome counters,
+        bytes in/out and the duration of the request phases (pace, spawn, handshake, wait, parse) """
+    def __init__(self, buckets=None):
+        self.buckets = buckets
+
+        self._lock     = threading.Lock()
+        self._requests = {}
+        self._phases   = {}
+        self._hooks    = []
+
+    def add_hook(self, hook):
+        """ registers hook(CoapRequestEvent) which is called after every request, e.g. to feed a tracer """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def begin(self, hubip, endpoint: TradfriEndpoint, method: str, uri: str, payload=None, bind: bool=True):
+        """ starts a request event, bound events collect the phases the transport records on this thread """
+        event = CoapRequestEvent(hubip, endpoint, method, uri, payload)
+
+        if bind:
+            _active.event = event
+
+        return event
+
+    def end(self, event: CoapRequestEvent, outcome: str, received_data=None, error: Exception=None):
+        if getattr(_active, 'event', None) is event:
+            _active.event = None
+
+        event.duration = time.perf_counter() - event._started
+        event.outcome  = outcome
+        event.error    = error
+        event.bytes_in = len(received_data.encode('utf-8')) if isinstance(received_data, str) else \
+                         len(received_data or b'')
+
+        with self._lock:
+            key   = (_endpoint_label(event.endpoint), event.method)
+            stats = self._requests.get(key)
+
+            if stats is None:
+                stats = self._requests[key] = _RequestStats(self.buckets)
+
+            stats.latency.observe(event.duration)
+            stats.outcomes[outcome] = stats.outcomes.get(outcome, 0) + 1
+            stats.bytes_out        += event.bytes_out
+            stats.bytes_in         += event.bytes_in
+
+            for phase, seconds in event.phases.items():
+                histogram = self._phases.get(phase)
+
+                if histogram is None:
+                    histogram = self._phases[phase] = Histogram(self.buckets)
+
+                histogram.observe(seconds)
+
+        for hook in list(self._hooks):
+            try:
+                hook(event)
+            except Exception:
+                # a broken hook must not fail the request
+                pass
+
+    def reset(self):
+        with self._lock:
+            self._requests.clear()
+            self._phases.clear()
+
+    def snapshot(self):
+        """ returns all metrics as JSON serializable dict """
+        with self._lock:
+            return {
+                'requests': [{
+                    'endpoint':  endpoint,
+                    'method':    method,
+                    'outcomes':  dict(stats.outcomes),
+                    'bytes_out': stats.bytes_out,
+                    'bytes_in':  stats.bytes_in,
+                    'latency':   stats.latency.as_dict(),
+                } for (endpoint, method), stats in sorted(self._requests.items())],
+                'phases': {phase: histogram.as_dict() for phase, histogram in sorted(self._phases.items())},
+            }
+
+    def to_json(self, indent=None):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self, prefix: str='tradfri_coap'):
+        """ returns all metrics in the Prometheus text exposition format """
+        lines = []
+
+        with self._lock:
+            requests = sorted(self._requests.items())
+            phases   = sorted(self._phases.items())
+
+            lines += [f'# HELP {prefix}_request_duration_seconds duration of the requests including pacing and retransmissions',
+                      f'# TYPE {prefix}_request_duration_seconds histogram']
+
+            for (endpoint, method), stats in requests:
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                lines += _histogram_lines(f'{prefix}_request_duration_seconds', labels, stats.latency)
+
+            lines += [f'# HELP {prefix}_requests_total requests by outcome (ok, error, timeout, rejected)',
+                      f'# TYPE {prefix}_requests_total counter']
+
+            for (endpoint, method), stats in requests:
+                for outcome, count in sorted(stats.outcomes.items()):
+                    lines.append(f'{prefix}_requests_total{{endpoint="{endpoint}",method="{method}",'
+                                 f'outcome="{outcome}"}} {count}')
+
+            for name, attribute, help in (('sent_bytes_total', 'bytes_out', 'payload bytes sent'),
+                                          ('received_bytes_total', 'bytes_in', 'payload bytes received')):
+                lines += [f'# HELP {prefix}_{name} {help}', f'# TYPE {prefix}_{name} counter']
+
+                for (endpoint, method), stats in requests:
+                    lines.append(f'{prefix}_{name}{{endpoint="{endpoint}",method="{method}"}} '
+                                 f'{getattr(stats, attribute)}')
+
+            lines += [f'# HELP {prefix}_phase_duration_seconds time spent per request phase',
+                      f'# TYPE {prefix}_phase_duration_seconds histogram']
+
+            for phase, histogram in phases:
+                lines += _histogram_lines(f'{prefix}_phase_duration_seconds', f'phase="{phase}"', histogram)
+
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram):
+    lines = []
+
+    for bound, count in histogram.cumulative():
+        le = '+Inf' if bound == float('inf') else f'{bound:g}'
+        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+
+    lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6f}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
@@ -0,0 +1,175 @@
+import time
+import random
+import threading
+import contextvars
+
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from coap.coap_transport import CoapTimeoutError
+
+_deadline = contextvars.ContextVar('coap_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """ bounds all Coap requests within the block to seconds in total (retries included), the deadline follows
+        the requests onto the ParallelFetcher threads; nested deadlines can only shorten the outer one """
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    token   = _deadline.set(expires if current is None else min(current, expires))
+
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """ returns the seconds left until the active deadline, None without deadline """
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+class CoapRequestPolicy:
+    """ timeouts, retries and hedging of the Coap requests. every attempt gets timeout seconds, shortened to what
+        is left of the active deadline. idempotent requests which time out or answer an invalid payload are
+        retried after a jittered exponential backoff. with hedge_percentile a GET which takes longer than that
+        percentile of the recent latencies of its gateway gets a second request, the first response wins """
+    IDEMPOTENT_METHODS        = ('get', 'put', 'delete')
+    DEFAULT_TIMEOUT           = 5
+    DEFAULT_RETRIES           = 2
+    DEFAULT_BACKOFF           = .2
+    DEFAULT_MAX_BACKOFF       = 2.0
+    DEFAULT_HEDGE_MIN_SAMPLES = 20
+    DEFAULT_HEDGE_MIN_DELAY   = .01
+    DEFAULT_WINDOW            = 200
+    DEFAULT_HEDGE_WORKERS     = 32
+
+    def __init__(self, timeout: float=None, retries: int=None, backoff: float=None, max_backoff: float=None,
+                 hedge_percentile: float=None, hedge_min_samples: int=None, window: int=None):
+        self.timeout           = timeout if timeout is not None else CoapRequestPolicy.DEFAULT_TIMEOUT
+        self.retries           = retries if retries is not None else CoapRequestPolicy.DEFAULT_RETRIES
+        self.backoff           = backoff if backoff is not None else CoapRequestPolicy.DEFAULT_BACKOFF
+        self.max_backoff       = max_backoff if max_backoff is not None else CoapRequestPolicy.DEFAULT_MAX_BACKOFF
+        self.hedge_percentile  = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples if hedge_min_samples is not None else \
+                                 CoapRequestPolicy.DEFAULT_HEDGE_MIN_SAMPLES
+        self.window            = window if window is not None else CoapRequestPolicy.DEFAULT_WINDOW
+
+        if self.timeout <= 0:
+            raise ValueError('timeout must be greater than 0')
+
+        if self.retries < 0:
+            raise ValueError('retries must not be negative')
+
+        if hedge_percentile is not None and not 0 < hedge_percentile < 100:
+            raise ValueError('hedge_percentile can only be between 0 and 100')
+
+        self.retried = 0
+        self.hedged  = 0
+
+        self._latencies = {}
+        self._executor  = None
+        self._lock      = threading.Lock()
+
+    def attempt_timeout(self, description: str) -> float:
+        """ returns the timeout of the next attempt, raises CoapTimeoutError if the deadline has passed """
+        left = remaining()
+
+        if left is None:
+            return self.timeout
+
+        if left <= 0:
+            raise CoapTimeoutError(f'{description} exceeded the deadline')
+
+        return min(self.timeout, left)
+
+    def can_retry(self, method: str, attempt: int) -> bool:
+        return method in CoapRequestPolicy.IDEMPOTENT_METHODS and attempt < self.retries
+
+    def retry_delay(self, attempt: int) -> float:
+        """ full jitter: a random delay up to backoff * 2^attempt, so retrying clients do not synchronise """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def retry_backoff(self, attempt: int) -> float:
+        """ counts a retry and returns its backoff, at most the time left until the deadline """
+        delay = self.retry_delay(attempt)
+        left  = remaining()
+
+        with self._lock:
+            self.retried += 1
+
+        return delay if left is None else max(0, min(delay, left))
+
+    def wait_before_retry(self, attempt: int):
+        time.sleep(self.retry_backoff(attempt))
+
+    def record_latency(self, hubip, seconds: float):
+        with self._lock:
+            latencies = self._latencies.get(hubip)
+
+            if latencies is None:
+                latencies = self._latencies[hubip] = deque(maxlen=self.window)
+
+            latencies.append(seconds)
+
+    def hedge_delay(self, hubip):
+        """ returns the latency percentile of the gateway after which a GET is hedged, None if hedging is off
+            or there are not enough samples yet """
+        if self.hedge_percentile is None:
+            return None
+
+        with self._lock:
+            latencies = sorted(self._latencies.get(hubip, ()))
+
+        if len(latencies) < self.hedge_min_samples:
+            return None
+
+        index = min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))
+        return max(CoapRequestPolicy.DEFAULT_HEDGE_MIN_DELAY, latencies[index])
+
+    def count_hedge(self):
+        with self._lock:
+            self.hedged += 1
+
+    def hedge(self, request, delay: float, timeout: float, description: str):
+        """ runs request(), starts it a second time if there is no response after delay seconds and returns
+            the first successful response; the error of the last request is raised if both fail """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=CoapRequestPolicy.DEFAULT_HEDGE_WORKERS,
+                                                    thread_name_prefix='coap-hedge')
+            executor = self._executor
+
+        expires = time.monotonic() + timeout
+        pending = {executor.submit(request)}
+        done, _ = wait(pending, delay)
+
+        if not done:
+            self.count_hedge()
+            pending.add(executor.submit(request))
+
+        error = None
+
+        while pending:
+            done, pending = wait(pending, max(0, expires - time.monotonic()), return_when=FIRST_COMPLETED)
+
+            if not done:
+                raise CoapTimeoutError(f'{description} timed out after {timeout}s')
+
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+
+                error = future.exception()
+
+        raise error
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,75 @@
+import time
+import threading
+
+
+class _Bucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate    = rate
+        self.tokens  = burst
+        self.updated = time.monotonic()
+
+
+class CoapRateLimiter:
+    """ adaptive per-gateway token bucket: the rate is halved when the gateway rejects a request, times out or
+        answers empty (flood protection) and recovers additively with every successful request """
+    DEFAULT_RATE     = 10.0
+    DEFAULT_MIN_RATE = .5
+    DEFAULT_MAX_RATE = 25.0
+    DEFAULT_BURST    = 4
+    DEFAULT_RECOVERY = .25
+    DEFAULT_BACKOFF  = .5
+
+    def __init__(self, rate: float=None, min_rate: float=None, max_rate: float=None, burst: float=None,
+                 recovery: float=None, backoff: float=None):
+        self.initial_rate = rate if rate is not None else CoapRateLimiter.DEFAULT_RATE
+        self.min_rate     = min_rate if min_rate is not None else CoapRateLimiter.DEFAULT_MIN_RATE
+        self.max_rate     = max_rate if max_rate is not None else CoapRateLimiter.DEFAULT_MAX_RATE
+        self.burst        = burst if burst is not None else CoapRateLimiter.DEFAULT_BURST
+        self.recovery     = recovery if recovery is not None else CoapRateLimiter.DEFAULT_RECOVERY
+        self.backoff      = backoff if backoff is not None else CoapRateLimiter.DEFAULT_BACKOFF
+
+        self._buckets = {}
+        self._lock    = threading.Lock()
+
+    def _bucket(self, hubip):
+        bucket = self._buckets.get(hubip)
+
+        if bucket is None:
+            bucket = self._buckets[hubip] = _Bucket(self.initial_rate, self.burst)
+
+        return bucket
+
+    def rate(self, hubip):
+        with self._lock:
+            return self._bucket(hubip).rate
+
+    def reserve(self, hubip):
+        """ takes a token and returns how many seconds the caller has to wait before sending """
+        with self._lock:
+            bucket = self._bucket(hubip)
+            now    = time.monotonic()
+
+            bucket.tokens   = min(self.burst, bucket.tokens + (now - bucket.updated) * bucket.rate)
+            bucket.updated  = now
+            bucket.tokens  -= 1
+
+            # a negative balance queues the caller behind the ones which are already waiting
+            return 0.0 if bucket.tokens >= 0 else -bucket.tokens / bucket.rate
+
+    def acquire(self, hubip):
+        wait = self.reserve(hubip)
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def report_success(self, hubip):
+        with self._lock:
+            bucket      = self._bucket(hubip)
+            bucket.rate = min(self.max_rate, bucket.rate + self.recovery)
+
+    def report_failure(self, hubip):
+        """ slows down after a rejection, timeout or empty response, the burst credit is dropped as well """
+        with self._lock:
+            bucket        = self._bucket(hubip)
+            bucket.rate   = max(self.min_rate, bucket.rate * self.backoff)
+            bucket.tokens = min(bucket.tokens, 0)
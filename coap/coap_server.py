@@ -0,0 +1,260 @@
+import json
+import socket
+import threading
+
+from coap.coap_message import CoapMessage
+
+
+class CoapServer:
+    """ plain UDP CoAP stand-in for the gateway, serves JSON resources for offline testing """
+    __BLOCK_SIZE   = 1024
+    __RECEIVE_SIZE = 65535
+
+    def __init__(self, host: str='127.0.0.1', port: int=0, resources: dict=None):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self._socket.settimeout(.5)
+
+        self._lock          = threading.RLock()
+        self._resources     = {}
+        self._handlers      = {}
+        self._responses     = {}
+        self._observers     = {}
+        self._notifications = {}
+        self._sequence      = 0
+        self._message_id    = 0
+        self._thread        = None
+        self._running       = False
+
+        for path, value in (resources or {}).items():
+            self.set_resource(path, value)
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    @property
+    def port(self):
+        return self.address[1]
+
+    def set_resource(self, path: str, value):
+        """ stores a JSON serializable value which is served under path """
+        with self._lock:
+            self._resources[path.strip('/')] = value
+
+        self.notify(path)
+
+    def get_resource(self, path: str):
+        with self._lock:
+            return self._resources.get(path.strip('/'))
+
+    def remove_resource(self, path: str):
+        with self._lock:
+            self._resources.pop(path.strip('/'), None)
+
+        self.notify(path)
+
+    def set_handler(self, method: str, path: str, handler):
+        """ registers handler(server, path, payload) returning (code, payload) for method and path """
+        self._handlers[(CoapMessage.METHODS[method], path.strip('/'))] = handler
+
+    def start(self):
+        self._running = True
+        self._thread  = threading.Thread(target=self.serve_forever, name='coap-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+
+        if self._thread is not None:
+            self._thread.join()
+
+        self._socket.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def serve_forever(self):
+        self._running = True
+
+        while self._running:
+            try:
+                data, address = self._socket.recvfrom(CoapServer.__RECEIVE_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            self.handle_datagram(data, address)
+
+    def send(self, message: CoapMessage, address):
+        self._socket.sendto(message.encode(), address)
+
+    def handle_datagram(self, data: bytes, address):
+        try:
+            request = CoapMessage.decode(data)
+        except ValueError:
+            return
+
+        if request.type == CoapMessage.TYPE_RST:
+            # the client is not interested in the notification anymore
+            with self._lock:
+                observer = self._notifications.pop(request.message_id, None)
+
+                if observer is not None:
+                    self._observers.get(observer[0], {}).pop(observer[1], None)
+
+            return
+
+        if not request.is_request:
+            return
+
+        # answer retransmissions with the same response instead of processing them twice
+        key = (address, request.message_id)
+
+        with self._lock:
+            cached = self._responses.get(key)
+
+        if cached is None:
+            cached = self.handle_request(request, address)
+
+            with self._lock:
+                if len(self._responses) > 1024:
+                    self._responses.clear()
+
+                self._responses[key] = cached
+
+        if cached is not None:
+            self.send(cached, address)
+
+    def handle_request(self, request: CoapMessage, address):
+        path    = request.uri_path
+        handler = self._handlers.get((request.code, path))
+
+        if handler is not None:
+            code, payload = handler(self, path, request.payload)
+        elif request.code == CoapMessage.CODE_GET:
+            code, payload = self._handle_get(path)
+        elif request.code == CoapMessage.CODE_PUT:
+            code, payload = self._handle_put(path, request.payload)
+        else:
+            code, payload = CoapMessage.CODE_METHOD_NOT_ALLOWED, b''
+
+        response = self.build_response(request, code, payload)
+
+        if request.code == CoapMessage.CODE_GET and request.observe is not None:
+            with self._lock:
+                observers = self._observers.setdefault(path, {})
+
+                if request.observe == 0 and response.is_success:
+                    self._sequence += 1
+                    observers[(address, request.token)] = True
+                    response.add_option(CoapMessage.OPTION_OBSERVE, CoapMessage.encode_uint(self._sequence))
+                else:
+                    observers.pop((address, request.token), None)
+
+        return self.split_blocks(request, response)
+
+    @staticmethod
+    def split_blocks(request: CoapMessage, response: CoapMessage):
+        """ reduces the response to the block requested by the Block2 option """
+        block2 = request.block2
+        block  = block2[0] if block2 is not None else 0
+        size   = block2[2] if block2 is not None else CoapServer.__BLOCK_SIZE
+
+        if len(response.payload) > size:
+            payload          = response.payload
+            more             = len(payload) > (block + 1) * size
+            response.payload = payload[block * size:(block + 1) * size]
+            response.add_option(CoapMessage.OPTION_BLOCK2, CoapMessage.encode_block2(block, more, size))
+
+        return response
+
+    def notify(self, path: str):
+        """ sends the current state of path to all of its observers """
+        path = path.strip('/')
+
+        with self._lock:
+            observers = list(self._observers.get(path, {}))
+
+        for address, token in observers:
+            code, payload = self._handle_get(path)
+
+            with self._lock:
+                if len(self._notifications) > 1024:
+                    self._notifications.clear()
+
+                self._sequence   += 1
+                self._message_id  = (self._message_id + 1) & 0xffff
+                sequence          = self._sequence
+                message_id        = self._message_id
+
+                self._notifications[message_id] = (path, (address, token))
+
+                if code != CoapMessage.CODE_CONTENT:
+                    # the resource is gone, the observation ends with this notification
+                    self._observers[path].pop((address, token), None)
+
+            request      = CoapMessage(CoapMessage.TYPE_NON, CoapMessage.CODE_GET, message_id, token)
+            notification = self.build_response(request, code, payload)
+
+            if code == CoapMessage.CODE_CONTENT:
+                notification.add_option(CoapMessage.OPTION_OBSERVE, CoapMessage.encode_uint(sequence))
+
+            self.send(CoapServer.split_blocks(request, notification), address)
+
+    @staticmethod
+    def build_response(request: CoapMessage, code, payload):
+        response_type = CoapMessage.TYPE_ACK if request.type == CoapMessage.TYPE_CON else CoapMessage.TYPE_NON
+        response      = CoapMessage(response_type, code, request.message_id, request.token)
+
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+
+        response.payload = payload or b''
+        return response
+
+    def _handle_get(self, path):
+        value = self.get_resource(path)
+
+        if value is None:
+            return CoapMessage.CODE_NOT_FOUND, b''
+
+        return CoapMessage.CODE_CONTENT, json.dumps(value)
+
+    def _handle_put(self, path, payload):
+        try:
+            changes = json.loads(payload.decode('utf-8'))
+        except ValueError:
+            return CoapMessage.CODE_BAD_REQUEST, b''
+
+        with self._lock:
+            value = self._resources.get(path)
+
+            if value is None:
+                return CoapMessage.CODE_NOT_FOUND, b''
+
+            CoapServer.merge(value, changes)
+
+        self.notify(path)
+        return CoapMessage.CODE_CHANGED, b''
+
+    @staticmethod
+    def merge(target, changes):
+        """ merges a TRADFRI style PUT payload into a stored resource """
+        for key, value in changes.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                CoapServer.merge(target[key], value)
+            elif isinstance(value, list) and isinstance(target.get(key), list) and \
+                 all(isinstance(entry, dict) for entry in value + target[key]):
+                for index, entry in enumerate(value):
+                    if index < len(target[key]):
+                        CoapServer.merge(target[key][index], entry)
+                    else:
+                        target[key].append(entry)
+            else:
+                target[key] = value
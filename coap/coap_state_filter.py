@@ -0,0 +1,116 @@
+import threading
+import contextvars
+
+from contextlib import contextmanager
+
+from tradfri.tradfri_schema import TradfriKey
+
+_active = contextvars.ContextVar('coap_state_filter', default=None)
+
+
+def contains(current, changes) -> bool:
+    """ returns True if the PUT payload changes would not modify current, lists of objects are compared by index
+        like the gateway merges them. keys which are unknown in current count as changes """
+    if isinstance(changes, dict):
+        if not isinstance(current, dict):
+            return False
+
+        return all(key in current and contains(current[key], value) for key, value in changes.items())
+
+    if isinstance(changes, list) and all(isinstance(entry, dict) for entry in changes):
+        if not isinstance(current, list) or len(current) < len(changes):
+            return False
+
+        return all(contains(target, entry) for target, entry in zip(current, changes))
+
+    return current == changes
+
+
+@contextmanager
+def skipping(state_filter):
+    """ uses state_filter instead of Coap's for the PUTs within the block (also on ParallelFetcher threads),
+        e.g. for a single daemon request """
+    token = _active.set(state_filter)
+
+    try:
+        yield state_filter
+    finally:
+        _active.reset(token)
+
+
+def active():
+    """ returns the state filter of the surrounding skipping block, None outside of one """
+    return _active.get()
+
+
+class CoapStateFilter:
+    """ skips PUTs which would not change the last known state of the resource. source 'cache' compares with
+        the cached state only (nothing is skipped without a cached state), source 'read' reads the resource first.
+        group commands are compared with the state of all member lights, since the state of the group resource
+        is only its last command; with 'read' the members are read (from the cache if possible) until one of them
+        differs. dimming a light which is off turns it on, so it is never skipped """
+    SOURCE_CACHE = 'cache'
+    SOURCE_READ  = 'read'
+
+    def __init__(self, source: str=None):
+        self.source = source if source is not None else CoapStateFilter.SOURCE_CACHE
+
+        if self.source not in (CoapStateFilter.SOURCE_CACHE, CoapStateFilter.SOURCE_READ):
+            raise ValueError(f'source can only be {CoapStateFilter.SOURCE_CACHE}/{CoapStateFilter.SOURCE_READ}')
+
+        self.skipped = 0
+        self.sent    = 0
+
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def member_ids(group: dict) -> list:
+        return group[TradfriKey.GROUP_MEMBERS][TradfriKey.GROUP_MEMBERS_ENDPOINT][TradfriKey.INSTANCE_ID]
+
+    @staticmethod
+    def _is_unchanged_light(light: dict, changes: dict) -> bool:
+        # a brightness without state switches a light which is off on, even if the brightness is the same
+        if TradfriKey.BRIGHTNESS in changes and TradfriKey.STATE not in changes and not light.get(TradfriKey.STATE):
+            return False
+
+        return contains(light, changes)
+
+    @staticmethod
+    def is_unchanged(changes: dict, current: dict, members=None) -> bool:
+        """ compares a device PUT with the device state or a group PUT with the member states (None if unknown).
+            members may be a generator, it is only consumed until a member differs """
+        if members is None:
+            if current is None or not contains(current, changes):
+                return False
+
+            return all(CoapStateFilter._is_unchanged_light(light, entry)
+                       for light, entry in zip(current.get(TradfriKey.LIGHT, ()), changes.get(TradfriKey.LIGHT, ())))
+
+        lights = 0
+
+        for member in members:
+            if member is None:
+                return False
+
+            # remotes and other non-lights in a group ignore group commands
+            if member.get(TradfriKey.LIGHT):
+                if not CoapStateFilter._is_unchanged_light(member[TradfriKey.LIGHT][0], changes):
+                    return False
+
+                lights += 1
+
+        return lights > 0
+
+    def count(self, skipped: bool):
+        self.add(1 if skipped else 0, 0 if skipped else 1)
+
+    def add(self, skipped: int, sent: int):
+        """ adds counts, e.g. the ones reported by the daemon for a command """
+        with self._lock:
+            self.skipped += skipped
+            self.sent    += sent
+
+    def reset(self):
+        with self._lock:
+            self.skipped = 0
+            self.sent    = 0
@@ -0,0 +1,614 @@
+import os
+import time
+import random
+import socket
+import threading
+import subprocess
+
+from contextlib import contextmanager
+
+from urllib.parse import urlsplit
+
+from config.config import Config
+from coap.coap_message import CoapMessage
+from coap.coap_metrics import record_phase
+
+try:
+    from DTLSSocket import dtls
+except ImportError:
+    # the in-process DTLS transport is optional, Coap falls back to coap-client without it
+    dtls = None
+
+
+class CoapError(Exception):
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class CoapTimeoutError(CoapError):
+    pass
+
+
+class CoapConnectionError(CoapError):
+    """ the request could not be sent, e.g. the gateway is unreachable """
+    pass
+
+
+class CoapResponseError(CoapError, ValueError):
+    """ the gateway answered with a payload which is not valid JSON """
+    pass
+
+
+class CoapObservation:
+    """ handle of a CoAP Observe registration, callback(payload) is called for every fresh notification """
+    __LAPSE_GRACE  = 10
+    __SEQUENCE_MAX = 2 ** 23
+
+    def __init__(self, uri: str, callback, cancel=None, alive=None):
+        self.uri               = uri
+        self.callback          = callback
+        self.active            = True
+        self.sequence          = None
+        self.max_age           = 60
+        self.last_notification = time.monotonic()
+        self._cancel           = cancel
+        self._alive            = alive
+
+    @property
+    def lapsed(self):
+        """ true if the registration has been cancelled, lost or not refreshed within its max-age """
+        if not self.active or (self._alive is not None and not self._alive()):
+            return True
+
+        return time.monotonic() > self.last_notification + self.max_age + CoapObservation.__LAPSE_GRACE
+
+    def _is_newer(self, sequence, now):
+        # RFC 7641 section 3.4, sequence numbers wrap around after 24 bits
+        if self.sequence is None or now > self.last_notification + 128:
+            return True
+
+        return (self.sequence < sequence and sequence - self.sequence < CoapObservation.__SEQUENCE_MAX) or \
+               (self.sequence > sequence and self.sequence - sequence > CoapObservation.__SEQUENCE_MAX)
+
+    def notify(self, payload: str, sequence: int=None, max_age: int=None):
+        now = time.monotonic()
+
+        if sequence is not None:
+            if not self._is_newer(sequence, now):
+                # reordered notification, a newer state has already been delivered
+                return
+
+            self.sequence = sequence
+
+        if max_age is not None:
+            self.max_age = max_age
+
+        self.last_notification = now
+        self.callback(payload)
+
+    def cancel(self):
+        self.active = False
+
+        if self._cancel is not None:
+            self._cancel()
+
+
+class CoapTransport:
+    """ base class of all transports which are able to carry a single CoAP request to the gateway """
+    scheme = 'coaps'
+    port   = 5684
+
+    def request(self, method: str, uri: str, api_config: Config, payload=None, timeout=None):
+        """ sends a request and returns the response payload as string """
+        raise NotImplementedError()
+
+    def observe(self, uri: str, api_config: Config, callback, timeout=None) -> CoapObservation:
+        """ registers a CoAP Observe subscription for uri, callback(payload) is called for every notification """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class CoapClientTransport(CoapTransport):
+    """ transport which spawns libcoap's coap-client for every request (one DTLS handshake per call) """
+    __PATH_COAP_BIN    = '/usr/local/bin/coap-client'
+    __OBSERVE_DURATION = 600
+
+    def __init__(self, path: str=None):
+        self.path = path if path is not None else CoapClientTransport.__PATH_COAP_BIN
+
+    def is_available(self):
+        return os.path.exists(self.path)
+
+    def request(self, method: str, uri: str, api_config: Config, payload=None, timeout=None):
+        if not self.is_available():
+            raise CoapError(f'could not find libcoap ({self.path})')
+
+        call = [self.path, '-m', method, '-u', api_config.apiuser, '-k', api_config.apikey]
+
+        if payload is not None:
+            call += ['-e', payload]
+
+        if timeout is not None:
+            call += ['-B', str(int(timeout))]
+
+        call.append(uri)
+
+        start = time.perf_counter()
+
+        with subprocess.Popen(call, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+            spawned = time.perf_counter()
+            record_phase('spawn', spawned - start)
+
+            try:
+                # give coap-client a little more time than its own -B timeout before it gets killed
+                stdout, _ = process.communicate(timeout=None if timeout is None else timeout + 1)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                raise CoapTimeoutError(f'{method.upper()} {uri} timed out')
+            finally:
+                # coap-client does the DTLS handshake itself, so it is part of the wait
+                record_phase('wait', time.perf_counter() - spawned)
+
+        received_data = stdout.decode('utf-8', 'replace').strip('\n')
+
+        # coap-client prints some status lines before the actual payload
+        return received_data.split('\n')[-1]
+
+    def observe(self, uri: str, api_config: Config, callback, timeout=None) -> CoapObservation:
+        if not self.is_available():
+            raise CoapError(f'could not find libcoap ({self.path})')
+
+        duration = str(CoapClientTransport.__OBSERVE_DURATION)
+        process  = subprocess.Popen([self.path, '-m', 'get', '-s', duration, '-B', duration,
+                                     '-u', api_config.apiuser, '-k', api_config.apikey, uri],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        observation         = CoapObservation(uri, callback, process.terminate, lambda: process.poll() is None)
+        observation.max_age = CoapClientTransport.__OBSERVE_DURATION
+
+        def read_notifications():
+            # every notification is printed as payload line, the status lines are skipped
+            for line in process.stdout:
+                line = line.decode('utf-8', 'replace').strip()
+
+                if line.startswith('{') or line.startswith('['):
+                    observation.notify(line)
+
+            observation.active = False
+
+        threading.Thread(target=read_notifications, name=f'coap-observe-{uri}', daemon=True).start()
+        return observation
+
+
+class _PendingRequest:
+    def __init__(self):
+        self.event        = threading.Event()
+        self.acknowledged = False
+        self.response     = None
+
+
+class CoapSession:
+    """ a CoAP endpoint bound to a single gateway which is reused for all requests """
+    __ACK_TIMEOUT       = 2.0
+    __ACK_RANDOM_FACTOR = 1.5
+    __DEFAULT_TIMEOUT   = 5
+    __RECEIVE_SIZE      = 65535
+    __POLL_INTERVAL     = .5
+
+    def __init__(self, host: str, port: int):
+        self.host    = host
+        self.port    = port
+        self.closed  = False
+        self.retired = False
+
+        self._socket = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.settimeout(CoapSession.__POLL_INTERVAL)
+        self._socket.connect((host, port))
+
+        self._lock         = threading.Lock()
+        self._in_flight    = 0
+        self._pending      = {}
+        self._observations = {}
+        self._message_id   = random.randint(0, 0xffff)
+        self._receiver     = threading.Thread(target=self._receive_loop, name=f'coap-{host}:{port}', daemon=True)
+
+    def open(self, timeout=None):
+        self._receiver.start()
+
+    def close(self):
+        self.closed = True
+        self._socket.close()
+
+    def retire(self):
+        """ closes the session once the requests which are using it are done, new requests have to use
+            another session """
+        with self._lock:
+            self.retired = True
+            idle         = self._in_flight == 0
+
+        if idle:
+            self.close()
+
+    @contextmanager
+    def _using(self):
+        with self._lock:
+            self._in_flight += 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                idle = self.retired and self._in_flight == 0
+
+            if idle:
+                self.close()
+
+    def _next_message_id(self):
+        with self._lock:
+            self._message_id = (self._message_id + 1) & 0xffff
+            return self._message_id
+
+    def _new_token(self):
+        while True:
+            token = os.urandom(4)
+
+            if token not in self._pending and token not in self._observations:
+                return token
+
+    def _send_datagram(self, data: bytes):
+        self._socket.send(data)
+
+    def _receive_datagram(self, data: bytes):
+        self._handle_message(data)
+
+    def _receive_loop(self):
+        while not self.closed:
+            try:
+                data = self._socket.recv(CoapSession.__RECEIVE_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                # socket has been closed or the gateway is unreachable (ICMP), pending requests run into timeout
+                if self.closed:
+                    break
+                continue
+
+            self._receive_datagram(data)
+
+    def _handle_message(self, data: bytes):
+        try:
+            message = CoapMessage.decode(data)
+        except ValueError:
+            return
+
+        known = message.token in self._pending or message.token in self._observations
+
+        if message.is_response and not known:
+            # notification of a cancelled observation, a reset deregisters it at the gateway
+            self._send_datagram(CoapMessage(CoapMessage.TYPE_RST, CoapMessage.CODE_EMPTY, message.message_id).encode())
+            return
+
+        if message.type == CoapMessage.TYPE_CON:
+            # confirmable responses (separate responses and notifications) have to be acknowledged
+            self._send_datagram(CoapMessage(CoapMessage.TYPE_ACK, CoapMessage.CODE_EMPTY, message.message_id).encode())
+
+        self._dispatch(message)
+
+    def _dispatch(self, message: CoapMessage):
+        pending = self._pending.get(message.token)
+
+        if pending is None:
+            observer = self._observations.get(message.token)
+
+            if observer is not None and message.is_response:
+                observer(message)
+
+            return
+
+        if message.type == CoapMessage.TYPE_ACK and message.code == CoapMessage.CODE_EMPTY:
+            # the gateway acknowledged the request and will send the response separately
+            pending.acknowledged = True
+        else:
+            pending.response = message
+            pending.event.set()
+
+    def _exchange(self, message: CoapMessage, timeout):
+        """ sends a single confirmable request and waits for its response """
+        pending = _PendingRequest()
+        self._pending[message.token] = pending
+
+        data           = message.encode()
+        retransmission = CoapSession.__ACK_TIMEOUT * random.uniform(1, CoapSession.__ACK_RANDOM_FACTOR)
+        remaining      = timeout
+
+        try:
+            self._send_datagram(data)
+
+            while remaining > 0:
+                wait = remaining if pending.acknowledged else min(retransmission, remaining)
+
+                if pending.event.wait(wait):
+                    return pending.response
+
+                remaining -= wait
+
+                if not pending.acknowledged:
+                    retransmission *= 2
+                    self._send_datagram(data)
+        except OSError as e:
+            # e.g. the gateway is unreachable (ICMP) or the session has been closed
+            raise CoapConnectionError(f'could not send {message.uri_path} to {self.host}:{self.port}: {e}') from e
+        finally:
+            del self._pending[message.token]
+
+        raise CoapTimeoutError(f'no response from {self.host}:{self.port} for {message.uri_path}')
+
+    def request(self, method: str, path: str, payload=None, timeout=None, options=None):
+        """ sends a request, follows Block2 transfers and returns the final response message """
+        with self._using():
+            return self._request(method, path, payload, timeout, options)
+
+    def _request(self, method: str, path: str, payload=None, timeout=None, options=None):
+        timeout = timeout if timeout is not None else CoapSession.__DEFAULT_TIMEOUT
+        body    = b''
+        block   = 0
+
+        while True:
+            message = CoapMessage(CoapMessage.TYPE_CON, CoapMessage.METHODS[method], self._next_message_id(),
+                                  self._new_token(), list(options or []), payload or b'')
+            message.uri_path = path
+
+            if block > 0:
+                message.add_option(CoapMessage.OPTION_BLOCK2, CoapMessage.encode_block2(block, False, size))
+
+            response = self._exchange(message, timeout)
+            body    += response.payload
+            block2   = response.block2
+
+            if block2 is None or not block2[1] or not response.is_success:
+                response.payload = body
+                return response
+
+            block = block2[0] + 1
+            size  = block2[2]
+
+
+    def observe(self, path: str, callback, timeout=None):
+        """ registers an observation, callback(message) is called on the receiver thread for every
+            notification; returns the token and the initial response """
+        token = self._new_token()
+        self._observations[token] = callback
+
+        message = CoapMessage(CoapMessage.TYPE_CON, CoapMessage.CODE_GET, self._next_message_id(), token,
+                              [(CoapMessage.OPTION_OBSERVE, b'')])
+        message.uri_path = path
+
+        try:
+            with self._using():
+                response = self._exchange(message, timeout if timeout is not None else CoapSession.__DEFAULT_TIMEOUT)
+        except CoapError:
+            self.cancel_observation(token)
+            raise
+
+        if not response.is_success or response.observe is None:
+            # the resource can't be observed, the caller has to poll it instead
+            self.cancel_observation(token)
+
+        return token, response
+
+    def cancel_observation(self, token: bytes):
+        self._observations.pop(token, None)
+
+
+class DtlsSession(CoapSession):
+    """ CoAP session secured by a PSK DTLS association (tinydtls through the DTLSSocket module) """
+    __DTLS_EVENT_CONNECTED = 0x01de
+    __DTLS_LEVEL_FATAL     = 2
+
+    def __init__(self, host: str, port: int, identity: str, key: str):
+        super().__init__(host, port)
+
+        self._identity   = identity.encode('utf-8')
+        self._key        = key.encode('utf-8')
+        self._dtls_lock  = threading.RLock()
+        self._connected  = threading.Event()
+        self._dtls       = None
+        self._connection = None
+
+    def open(self, timeout=None):
+        self._dtls = dtls.DTLS(read=self._dtls_read, write=self._dtls_write, event=self._dtls_event,
+                               pskId=self._identity, pskStore={self._identity: self._key})
+        super().open(timeout)
+
+        with self._dtls_lock:
+            self._connection = self._dtls.connect(self.host, self.port)
+
+        if not self._connected.wait(timeout if timeout is not None else 5):
+            self.close()
+            raise CoapTimeoutError(f'DTLS handshake with {self.host}:{self.port} timed out')
+
+    def close(self):
+        if self._dtls is not None and self._connection is not None and not self.closed:
+            with self._dtls_lock:
+                try:
+                    self._dtls.close(self._connection)
+                except Exception:
+                    pass
+
+        super().close()
+
+    def _dtls_read(self, sender, data):
+        self._handle_message(data)
+        return len(data)
+
+    def _dtls_write(self, recipient, data):
+        self._socket.send(data)
+        return len(data)
+
+    def _dtls_event(self, level, code):
+        if code == DtlsSession.__DTLS_EVENT_CONNECTED:
+            self._connected.set()
+        elif level == DtlsSession.__DTLS_LEVEL_FATAL:
+            self.closed = True
+
+    def _send_datagram(self, data: bytes):
+        with self._dtls_lock:
+            self._dtls.write(self._connection, data)
+
+    def _receive_datagram(self, data: bytes):
+        with self._dtls_lock:
+            self._dtls.handleMessage(self._connection, data)
+
+
+class UdpTransport(CoapTransport):
+    """ in-process transport over plain UDP, keeps one session per gateway (e.g. for the CoapServer stand-in) """
+    scheme = 'coap'
+    port   = 5683
+
+    def __init__(self, port: int=None):
+        if port is not None:
+            self.port = port
+
+        self._sessions      = {}
+        self._sessions_lock = threading.Lock()
+        self._opening       = {}
+
+    def _create_session(self, host: str, port: int, api_config: Config):
+        return CoapSession(host, port)
+
+    @staticmethod
+    def _key(host: str, port: int, api_config: Config):
+        return host, port, api_config.apiuser
+
+    def get_session(self, host: str, port: int, api_config: Config, timeout=None):
+        key = UdpTransport._key(host, port, api_config)
+
+        with self._sessions_lock:
+            session = self._sessions.get(key)
+
+            if session is not None and not session.closed:
+                return session
+
+            # handshakes are serialized per gateway only, an unreachable gateway must not block the others
+            opening = self._opening.setdefault(key, threading.Lock())
+
+        with opening:
+            with self._sessions_lock:
+                session = self._sessions.get(key)
+
+            if session is None or session.closed:
+                start   = time.perf_counter()
+                session = self._create_session(host, port, api_config)
+                session.open(timeout)
+
+                with self._sessions_lock:
+                    self._sessions[key] = session
+
+                record_phase('handshake', time.perf_counter() - start)
+
+        return session
+
+    def _reset(self, host: str, port: int, api_config: Config, session: CoapSession):
+        """ replaces the session for the following requests, it is closed once its own requests are done """
+        key = UdpTransport._key(host, port, api_config)
+
+        with self._sessions_lock:
+            if self._sessions.get(key) is session:
+                del self._sessions[key]
+
+        session.retire()
+
+    def request(self, method: str, uri: str, api_config: Config, payload=None, timeout=None):
+        parts = urlsplit(uri)
+        port  = parts.port or self.port
+
+        try:
+            session = self.get_session(parts.hostname, port, api_config, timeout)
+        except OSError as e:
+            raise CoapConnectionError(f'{method.upper()} {uri} failed: {e}') from e
+
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+
+        start = time.perf_counter()
+
+        try:
+            response = session.request(method, parts.path, payload, timeout)
+        except CoapTimeoutError:
+            # the association might be stale (e.g. gateway reboot), the next requests start over with a new one
+            self._reset(parts.hostname, port, api_config, session)
+            raise
+        finally:
+            record_phase('wait', time.perf_counter() - start)
+
+        if not response.is_success:
+            raise CoapError(f'{method.upper()} {uri} failed with {response.code_string}', response.code)
+
+        return response.payload.decode('utf-8')
+
+    def observe(self, uri: str, api_config: Config, callback, timeout=None) -> CoapObservation:
+        parts       = urlsplit(uri)
+        session     = self.get_session(parts.hostname, parts.port or self.port, api_config, timeout)
+        observation = CoapObservation(uri, callback, alive=lambda: not session.closed)
+
+        def fetch_blocks(sequence, max_age):
+            # the notification only carried the first block, the rest is requested separately
+            try:
+                response = session.request('get', parts.path, timeout=timeout)
+            except CoapError:
+                return
+
+            observation.notify(response.payload.decode('utf-8'), sequence, max_age)
+
+        def on_notification(message: CoapMessage):
+            if not message.is_success:
+                # e.g. 4.04 after the device has been removed, the observation ends
+                observation.active = False
+                session.cancel_observation(message.token)
+            elif message.block2 is not None and message.block2[1]:
+                # the receiver thread must not block on a request
+                threading.Thread(target=fetch_blocks, args=(message.observe, message.max_age), daemon=True).start()
+            else:
+                observation.notify(message.payload.decode('utf-8'), message.observe, message.max_age)
+
+        token, response = session.observe(parts.path, on_notification, timeout)
+
+        if not response.is_success:
+            raise CoapError(f'OBSERVE {uri} failed with {response.code_string}', response.code)
+
+        observation._cancel = lambda: session.cancel_observation(token)
+
+        if response.block2 is not None and response.block2[1]:
+            response = session.request('get', parts.path, timeout=timeout)
+
+        observation.notify(response.payload.decode('utf-8'), response.observe, response.max_age)
+
+        if response.observe is None:
+            observation.active = False
+
+        return observation
+
+    def close(self):
+        with self._sessions_lock:
+            for session in self._sessions.values():
+                session.close()
+
+            self._sessions.clear()
+
+
+class DtlsTransport(UdpTransport):
+    """ in-process CoAP over DTLS transport, the handshake is only done once per gateway """
+    scheme = 'coaps'
+    port   = 5684
+
+    @staticmethod
+    def is_available():
+        return dtls is not None
+
+    def _create_session(self, host: str, port: int, api_config: Config):
+        return DtlsSession(host, port, api_config.apiuser, api_config.apikey)
@@ -0,0 +1,84 @@
+import threading
+
+from common.parallel import ParallelFetcher
+
+
+class BatchCommand:
+    """ one line of a batch: '<action> <id> <value>', error is set if the line is invalid or the command failed """
+    def __init__(self, line_number: int, text: str, action=None, id=None, value=None, error: Exception=None):
+        self.line_number = line_number
+        self.text        = text
+        self.action      = action
+        self.id          = id
+        self.value       = value
+        self.error       = error
+
+        self._done = threading.Event()
+
+    @property
+    def success(self):
+        return self.error is None
+
+
+def parse_commands(lines, actions):
+    """ parses one command per line, blank lines and lines starting with # are skipped """
+    commands = []
+
+    for line_number, line in enumerate(lines, 1):
+        text = line.strip()
+
+        if not text or text.startswith('#'):
+            continue
+
+        parts = text.split()
+
+        if len(parts) != 3:
+            commands.append(BatchCommand(line_number, text, error=ValueError('expected <action> <id> <value>')))
+        elif parts[0] not in actions:
+            commands.append(BatchCommand(line_number, text, error=ValueError(
+                'action can only be {0}'.format('/'.join(actions)))))
+        else:
+            commands.append(BatchCommand(line_number, text, *parts))
+
+    return commands
+
+
+def run_commands(commands: list, execute, max_in_flight: int=None, report=None):
+    """ runs execute(action, id, value) for all valid commands with at most max_in_flight at the same time.
+        commands for the same id keep their order, report(command) is called in input order as soon as a
+        command and all commands before it are done; returns the number of failed commands """
+    chains = {}
+
+    for command in commands:
+        if command.error is None:
+            chains.setdefault(command.id, []).append(command)
+        else:
+            command._done.set()
+
+    def run_chain(id):
+        for command in chains[id]:
+            try:
+                execute(command.action, command.id, command.value)
+            except Exception as e:
+                command.error = e
+            finally:
+                command._done.set()
+
+    with ParallelFetcher(max_in_flight) as fetcher:
+        fetcher.submit(run_chain, list(chains))
+
+        for command in commands:
+            command._done.wait()
+
+            if report is not None:
+                report(command)
+
+    return sum(1 for command in commands if not command.success)
+
+
+def format_result(command: BatchCommand):
+    """ returns the result line of a command """
+    if command.success:
+        return '[+] {0} {1}'.format(command.line_number, command.text)
+
+    return '[-] {0} {1}: {2}'.format(command.line_number, command.text, command.error)
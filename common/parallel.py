@@ -0,0 +1,103 @@
+import contextvars
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class ParallelResult:
+    def __init__(self, items: list, failed: dict):
+        self.items  = items
+        self.failed = failed
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class ParallelFetcher:
+    """ fetches resources on a thread pool, at most max_in_flight requests are running at the same time """
+    DEFAULT_MAX_IN_FLIGHT = 4
+
+    def __init__(self, max_in_flight: int=None):
+        self.max_in_flight = max_in_flight if max_in_flight is not None else ParallelFetcher.DEFAULT_MAX_IN_FLIGHT
+
+        if self.max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1')
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='tradfri-fetch')
+
+    def _submit(self, fetch, id):
+        # the fetch runs in a copy of the caller's context, so e.g. a Coap deadline applies on the thread too
+        return self._executor.submit(contextvars.copy_context().run, fetch, id)
+
+    def submit(self, fetch, ids):
+        """ schedules fetch(id) for all ids, returns the pending futures in id order """
+        return [(id, self._submit(fetch, id)) for id in ids]
+
+    @staticmethod
+    def collect(futures):
+        """ waits for submitted fetches, results which are None or raised are reported as failed """
+        items  = []
+        failed = {}
+
+        for id, future in futures:
+            try:
+                item = future.result()
+            except Exception as e:
+                failed[id] = e
+                continue
+
+            if item is None:
+                failed[id] = ValueError(f'could not parse resource {id}')
+            else:
+                items.append(item)
+
+        return ParallelResult(items, failed)
+
+    def map(self, fetch, ids):
+        return ParallelFetcher.collect(self.submit(fetch, ids))
+
+    def imap(self, fetch, ids, failed: dict=None):
+        """ yields the results of fetch(id) in completion order as soon as they are done. at most twice
+            max_in_flight fetches are pending, so memory stays bounded for any number of ids; results which
+            are None or raised are skipped and reported in failed (if given) """
+        ids     = iter(ids)
+        pending = {}
+
+        while True:
+            for id in ids:
+                pending[self._submit(fetch, id)] = id
+
+                if len(pending) >= 2 * self.max_in_flight:
+                    break
+
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                id = pending.pop(future)
+
+                try:
+                    item = future.result()
+                except Exception as e:
+                    if failed is not None:
+                        failed[id] = e
+                    continue
+
+                if item is None:
+                    if failed is not None:
+                        failed[id] = ValueError(f'could not parse resource {id}')
+                else:
+                    yield item
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
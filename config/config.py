@@ -3,19 +3,57 @@ import configparser
 
 
 class Config:
-    def __init__(self, hubip, apiuser, apikey):
-        self.hubip   = hubip
-        self.apiuser = apiuser
-        self.apikey  = apikey
+    GATEWAY_SECTION_PREFIX = 'tradfri:'
+
+    def __init__(self, hubip, apiuser, apikey, max_in_flight=None, name=None):
+        self.hubip         = hubip
+        self.apiuser       = apiuser
+        self.apikey        = apikey
+        self.max_in_flight = max_in_flight
+        self.name          = name
 
     @staticmethod
-    def get_default_config():
-        conf = configparser.ConfigParser()
+    def get_default_dir():
+        """ returns the directory which holds tradfri.cfg """
         script_dir = os.path.dirname(os.path.realpath(__file__))
-        conf.read(script_dir + '/../tradfri.cfg')
+        return os.path.normpath(script_dir + '/..')
+
+    @staticmethod
+    def _read():
+        conf = configparser.ConfigParser()
+        conf.read(Config.get_default_dir() + '/tradfri.cfg')
+        return conf
+
+    @staticmethod
+    def _from_section(conf: configparser.ConfigParser, section: str, name=None):
+        hubip   = conf.get(section, 'hubip')
+        apiuser = conf.get(section, 'apiuser')
+        apikey  = conf.get(section, 'apikey')
+
+        # optional limit of concurrent requests, the gateway drops requests if it gets flooded
+        max_in_flight = conf.getint(section, 'maxinflight', fallback=None)
+
+        return Config(hubip, apiuser, apikey, max_in_flight, name)
+
+    @staticmethod
+    def get_default_config():
+        return Config._from_section(Config._read(), 'tradfri')
+
+    @staticmethod
+    def get_gateway_configs():
+        """ returns the configs of all gateways in file order keyed by name, [tradfri:<name>] sections are
+            named gateways and a plain [tradfri] section is the gateway 'default' """
+        conf     = Config._read()
+        gateways = {}
+
+        for section in conf.sections():
+            if section == 'tradfri':
+                name = 'default'
+            elif section.startswith(Config.GATEWAY_SECTION_PREFIX):
+                name = section[len(Config.GATEWAY_SECTION_PREFIX):]
+            else:
+                continue
 
-        hubip   = conf.get('tradfri', 'hubip')
-        apiuser = conf.get('tradfri', 'apiuser')
-        apikey  = conf.get('tradfri', 'apikey')
+            gateways[name] = Config._from_section(conf, section, name)
 
-        return Config(hubip, apiuser, apikey)
+        return gateways
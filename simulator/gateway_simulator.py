@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+"""
+    simulator/gateway_simulator.py - simulated TRADFRI gateway for load tests without a real hub
+
+    Serves the device (15001), group (15004) and scene (15005) resources over plain UDP CoAP with a configurable
+    inventory, latency, jitter, packet loss and flood protection. libcoap users can point the
+    CoapClientTransport to simulator/coap-client, which talks to the simulator instead of a gateway.
+    run from the repository root: python -m simulator.gateway_simulator --port 5684 --bulbs 500
+"""
+
+import json
+import time
+import heapq
+import random
+import argparse
+import threading
+
+from collections import deque
+
+from coap.coap_message import CoapMessage
+from coap.coap_server import CoapServer
+
+
+class GatewaySimulator(CoapServer):
+    """ CoapServer with a generated gateway inventory which behaves like a slow, lossy and flood protected hub """
+    FIRST_DEVICE_ID = 65537
+    FIRST_GROUP_ID  = 131073
+    FIRST_SCENE_ID  = 196608
+
+    __PRODUCTS = {
+        'bulb':        'TRADFRI bulb E27 WS opal 980lm',
+        'color_bulb':  'TRADFRI bulb E27 CWS opal 600lm',
+        'remote':      'TRADFRI remote control',
+    }
+
+    def __init__(self, host: str='127.0.0.1', port: int=0, bulbs: int=10, color_bulbs: int=0, remotes: int=0,
+                 groups: int=1, latency: float=0, jitter: float=0, loss: float=0, reject: float=0,
+                 flood_limit: float=None, seed=None):
+        """ latency and jitter in seconds, loss and reject are probabilities per datagram and request,
+            flood_limit is the number of requests per second above which requests are rejected with 5.03 """
+        super().__init__(host, port)
+
+        self.latency     = latency
+        self.jitter      = jitter
+        self.loss        = loss
+        self.reject      = reject
+        self.flood_limit = flood_limit
+
+        self.requests = 0
+        self.rejected = 0
+        self.dropped  = 0
+
+        self._random     = random.Random(seed)
+        self._arrivals   = deque()
+        self._queue      = []
+        self._queue_lock = threading.Condition()
+        self._queued     = 0
+        self._sender     = None
+
+        self.device_ids = []
+        self.group_ids  = []
+
+        self._build_inventory(bulbs, color_bulbs, remotes, groups)
+
+    def _build_inventory(self, bulbs, color_bulbs, remotes, groups):
+        kinds = ['bulb'] * bulbs + ['color_bulb'] * color_bulbs + ['remote'] * remotes
+
+        for index, kind in enumerate(kinds):
+            id = GatewaySimulator.FIRST_DEVICE_ID + index
+
+            self.device_ids.append(id)
+            self.set_resource(f'15001/{id}', self.device(id, kind, self._random))
+
+        lights = [id for id, kind in zip(self.device_ids, kinds) if kind != 'remote']
+
+        for index in range(groups):
+            id = GatewaySimulator.FIRST_GROUP_ID + index
+
+            # the lights are spread round robin over the groups
+            self.group_ids.append(id)
+            self.set_resource(f'15004/{id}', self.group(id, f'group {index + 1}', lights[index::groups]))
+
+            # every group starts with one scene holding the initial state of its lights
+            settings = [dict(self.get_resource(f'15001/{light}')['3311'][0], **{'9003': light})
+                        for light in lights[index::groups]]
+
+            self.set_resource(f'15005/{id}', [GatewaySimulator.FIRST_SCENE_ID])
+            self.set_resource(f'15005/{id}/{GatewaySimulator.FIRST_SCENE_ID}',
+                              self.scene(GatewaySimulator.FIRST_SCENE_ID, 'RELAX', settings))
+            self.set_handler('post', f'15005/{id}', GatewaySimulator._create_scene)
+
+        self.set_resource('15001', self.device_ids)
+        self.set_resource('15004', self.group_ids)
+        self.set_resource('15005', self.group_ids)
+
+    @staticmethod
+    def device(id, kind: str, rng: random.Random=random):
+        """ returns a device resource like the gateway reports it, kind is bulb, color_bulb or remote """
+        json = {'9001': f'{kind.replace("_", " ")} {id}', '9002': 1509290000 + id, '9020': 1509371000 + id,
+                '9003': id, '9054': 0, '9019': 1,
+                '3': {'0': 'IKEA of Sweden', '1': GatewaySimulator.__PRODUCTS[kind], '2': '', '3': '1.2.214', '6': 1}}
+
+        if kind == 'remote':
+            json.update({'5750': 0, '15009': [{'9003': 0}]})
+            json['3'].update({'6': 3, '9': rng.randint(10, 100)})
+            return json
+
+        light = {'5850': rng.randint(0, 1), '5851': rng.randint(0, 254), '5706': 'f1e0b5', '5709': 30140,
+                 '5710': 26909, '9003': 0}
+
+        if kind == 'color_bulb':
+            light.update({'5707': rng.randint(0, 65535), '5708': rng.randint(0, 65535), '5711': 0})
+
+        json.update({'5750': 2, '3311': [light]})
+        return json
+
+    @staticmethod
+    def group(id, name: str, device_ids: list):
+        return {'5850': 1, '5851': 254, '9001': name, '9002': 1509290000, '9003': id, '9039': 196608, '9108': 0,
+                '9018': {'15002': {'9003': list(device_ids)}}}
+
+    @staticmethod
+    def scene(id, name: str, light_settings: list):
+        return {'9001': name, '9002': 1509290000, '9003': id, '9057': 0, '9068': 1, '15013': light_settings}
+
+    def _create_scene(self, path, payload):
+        try:
+            scene = json.loads(payload.decode('utf-8'))
+        except ValueError:
+            return CoapMessage.CODE_BAD_REQUEST, b''
+
+        with self._lock:
+            scene_ids = self._resources[path]
+            id        = max(scene_ids, default=GatewaySimulator.FIRST_SCENE_ID - 1) + 1
+
+            scene_ids.append(id)
+            self._resources[f'{path}/{id}'] = dict(self.scene(id, '', []), **scene)
+
+        self.notify(path)
+        return CoapMessage.CODE_CREATED, b''
+
+    def _handle_put(self, path, payload):
+        code, response = super()._handle_put(path, payload)
+        parts          = path.split('/')
+
+        if code != CoapMessage.CODE_CHANGED or parts[0] != '15004' or len(parts) != 2:
+            return code, response
+
+        # activating a scene applies its stored light settings to the group members
+        scene_id = json.loads(payload.decode('utf-8')).get('9039')
+        scene    = self.get_resource(f'15005/{parts[1]}/{scene_id}') if scene_id is not None else None
+
+        for setting in scene['15013'] if scene is not None else []:
+            light = {key: value for key, value in setting.items() if key != '9003'}
+            super()._handle_put(f'15001/{setting["9003"]}', json.dumps({'3311': [light]}).encode('utf-8'))
+
+        return code, response
+
+    def start(self):
+        super().start()
+
+        self._sender = threading.Thread(target=self._send_delayed, name='gateway-simulator-sender', daemon=True)
+        self._sender.start()
+        return self
+
+    def stop(self):
+        super().stop()
+
+        with self._queue_lock:
+            self._queue_lock.notify()
+
+    def handle_datagram(self, data: bytes, address):
+        if self.loss and self._random.random() < self.loss:
+            self.dropped += 1
+            return
+
+        super().handle_datagram(data, address)
+
+    def handle_request(self, request: CoapMessage, address):
+        self.requests += 1
+
+        if self._is_flooded() or (self.reject and self._random.random() < self.reject):
+            self.rejected += 1
+            return self.build_response(request, CoapMessage.CODE_SERVICE_UNAVAILABLE, b'')
+
+        return super().handle_request(request, address)
+
+    def _is_flooded(self):
+        if self.flood_limit is None:
+            return False
+
+        now = time.monotonic()
+
+        # sliding window of one second
+        while self._arrivals and self._arrivals[0] <= now - 1:
+            self._arrivals.popleft()
+
+        if len(self._arrivals) >= self.flood_limit:
+            return True
+
+        self._arrivals.append(now)
+        return False
+
+    def send(self, message: CoapMessage, address):
+        if self.loss and self._random.random() < self.loss:
+            self.dropped += 1
+            return
+
+        delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+        if delay == 0 or self._sender is None:
+            super().send(message, address)
+            return
+
+        with self._queue_lock:
+            self._queued += 1
+            heapq.heappush(self._queue, (time.monotonic() + delay, self._queued, message, address))
+            self._queue_lock.notify()
+
+    def _send_delayed(self):
+        """ sends the responses once their latency has passed, requests are not serialized by the latency """
+        with self._queue_lock:
+            while self._running:
+                if not self._queue:
+                    self._queue_lock.wait(.5)
+                    continue
+
+                due = self._queue[0][0] - time.monotonic()
+
+                if due > 0:
+                    self._queue_lock.wait(due)
+                    continue
+
+                _, _, message, address = heapq.heappop(self._queue)
+
+                try:
+                    CoapServer.send(self, message, address)
+                except OSError:
+                    break
+
+
+def main():
+    parser = argparse.ArgumentParser(description='simulated TRADFRI gateway serving 15001, 15004 and 15005 over UDP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5684)
+    parser.add_argument('--bulbs', type=int, default=10)
+    parser.add_argument('--color-bulbs', type=int, default=0)
+    parser.add_argument('--remotes', type=int, default=0)
+    parser.add_argument('--groups', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0, help='response latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='latency jitter in milliseconds')
+    parser.add_argument('--loss', type=float, default=0, help='probability a datagram gets lost')
+    parser.add_argument('--reject', type=float, default=0, help='probability a request is rejected with 5.03')
+    parser.add_argument('--flood-limit', type=float, help='requests per second above which requests are rejected')
+    args = parser.parse_args()
+
+    simulator = GatewaySimulator(args.host, args.port, args.bulbs, args.color_bulbs, args.remotes, args.groups,
+                                 args.latency / 1000, args.jitter / 1000, args.loss, args.reject, args.flood_limit)
+
+    print(f'[+] simulator: {len(simulator.device_ids)} devices and {len(simulator.group_ids)} groups on '
+          f'{args.host}:{simulator.port}')
+
+    with simulator:
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+    print(f'[+] simulator: {simulator.requests} requests, {simulator.rejected} rejected, {simulator.dropped} dropped')
+
+
+if __name__ == "__main__":
+    main()
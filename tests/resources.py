@@ -0,0 +1,126 @@
+import os
+import copy
+import json
+import time
+import importlib.util
+
+from urllib.parse import urlsplit
+
+from coap.coap import Coap
+from coap.coap_server import CoapServer
+from coap.coap_transport import CoapTransport, CoapError
+from config.config import Config
+from tradfri.tradfri_device import parse_tradfri_device
+from tradfri.tradfri_group import TradfriGroup
+
+CONFIG = Config('127.0.0.1', 'user', 'key')
+ROOT   = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bulb(id, on: int=1, brightness: int=200):
+    return {'9001': f'bulb {id}', '9002': 1, '9003': id, '3': {'0': 'IKEA', '1': 'TRADFRI bulb E27', '3': '1.2'},
+            '3311': [{'5850': on, '5851': brightness, '5706': 'f1e0b5'}]}
+
+
+def remote(id):
+    return {'9001': f'remote {id}', '9002': 1, '9003': id,
+            '3': {'0': 'IKEA', '1': 'TRADFRI remote control', '3': '1.2'}, '15009': [{'9003': 0}]}
+
+
+def group(id, members: list, on: int=1, brightness: int=200, scene: int=0):
+    return {'9001': f'group {id}', '9002': 1, '9003': id, '5850': on, '5851': brightness, '9039': scene,
+            '9018': {'15002': {'9003': list(members)}}}
+
+
+def inventory(*resources):
+    """ returns the resources of a gateway serving the given device and group JSON objects """
+    result = {'15001': [], '15004': []}
+
+    for resource in resources:
+        endpoint = '15004' if '9018' in resource else '15001'
+        result[endpoint].append(resource['9003'])
+        result[f'{endpoint}/{resource["9003"]}'] = copy.deepcopy(resource)
+
+    return result
+
+
+def devices(*resources):
+    return [parse_tradfri_device(resource, CONFIG) for resource in resources]
+
+
+def groups(*resources):
+    return [TradfriGroup.from_json(resource, CONFIG) for resource in resources]
+
+
+def load_script(name: str):
+    """ imports one of the CLI scripts (e.g. tradfri-lights) as module """
+    spec   = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(ROOT, f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def wait_for(condition, timeout: float=2):
+    """ polls condition until it is true, returns False if it isn't within timeout seconds """
+    expires = time.monotonic() + timeout
+
+    while not condition():
+        if time.monotonic() > expires:
+            return False
+
+        time.sleep(0.01)
+
+    return True
+
+
+class ResourceTransport(CoapTransport):
+    """ serves the resources by path like the gateway, PUTs are merged into the resources. every request is
+        recorded as (method, path, payload) """
+    scheme = 'coap'
+
+    def __init__(self, resources: dict):
+        self.resources = resources
+        self.requests  = []
+
+    def paths(self, method: str=None):
+        return [path for request_method, path, _ in self.requests if method in (None, request_method)]
+
+    def request(self, method, uri, api_config, payload=None, timeout=None):
+        path = urlsplit(uri).path.strip('/')
+        self.requests.append((method, path, json.loads(payload) if payload else None))
+
+        if path not in self.resources:
+            raise CoapError(f'{method.upper()} {uri} failed with 4.04', 0x84)
+
+        if method == 'put':
+            CoapServer.merge(self.resources[path], json.loads(payload))
+            return ''
+
+        return json.dumps(self.resources[path])
+
+    def install(self):
+        Coap.set_transport(self)
+        return self
+
+
+class ScriptedTransport(CoapTransport):
+    """ answers with the given responses one after the other (the last one is repeated), exceptions are raised.
+        every request is recorded as (method, uri, payload) """
+    scheme = 'coap'
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests  = []
+
+    def request(self, method, uri, api_config, payload=None, timeout=None):
+        self.requests.append((method, uri, payload))
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+        if isinstance(response, Exception):
+            raise response
+
+        return response
+
+    def install(self):
+        Coap.set_transport(self)
+        return self
@@ -0,0 +1,148 @@
+import asyncio
+import unittest
+
+from coap.coap import Coap
+from coap.async_coap import AsyncCoap, AsyncCoapTransport, AsyncUdpTransport
+from coap.coap_cache import CoapCache
+from coap.coap_policy import CoapRequestPolicy, deadline
+from coap.coap_state_filter import CoapStateFilter
+from coap.coap_transport import CoapError, CoapTimeoutError, CoapResponseError
+from config.config import Config
+from simulator.gateway_simulator import GatewaySimulator
+from tradfri.tradfri_endpoint import TradfriEndpoint
+
+CONFIG = Config('127.0.0.1', 'user', 'key')
+
+
+class ScriptedTransport(AsyncCoapTransport):
+    """ answers with the given responses one after the other, exceptions are raised """
+    scheme = 'coap'
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests  = []
+        self.closed    = False
+
+    async def request(self, method, uri, api_config, payload=None, timeout=None):
+        self.requests.append((method, uri, payload))
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+        if isinstance(response, Exception):
+            raise response
+
+        return response
+
+    async def close(self):
+        self.closed = True
+
+
+class AsyncCoapTest(unittest.TestCase):
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        self.policy       = Coap.get_policy()
+
+        Coap.set_rate_limiter(None)
+        Coap.set_policy(CoapRequestPolicy(backoff=.001))
+
+    def tearDown(self):
+        AsyncCoap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+        Coap.set_policy(self.policy)
+        Coap.set_cache(None)
+        Coap.set_state_filter(None)
+
+    def transport(self, *responses):
+        transport = ScriptedTransport(*responses)
+        AsyncCoap.set_transport(transport)
+        return transport
+
+    def test_timeouts_and_invalid_payloads_are_retried(self):
+        transport = self.transport(CoapTimeoutError('timed out'), 'garbage', '[1, 2]')
+
+        self.assertEqual(asyncio.run(AsyncCoap.get(CONFIG, TradfriEndpoint.DEVICE)), [1, 2])
+        self.assertEqual(len(transport.requests), 3)
+
+    def test_invalid_payload_raises_after_the_retries(self):
+        transport = self.transport('garbage')
+
+        with self.assertRaises(CoapResponseError):
+            asyncio.run(AsyncCoap.get(CONFIG, TradfriEndpoint.DEVICE))
+
+        self.assertEqual(len(transport.requests), Coap.get_policy().retries + 1)
+
+    def test_deadline(self):
+        self.transport('[]')
+
+        async def expired():
+            with deadline(0):
+                return await AsyncCoap.get(CONFIG, TradfriEndpoint.DEVICE)
+
+        with self.assertRaises(CoapTimeoutError):
+            asyncio.run(expired())
+
+    def test_cache(self):
+        transport = self.transport('{"9003": 65537}')
+        Coap.set_cache(CoapCache(default_ttl=60))
+
+        for _ in range(3):
+            asyncio.run(AsyncCoap.get(CONFIG, TradfriEndpoint.DEVICE, 65537))
+
+        self.assertEqual(len(transport.requests), 1)
+
+    def test_state_filter_reads_with_the_async_client(self):
+        transport = self.transport('{"3311": [{"5850": 1}]}', '')
+        Coap.set_state_filter(CoapStateFilter(CoapStateFilter.SOURCE_READ))
+
+        asyncio.run(AsyncCoap.put('{"3311": [{"5850": 1}]}', CONFIG, TradfriEndpoint.DEVICE, 65537, False))
+
+        self.assertEqual(Coap.get_state_filter().skipped, 1)
+        self.assertEqual([method for method, _, _ in transport.requests], ['get'])
+
+    def test_state_filter_compares_with_the_cache(self):
+        transport = self.transport('')
+        Coap.set_cache(CoapCache(default_ttl=60))
+        Coap.set_state_filter(CoapStateFilter(CoapStateFilter.SOURCE_CACHE))
+        Coap.get_cache().set(CONFIG.hubip, TradfriEndpoint.DEVICE, 65537, {'3311': [{'5850': 1}]})
+
+        asyncio.run(AsyncCoap.put('{"3311": [{"5850": 1}]}', CONFIG, TradfriEndpoint.DEVICE, 65537, False))
+        asyncio.run(AsyncCoap.put('{"3311": [{"5850": 0}]}', CONFIG, TradfriEndpoint.DEVICE, 65537, False))
+
+        self.assertEqual((Coap.get_state_filter().skipped, Coap.get_state_filter().sent), (1, 1))
+        self.assertEqual([method for method, _, _ in transport.requests], ['put'])
+        self.assertIsNone(Coap.get_cache().get(CONFIG.hubip, TradfriEndpoint.DEVICE, 65537))
+
+    def test_rejections_are_retried(self):
+        transport = self.transport(CoapError('rejected', 0xa3), '', '[]')
+
+        self.assertEqual(asyncio.run(AsyncCoap.get(CONFIG, TradfriEndpoint.DEVICE)), [])
+        self.assertEqual(len(transport.requests), 3)
+
+    def test_set_transport_closes_the_previous_one(self):
+        previous = self.transport('[]')
+        self.transport('[]')
+
+        self.assertTrue(previous.closed)
+
+        async def replace():
+            current = AsyncCoap.get_transport()
+            self.transport('[]')
+            await asyncio.sleep(0)
+            return current
+
+        self.assertTrue(asyncio.run(replace()).closed)
+
+    def test_udp_sessions_are_bound_to_their_loop(self):
+        simulator = GatewaySimulator(bulbs=2).start()
+
+        try:
+            AsyncCoap.set_transport(AsyncUdpTransport(simulator.port))
+
+            # every asyncio.run has a loop of its own
+            for _ in range(2):
+                self.assertEqual(asyncio.run(AsyncCoap.get(CONFIG, TradfriEndpoint.DEVICE)), simulator.device_ids)
+        finally:
+            AsyncCoap.set_transport(None)
+            simulator.stop()
+
+if __name__ == '__main__':
+    unittest.main()
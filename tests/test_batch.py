@@ -0,0 +1,78 @@
+import unittest
+
+from coap.coap import Coap
+from tradfri.tradfri_batch import set_devices_state, _covering_groups
+from tests.resources import CONFIG, ResourceTransport, bulb, remote, group, inventory, devices, groups
+
+
+class CoveringGroupsTest(unittest.TestCase):
+    def test_whole_groups_are_collapsed(self):
+        covering, remaining = _covering_groups({'65537', '65538', '65539'},
+                                               groups(group(131073, [65537, 65538]), group(131074, [65539, 65540])))
+
+        self.assertEqual([(group.id, members) for group, members in covering], [(131073, {'65537', '65538'})])
+        self.assertEqual(remaining, {'65539'})
+
+    def test_known_non_lights_are_ignored(self):
+        covering, remaining = _covering_groups({'65537'}, groups(group(131073, [65537, 65538])),
+                                               devices(bulb(65537), remote(65538)))
+
+        self.assertEqual([(group.id, members) for group, members in covering], [(131073, {'65537'})])
+        self.assertEqual(remaining, set())
+
+    def test_groups_with_unknown_members_are_not_collapsed(self):
+        # 65538 failed to fetch or is not known to the index yet, it might be a light
+        covering, remaining = _covering_groups({'65537'}, groups(group(131073, [65537, 65538])),
+                                               devices(bulb(65537)))
+
+        self.assertEqual(covering, [])
+        self.assertEqual(remaining, {'65537'})
+
+
+class SetDevicesStateTest(unittest.TestCase):
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        self.transport    = ResourceTransport(inventory(
+            bulb(65537), bulb(65538), bulb(65539), remote(65540),
+            group(131073, [65537, 65538, 65540]), group(131074, [65539, 65540])
+        )).install()
+
+        Coap.set_rate_limiter(None)
+
+    def tearDown(self):
+        Coap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+
+    def test_group_put(self):
+        results = set_devices_state(CONFIG, [65537, 65538, 65539], on=False,
+                                    devices=devices(bulb(65537), bulb(65538), bulb(65539), remote(65540)))
+
+        self.assertEqual(sorted(self.transport.paths('put')), ['15004/131073', '15004/131074'])
+        self.assertEqual({id: result.group_id for id, result in results.items()},
+                         {65537: 131073, 65538: 131073, 65539: 131074})
+        self.assertTrue(all(result.success for result in results.values()))
+
+    def test_partial_group_is_switched_per_device(self):
+        results = set_devices_state(CONFIG, [65537, 65539], brightness=50,
+                                    devices=devices(bulb(65537), bulb(65538), bulb(65539), remote(65540)))
+
+        self.assertEqual(sorted(self.transport.paths('put')), ['15001/65537', '15004/131074'])
+        self.assertEqual(self.transport.resources['15001/65537']['3311'][0]['5851'], 127)
+        self.assertEqual(sorted(results), [65537, 65539])
+
+    def test_failed_device_is_not_switched_with_its_group(self):
+        # 65538 is missing from devices as if its fetch had failed
+        set_devices_state(CONFIG, [65537], on=False, devices=devices(bulb(65537), remote(65540)))
+
+        self.assertEqual(self.transport.paths('put'), ['15001/65537'])
+        self.assertEqual(self.transport.resources['15001/65538']['3311'][0]['5850'], 1)
+
+    def test_failed_device_put(self):
+        del self.transport.resources['15001/65539']
+        results = set_devices_state(CONFIG, [65539], on=True, groups=[])
+
+        self.assertFalse(results[65539].success)
+
+
+if __name__ == '__main__':
+    unittest.main()
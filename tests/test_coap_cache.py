@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+
+from coap.coap import Coap
+from coap.async_coap import AsyncCoap, AsyncCoapTransport
+
+from coap.coap_cache import CoapCache
+from config.config import Config
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_schema import TradfriKey
+
+HUB = '127.0.0.1'
+
+
+def group(ids):
+    return {TradfriKey.GROUP_MEMBERS: {TradfriKey.GROUP_MEMBERS_ENDPOINT: {TradfriKey.INSTANCE_ID: ids}}}
+
+
+class CoapCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = CoapCache(default_ttl=60)
+
+        for id in (65537, 65538, 65539):
+            self.cache.set(HUB, TradfriEndpoint.DEVICE, id, {'id': id})
+
+        self.cache.set('127.0.0.2', TradfriEndpoint.DEVICE, 65537, {'id': 65537})
+
+    def cached(self, endpoint, id, hubip=HUB):
+        return self.cache.get(hubip, endpoint, id) is not None
+
+    def test_ids_are_normalized(self):
+        self.assertTrue(self.cached(TradfriEndpoint.DEVICE, '65537'))
+
+    def test_expiry(self):
+        cache = CoapCache(default_ttl=0)
+        cache.set(HUB, TradfriEndpoint.DEVICE, 65537, {})
+
+        self.assertIsNone(cache.get(HUB, TradfriEndpoint.DEVICE, 65537))
+
+    def test_lru_eviction(self):
+        cache = CoapCache(default_ttl=60, max_size=2)
+
+        for id in (1, 2, 3):
+            cache.set(HUB, TradfriEndpoint.DEVICE, id, {})
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(HUB, TradfriEndpoint.DEVICE, 1))
+        self.assertEqual(cache.stats(TradfriEndpoint.DEVICE).evictions, 1)
+
+    def test_device_put_drops_groups_containing_it(self):
+        self.cache.set(HUB, TradfriEndpoint.GROUP, 131073, group([65537, 65538]))
+        self.cache.set(HUB, TradfriEndpoint.GROUP, 131074, group([65539]))
+        self.cache.invalidate(HUB, TradfriEndpoint.DEVICE, '65537')
+
+        self.assertFalse(self.cached(TradfriEndpoint.DEVICE, 65537))
+        self.assertFalse(self.cached(TradfriEndpoint.GROUP, 131073))
+        self.assertTrue(self.cached(TradfriEndpoint.GROUP, 131074))
+        self.assertTrue(self.cached(TradfriEndpoint.DEVICE, 65538))
+
+    def test_group_put_drops_members(self):
+        self.cache.set(HUB, TradfriEndpoint.GROUP, 131073, group([65537, 65538]))
+        self.cache.invalidate(HUB, TradfriEndpoint.GROUP, 131073)
+
+        self.assertFalse(self.cached(TradfriEndpoint.GROUP, 131073))
+        self.assertFalse(self.cached(TradfriEndpoint.DEVICE, 65537))
+        self.assertFalse(self.cached(TradfriEndpoint.DEVICE, 65538))
+        self.assertTrue(self.cached(TradfriEndpoint.DEVICE, 65539))
+
+    def test_group_put_without_cached_group_drops_all_devices_of_the_gateway(self):
+        self.cache.invalidate(HUB, TradfriEndpoint.GROUP, 131073)
+
+        for id in (65537, 65538, 65539):
+            self.assertFalse(self.cached(TradfriEndpoint.DEVICE, id))
+
+        self.assertTrue(self.cached(TradfriEndpoint.DEVICE, 65537, '127.0.0.2'))
+
+    def test_async_put_invalidates(self):
+        class Transport(AsyncCoapTransport):
+            async def request(self, method, uri, api_config, payload=None, timeout=None):
+                return ''
+
+        Coap.set_cache(self.cache)
+        AsyncCoap.set_transport(Transport())
+
+        try:
+            asyncio.run(AsyncCoap.put('{"5850": 1}', Config(HUB, 'user', 'key'), TradfriEndpoint.DEVICE, 65537,
+                                      False))
+        finally:
+            Coap.set_cache(None)
+            AsyncCoap.set_transport(None)
+
+        self.assertFalse(self.cached(TradfriEndpoint.DEVICE, 65537))
+        self.assertTrue(self.cached(TradfriEndpoint.DEVICE, 65538))
+
+
+if __name__ == '__main__':
+    unittest.main()
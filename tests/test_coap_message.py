@@ -0,0 +1,56 @@
+import unittest
+
+from coap.coap_message import CoapMessage
+
+
+class CoapMessageTest(unittest.TestCase):
+    def round_trip(self, message: CoapMessage):
+        return CoapMessage.decode(message.encode())
+
+    def test_request_round_trip(self):
+        request = CoapMessage(CoapMessage.TYPE_CON, CoapMessage.CODE_PUT, 0x1234, b'\x01\x02\x03',
+                              payload='{"5850": 1}')
+        request.uri_path = '/15001/65537'
+        decoded = self.round_trip(request)
+
+        self.assertEqual((decoded.type, decoded.code, decoded.message_id, decoded.token),
+                         (CoapMessage.TYPE_CON, CoapMessage.CODE_PUT, 0x1234, b'\x01\x02\x03'))
+        self.assertEqual(decoded.uri_path, '15001/65537')
+        self.assertEqual(decoded.payload, b'{"5850": 1}')
+        self.assertTrue(decoded.is_request)
+
+    def test_extended_option_deltas_and_lengths(self):
+        # 13 and 269 need the one and two byte extensions of the option delta and length
+        response = CoapMessage(CoapMessage.TYPE_ACK, CoapMessage.CODE_CONTENT, 7)
+        response.add_option(CoapMessage.OPTION_OBSERVE, CoapMessage.encode_uint(70000))
+        response.add_option(CoapMessage.OPTION_URI_PATH, b'x' * 13)
+        response.add_option(CoapMessage.OPTION_URI_PATH, b'y' * 269)
+        response.add_option(300, b'')
+        decoded = self.round_trip(response)
+
+        self.assertEqual(decoded.options, response.options)
+        self.assertEqual(decoded.observe, 70000)
+        self.assertEqual(decoded.code_string, '2.05')
+        self.assertTrue(decoded.is_success)
+
+    def test_block2(self):
+        message = CoapMessage(code=CoapMessage.CODE_CONTENT)
+        message.add_option(CoapMessage.OPTION_BLOCK2, CoapMessage.encode_block2(3, True, 1024))
+
+        self.assertEqual(self.round_trip(message).block2, (3, True, 1024))
+        self.assertIsNone(CoapMessage().block2)
+
+    def test_uint(self):
+        for value in (0, 1, 255, 256, 2 ** 24 - 1):
+            self.assertEqual(CoapMessage.decode_uint(CoapMessage.encode_uint(value)), value)
+
+        self.assertEqual(CoapMessage.encode_uint(0), b'')
+
+    def test_malformed(self):
+        for data in (b'\x40\x01', b'\x80\x01\x00\x01', b'\x49\x01\x00\x01', b'\x40\x01\x00\x01\xf0'):
+            with self.assertRaises(ValueError):
+                CoapMessage.decode(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from tradfri import tradfri_color
+from tradfri.tradfri_color import COLOR_INDEX, WHITE_SPECTRUM_INDEX, hsv_to_hex, hsv_to_hex_batch
+
+
+class ColorIndexTest(unittest.TestCase):
+    HUES        = list(range(0, 361, 15))
+    SATURATIONS = list(range(0, 101, 10))
+
+    def pairs(self):
+        return [(hue, saturation) for hue in self.HUES for saturation in self.SATURATIONS]
+
+    def test_from_hs(self):
+        self.assertEqual(COLOR_INDEX.from_hs(0, 100), 'Saturated Red')
+        self.assertEqual(COLOR_INDEX.from_hs(120, 100), 'Lime')
+        self.assertEqual(COLOR_INDEX.from_hs(240, 100), 'Blue')
+
+    def test_from_hex(self):
+        self.assertEqual(COLOR_INDEX.from_hex('dc4b31'), 'Saturated Red')
+        self.assertEqual(COLOR_INDEX.from_hex('dc4b32'), 'Saturated Red')
+        self.assertEqual(WHITE_SPECTRUM_INDEX.from_hex('f1e0b5'), 'Warm')
+        self.assertEqual(COLOR_INDEX.from_hex('unknown'), 'unknown')
+
+    def test_from_gateway_xy(self):
+        self.assertEqual(COLOR_INDEX.from_gateway_xy(45000, 20000), 'Saturated Red')
+        self.assertEqual(COLOR_INDEX.from_gateway_xy(9831, 3933), 'Blue')
+
+    def test_from_hs_batch_matches_from_hs(self):
+        hues, saturations = zip(*self.pairs())
+
+        self.assertEqual(COLOR_INDEX.from_hs_batch(hues, saturations),
+                         [COLOR_INDEX.from_hs(hue, saturation) for hue, saturation in self.pairs()])
+
+    @unittest.skipIf(tradfri_color.numpy is None, 'numpy is not installed')
+    def test_vectorized_matches_fallback(self):
+        hues, saturations = zip(*self.pairs())
+        vectorized        = COLOR_INDEX.from_hs_batch(hues, saturations)
+        array             = COLOR_INDEX._array
+
+        try:
+            COLOR_INDEX._array = None
+            self.assertEqual(COLOR_INDEX.from_hs_batch(hues, saturations), vectorized)
+        finally:
+            COLOR_INDEX._array = array
+
+    def test_hsv_to_hex_batch_matches_hsv_to_hex(self):
+        hues, saturations = zip(*self.pairs())
+        brightnesses      = [50] * len(hues)
+
+        self.assertEqual(hsv_to_hex_batch(hues, saturations, brightnesses),
+                         [hsv_to_hex(*values) for values in zip(hues, saturations, brightnesses)])
+
+
+if __name__ == '__main__':
+    unittest.main()
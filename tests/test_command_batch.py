@@ -0,0 +1,129 @@
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from coap.coap import Coap
+from common.command_batch import parse_commands, run_commands, format_result
+from config.config import Config
+from tradfri.tradfri_daemon import TradfriDaemon
+from tests.resources import CONFIG, ResourceTransport, bulb, inventory, load_script
+
+
+class CommandBatchTest(unittest.TestCase):
+    def test_parse_commands(self):
+        commands = parse_commands(['# comment', '', 'power 65537 on', 'power 65537', 'fly 65537 away'],
+                                  ['power', 'brightness'])
+
+        self.assertEqual([(command.line_number, command.action, command.id, command.value) for command in commands],
+                         [(3, 'power', '65537', 'on'), (4, None, None, None), (5, None, None, None)])
+        self.assertEqual([format_result(command) for command in commands[1:]],
+                         ['[-] 4 power 65537: expected <action> <id> <value>',
+                          '[-] 5 fly 65537 away: action can only be power/brightness'])
+
+    def test_commands_for_an_id_keep_their_order(self):
+        executed = []
+        lock     = threading.Lock()
+
+        def execute(action, id, value):
+            # the first command of each id is the slowest, so other ids overtake it
+            time.sleep(.02 if value == '1' else 0)
+
+            with lock:
+                executed.append((id, value))
+
+        lines    = [f'brightness {id} {value}' for value in '123' for id in (65537, 65538, 65539)]
+        commands = parse_commands(lines, ['brightness'])
+        reported = []
+
+        self.assertEqual(run_commands(commands, execute, 3, reported.append), 0)
+        self.assertEqual(reported, commands)
+
+        for id in ('65537', '65538', '65539'):
+            self.assertEqual([value for executed_id, value in executed if executed_id == id], ['1', '2', '3'])
+
+    def test_failed_commands_are_counted(self):
+        def execute(action, id, value):
+            if value == 'off':
+                raise ValueError('broken')
+
+        commands = parse_commands(['power 65537 off', 'power 65538 on', 'invalid'], ['power'])
+
+        self.assertEqual(run_commands(commands, execute, 2), 2)
+        self.assertEqual([command.success for command in commands], [False, True, False])
+        self.assertEqual(format_result(commands[0]), '[-] 1 power 65537 off: broken')
+
+
+class LightsBatchTest(unittest.TestCase):
+    """ tradfri-lights.py --batch, directly against the gateway and through the daemon """
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        self.transport    = ResourceTransport(inventory(bulb(65537), bulb(65538, on=0))).install()
+        self.directory    = tempfile.mkdtemp()
+        self.batch        = os.path.join(self.directory, 'batch')
+        self.environment  = mock.patch.dict(os.environ, {'TRADFRI_SOCKET': os.path.join(self.directory, 'sock')})
+        self.config       = mock.patch.object(Config, 'get_default_config', staticmethod(lambda: CONFIG))
+
+        Coap.set_rate_limiter(None)
+        self.environment.start()
+        self.config.start()
+
+        with open(self.batch, 'w') as batch_file:
+            batch_file.write('power 65537 on\npower 65538 on\ncolor 65537 purple\n')
+
+        self.lights = load_script('tradfri-lights')
+
+    def tearDown(self):
+        self.config.stop()
+        self.environment.stop()
+        Coap.set_state_filter(None)
+        Coap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+        shutil.rmtree(self.directory)
+
+    def run_batch(self, skip_unchanged: bool=False):
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            failed = self.lights.run_batch(argparse.Namespace(batch=self.batch, max_in_flight=2,
+                                                              skip_unchanged=skip_unchanged))
+
+        return failed, output.getvalue().splitlines()
+
+    def test_direct(self):
+        failed, lines = self.run_batch()
+
+        self.assertEqual(failed, 1)
+        self.assertEqual(lines, ['[+] 1 power 65537 on', '[+] 2 power 65538 on',
+                                 '[-] 3 color 65537 purple: color value can only be warm/normal/cold'])
+        self.assertEqual(sorted(self.transport.paths('put')), ['15001/65537', '15001/65538'])
+
+    def test_direct_skip_unchanged(self):
+        failed, lines = self.run_batch(skip_unchanged=True)
+
+        self.assertEqual(failed, 1)
+        self.assertEqual(lines[-1], '[+] Tradfri: skipped 1 of 2 commands, nothing to change')
+        self.assertEqual(self.transport.paths('put'), ['15001/65538'])
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix domain sockets are not available')
+    def test_daemon(self):
+        with TradfriDaemon(CONFIG, os.environ['TRADFRI_SOCKET'], refresh_interval=3600):
+            failed, lines = self.run_batch(skip_unchanged=True)
+
+        self.assertEqual(failed, 1)
+        self.assertEqual(lines, ['[+] 1 power 65537 on', '[+] 2 power 65538 on',
+                                 '[-] 3 color 65537 purple: color value can only be warm/normal/cold',
+                                 '[+] Tradfri: skipped 1 of 2 commands, nothing to change'])
+        self.assertEqual(self.transport.paths('put'), ['15001/65538'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import json
+import unittest
+
+from coap.coap import Coap
+from coap.coap_policy import CoapRequestPolicy
+from coap.coap_transport import CoapTransport, CoapTimeoutError
+from config.config import Config
+from tradfri.tradfri_command_queue import TradfriCommandQueue
+from tradfri.tradfri_endpoint import TradfriEndpoint
+
+
+class FlakyTransport(CoapTransport):
+    """ fails the first failures PUTs, records the payloads of the successful ones """
+    scheme = 'coap'
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.received = []
+
+    def request(self, method, uri, api_config, payload=None, timeout=None):
+        if self.failures > 0:
+            self.failures -= 1
+            raise CoapTimeoutError(f'{method.upper()} {uri} timed out')
+
+        self.received.append((uri, json.loads(payload)))
+        return ''
+
+
+class TradfriCommandQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        self.policy       = Coap.get_policy()
+
+        Coap.set_rate_limiter(None)
+        Coap.set_policy(CoapRequestPolicy(retries=0))
+
+    def tearDown(self):
+        Coap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+        Coap.set_policy(self.policy)
+
+    def queue(self, failures, flush_interval=.01):
+        transport = FlakyTransport(failures)
+        Coap.set_transport(transport)
+        return transport, TradfriCommandQueue(Config('127.0.0.1', 'user', 'key'), flush_interval)
+
+    def test_writes_are_merged(self):
+        # nothing is flushed before close
+        transport, queue = self.queue(0, 60)
+
+        for value in range(10):
+            queue.submit(TradfriEndpoint.GROUP, 131073, {'5851': value})
+
+        queue.close()
+
+        self.assertEqual(transport.received, [('coap://127.0.0.1:5684/15004/131073', {'5851': 9})])
+        self.assertEqual(queue.merged, 9)
+
+    def test_final_state_survives_gateway_trouble(self):
+        transport, queue = self.queue(6)
+
+        queue.dim_light(65537, 10)
+        queue.dim_light(65537, 50)
+        queue.close()
+
+        self.assertEqual(transport.received[-1][1], {'3311': [{'5851': 127}]})
+        self.assertEqual(queue.errors, {})
+
+    def test_close_raises_if_the_state_can_not_be_delivered(self):
+        transport, queue = self.queue(1000)
+        queue.power_group(131073, True)
+
+        with self.assertRaises(RuntimeError):
+            queue.close(timeout=.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from coap.coap import Coap
+from tradfri.tradfri_daemon import TradfriDaemon
+from tradfri.tradfri_daemon_client import TradfriDaemonClient, TradfriDaemonError
+from tests.resources import CONFIG, ResourceTransport, bulb, remote, group, inventory, wait_for
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix domain sockets are not available')
+class TradfriDaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        self.transport    = ResourceTransport(inventory(
+            bulb(65537), bulb(65538, on=0), remote(65539), group(131073, [65537, 65538, 65539])
+        )).install()
+
+        Coap.set_rate_limiter(None)
+
+        self.directory = tempfile.mkdtemp()
+        self.path      = os.path.join(self.directory, 'tradfri.sock')
+        self.daemon    = TradfriDaemon(CONFIG, self.path, refresh_interval=3600).start()
+        self.client    = TradfriDaemonClient(self.path, 5)
+
+    def tearDown(self):
+        self.daemon.stop()
+        Coap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+        shutil.rmtree(self.directory)
+
+    def test_status(self):
+        status = self.client.request('status')
+
+        self.assertEqual([(device['kind'], device['id'], device['groups']) for device in status['devices']],
+                         [('bulb', 65537, [131073]), ('bulb', 65538, [131073]), ('remote', 65539, [131073])])
+        self.assertEqual([(group['kind'], group['id'], group['any_on'], group['all_on'], group['lights'])
+                          for group in status['groups']], [('group', 131073, True, False, 2)])
+        self.assertEqual(self.client.request('device', id=65538)['status'], False)
+
+    def test_errors(self):
+        failing = [('device', {'id': 1}), ('unknown', {}), ('power_light', {'id': 65537, 'value': 'x'})]
+
+        for command, arguments in failing:
+            with self.assertRaises(TradfriDaemonError):
+                self.client.request(command, **arguments)
+
+        # the daemon keeps serving after failed commands
+        self.assertTrue(self.client.is_running())
+
+    def test_commands_refresh_the_touched_resources(self):
+        self.assertTrue(self.client.request('power_light', id=65538, value='on'))
+        self.assertIn(('put', '15001/65538', {'3311': [{'5850': 1}]}), self.transport.requests)
+
+        self.assertTrue(wait_for(lambda: self.client.request('device', id=65538)['status']))
+        self.assertTrue(wait_for(lambda: self.client.request('group', id=131073)['all_on']))
+
+    def test_skip_unchanged(self):
+        self.assertEqual(self.client.request('power_light', id=65537, value='on', skip_unchanged=True),
+                         {'result': True, 'skipped': 1, 'sent': 0})
+        self.assertEqual(self.client.request('power_group', id=131073, value='on', skip_unchanged=True),
+                         {'result': True, 'skipped': 0, 'sent': 1})
+        self.assertEqual(self.transport.paths('put'), ['15004/131073'])
+
+    def test_socket_is_owned_by_one_daemon(self):
+        with self.assertRaises(RuntimeError):
+            TradfriDaemon(CONFIG, self.path).start()
+
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_shutdown(self):
+        self.assertTrue(self.client.request('shutdown'))
+        self.assertTrue(wait_for(lambda: not os.path.exists(self.path)))
+        self.assertFalse(self.client.is_running())
+
+    def test_stale_socket_is_replaced(self):
+        self.daemon.stop()
+
+        # left behind by a daemon which has been killed
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(self.path)
+
+        self.daemon = TradfriDaemon(CONFIG, self.path, refresh_interval=3600).start()
+        self.assertEqual(self.client.request('ping'), 'pong')
+
+
+if __name__ == '__main__':
+    unittest.main()
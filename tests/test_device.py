@@ -0,0 +1,55 @@
+import unittest
+
+from benchmarks.bench_parsing import load_fixtures
+from tradfri.tradfri_color import COLOR_INDEX
+from tradfri.tradfri_device import parse_tradfri_device, parse_tradfri_devices, TradfriDevice, TradfriLightBulb, \
+                                   TradfriColorLightBulb, TradfriRemote
+
+PRODUCT_INFO = {'0': 'IKEA', '1': 'TRADFRI bulb E27', '3': '1.2'}
+
+
+class ParseTradfriDeviceTest(unittest.TestCase):
+    def setUp(self):
+        self.fixtures = load_fixtures()
+
+    def device(self, light):
+        return {'9001': 'bulb', '9002': 1, '9003': 65537, '3': PRODUCT_INFO, '3311': light}
+
+    def test_classes(self):
+        self.assertIs(type(parse_tradfri_device(self.fixtures['bulbs'][0])), TradfriLightBulb)
+        self.assertIs(type(parse_tradfri_device(self.fixtures['color_bulbs'][0])), TradfriColorLightBulb)
+        self.assertIs(type(parse_tradfri_device(self.fixtures['remotes'][0])), TradfriRemote)
+
+    def test_invalid_light_entries_fall_back_to_device(self):
+        for light in ({'5850': 1}, [], ['5850'], 'x'):
+            self.assertIs(type(parse_tradfri_device(self.device(light))), TradfriDevice)
+
+    def test_unparsable_responses(self):
+        self.assertIsNone(parse_tradfri_device('not json'))
+        self.assertIsNone(parse_tradfri_device('[]'))
+
+    def color_device(self, color, **light):
+        return self.device([dict({'5850': 1, '5851': 254, '5707': 0, '5708': 0, '5706': color}, **light)])
+
+    def test_color_description_from_gateway(self):
+        responses = [self.color_device('4a418a', **{'5709': 45000, '5710': 20000}),
+                     self.color_device('0', **{'5709': 45000, '5710': 20000}),
+                     self.color_device('0')]
+
+        for devices in ([parse_tradfri_device(response) for response in responses], parse_tradfri_devices(responses)):
+            self.assertEqual([type(device) for device in devices], [TradfriColorLightBulb] * 3)
+            self.assertEqual([device.color_description for device in devices],
+                             ['Blue', 'Saturated Red', COLOR_INDEX.from_hs(0, 0)])
+
+    def test_batch_matches_single(self):
+        responses = self.fixtures['bulbs'] + self.fixtures['color_bulbs'] + self.fixtures['remotes'] + ['not json']
+        single    = [parse_tradfri_device(response) for response in responses]
+        batch     = parse_tradfri_devices(responses)
+
+        self.assertEqual([(type(device), device.id, getattr(device, 'color_description', None)) for device in batch],
+                         [(type(device), device.id, getattr(device, 'color_description', None))
+                          for device in single if device is not None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import threading
+import time
+import unittest
+
+from urllib.parse import urlsplit
+
+from coap.coap import Coap
+from coap.coap_policy import CoapRequestPolicy
+from coap.coap_transport import CoapTransport, CoapConnectionError
+from common.parallel import ParallelResult
+from config.config import Config
+from tradfri.tradfri_gateways import GatewayResult, get_tradfri_devices_all, get_tradfri_inventory_all, power_lights
+from tests.resources import ResourceTransport, bulb, group, inventory
+
+CONFIGS = {name: Config(hubip, 'user', 'key', name=name)
+           for name, hubip in (('living', '10.0.0.1'), ('office', '10.0.0.2'), ('garden', '10.0.0.3'))}
+
+
+class GatewaysTransport(CoapTransport):
+    """ routes the requests by host to a ResourceTransport per gateway, hosts without one are unreachable.
+        requests to a host in slow block until release() """
+    scheme = 'coap'
+
+    def __init__(self, gateways: dict, slow=()):
+        self.gateways = gateways
+        self.slow     = set(slow)
+        self.timeouts = []
+        self.released = threading.Event()
+
+    def request(self, method, uri, api_config, payload=None, timeout=None):
+        host = urlsplit(uri).hostname
+
+        if host in self.slow:
+            self.timeouts.append(timeout)
+            self.released.wait()
+
+        if host not in self.gateways:
+            raise CoapConnectionError(f'{method.upper()} {uri} failed: host unreachable')
+
+        return self.gateways[host].request(method, uri, api_config, payload, timeout)
+
+    def release(self):
+        self.released.set()
+
+
+class GatewaysTest(unittest.TestCase):
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        self.policy       = Coap.get_policy()
+
+        living = inventory(bulb(65537), bulb(65538), group(131073, [65537, 65538]))
+        office = inventory(bulb(65537))
+
+        # listed by the gateway but can't be read
+        office['15001'].append(65539)
+
+        self.living    = ResourceTransport(living)
+        self.office    = ResourceTransport(office)
+        self.transport = GatewaysTransport({'10.0.0.1': self.living, '10.0.0.2': self.office})
+
+        Coap.set_transport(self.transport)
+        Coap.set_rate_limiter(None)
+        Coap.set_policy(CoapRequestPolicy(retries=0))
+
+    def tearDown(self):
+        self.transport.release()
+        Coap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+        Coap.set_policy(self.policy)
+
+    def test_results_are_keyed_by_gateway(self):
+        devices = get_tradfri_devices_all(CONFIGS)
+
+        self.assertEqual(sorted(devices.items), [('living', 65537), ('living', 65538), ('office', 65537)])
+        self.assertEqual(devices[('office', 65537)].id, 65537)
+        self.assertEqual(sorted(devices.failed, key=str), [('garden', None), ('office', 65539)])
+        self.assertIsInstance(devices.failed[('garden', None)], CoapConnectionError)
+        self.assertEqual(devices.failed_gateways(), ['garden'])
+
+    def test_inventory(self):
+        devices, groups = get_tradfri_inventory_all(CONFIGS)
+
+        self.assertEqual(len(devices), 3)
+        self.assertEqual([group.id for group in groups], [131073])
+        self.assertEqual((devices.failed_gateways(), groups.failed_gateways()), (['garden'], ['garden']))
+
+    def test_slow_gateways_do_not_delay_the_others(self):
+        self.transport.slow.add('10.0.0.2')
+
+        start   = time.monotonic()
+        devices = get_tradfri_devices_all(CONFIGS, timeout=.2)
+
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(sorted(devices.items), [('living', 65537), ('living', 65538)])
+        self.assertEqual(devices.failed_gateways(), ['garden', 'office'])
+        self.assertIsInstance(devices.failed[('office', None)], TimeoutError)
+
+        # the timeout is the Coap deadline of the slow gateway as well
+        self.assertLessEqual(self.transport.timeouts[0], .2)
+
+    def test_commands(self):
+        result = power_lights(CONFIGS, [('living', 65537), ('office', 65537), ('office', 65540), ('garden', 65537)],
+                              'off')
+
+        self.assertEqual(sorted(result.items), [('living', 65537), ('office', 65537)])
+        self.assertEqual(sorted(result.failed), [('garden', 65537), ('office', 65540)])
+        self.assertEqual(self.living.resources['15001/65537']['3311'][0]['5850'], 0)
+        self.assertEqual(self.living.resources['15001/65538']['3311'][0]['5850'], 1)
+
+        with self.assertRaises(ValueError):
+            power_lights(CONFIGS, [('attic', 65537)], 'on')
+
+
+class GatewayResultTest(unittest.TestCase):
+    def test_add(self):
+        class Item:
+            def __init__(self, id):
+                self.id = id
+
+        result = GatewayResult()
+        result.add('living', ParallelResult([Item(65537), Item(65538)], {65539: ValueError('could not parse')}))
+
+        self.assertEqual(sorted(result.items), [('living', 65537), ('living', 65538)])
+        self.assertEqual(list(result.failed), [('living', 65539)])
+        self.assertEqual(result.failed_gateways(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+
+from coap.coap import Coap
+from tradfri.tradfri_batch import set_devices_state
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_index import TradfriInventoryIndex
+from tests.resources import CONFIG, ResourceTransport, bulb, remote, group, inventory, devices, groups
+
+
+class FakeObserver:
+    def __init__(self, devices: list, groups: list):
+        self.devices   = {device.id: device for device in devices}
+        self.groups    = {group.id: group for group in groups}
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def notify(self, endpoint: TradfriEndpoint, id, obj):
+        for listener in self.listeners:
+            listener(endpoint, id, obj)
+
+
+class TradfriInventoryIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = TradfriInventoryIndex(devices(bulb(65537), bulb(65538, 0, 100), remote(65539)),
+                                           groups(group(131073, [65537, 65538, 65539]), group(131074, [65538])))
+
+    def test_reverse_lookups(self):
+        self.assertEqual(self.index.groups_of(65538), [131073, 131074])
+        self.assertEqual(self.index.groups_of(65540), [])
+        self.assertEqual(self.index.devices_of(131073), [65537, 65538, 65539])
+
+    def test_group_update_only_touches_changed_memberships(self):
+        self.index.update_group(groups(group(131074, [65537]))[0])
+
+        self.assertEqual(self.index.groups_of(65537), [131073, 131074])
+        self.assertEqual(self.index.groups_of(65538), [131073])
+
+        self.index.remove_group(131073)
+        self.assertEqual(self.index.groups_of(65538), [])
+        self.assertNotIn(131073, self.index.groups)
+
+    def test_group_state(self):
+        state = self.index.group_state(131073)
+
+        self.assertEqual((state.any_on, state.all_on, state.lights, state.unknown), (True, False, 2, 0))
+        self.assertEqual(state.mean_brightness,
+                         round((self.index.devices[65537].brightness + self.index.devices[65538].brightness) / 2, 2))
+
+    def test_group_state_of_unknown_members(self):
+        self.index.remove_device(65538)
+        state = self.index.group_state(131074)
+
+        self.assertEqual((state.any_on, state.all_on, state.mean_brightness, state.lights, state.unknown),
+                         (False, False, None, 0, 1))
+
+    def test_follows_an_observer(self):
+        observer = FakeObserver(devices(bulb(65537)), groups(group(131073, [65537])))
+        index    = TradfriInventoryIndex().add_to(observer)
+
+        self.assertEqual(index.groups_of(65537), [131073])
+
+        observer.notify(TradfriEndpoint.DEVICE, 65538, devices(bulb(65538))[0])
+        observer.notify(TradfriEndpoint.GROUP, 131073, groups(group(131073, [65538]))[0])
+        observer.notify(TradfriEndpoint.DEVICE, 65537, None)
+
+        self.assertEqual(sorted(index.devices), [65538])
+        self.assertEqual(index.groups_of(65537), [])
+        self.assertEqual(index.groups_of(65538), [131073])
+
+
+class IndexBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        self.transport    = ResourceTransport(inventory(bulb(65537), bulb(65538), group(131073, [65537, 65538])))
+
+        Coap.set_rate_limiter(None)
+        self.transport.install()
+
+    def tearDown(self):
+        Coap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+
+    def test_groups_and_devices_come_from_the_index(self):
+        index = TradfriInventoryIndex(devices(bulb(65537), bulb(65538)), groups(group(131073, [65537, 65538])))
+        set_devices_state(CONFIG, [65537, 65538], on=False, index=index)
+
+        self.assertEqual(self.transport.paths(), ['15004/131073'])
+
+    def test_member_not_in_the_index_yet(self):
+        index = TradfriInventoryIndex(devices(bulb(65537)), groups(group(131073, [65537, 65538])))
+        set_devices_state(CONFIG, [65537], on=False, index=index)
+
+        self.assertEqual(self.transport.paths(), ['15001/65537'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+from coap.coap import Coap
+from config.config import Config
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_inventory_cache import TradfriInventoryCache
+from tests.resources import ResourceTransport, bulb, remote, group, inventory
+
+
+class TradfriInventoryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        self.directory    = tempfile.TemporaryDirectory()
+        self.config       = Config('127.0.0.1', 'user', 'key')
+        self.transport    = ResourceTransport(inventory(bulb(65537), remote(65538), group(131073, [65537, 65538])))
+
+        Coap.set_rate_limiter(None)
+        Coap.set_transport(self.transport)
+
+    def tearDown(self):
+        Coap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+        self.directory.cleanup()
+
+    def refresh(self, max_age=None):
+        self.transport.requests = []
+        path            = os.path.join(self.directory.name, 'tradfri.cache')
+        devices, groups  = TradfriInventoryCache(self.config, path).refresh(max_age=max_age)
+
+        self.assertEqual([device.id for device in devices], [65537, 65538])
+        self.assertEqual([group.id for group in groups], [131073])
+        return sorted(self.transport.paths())
+
+    def test_fresh_state_is_not_fetched_again(self):
+        self.assertEqual(self.refresh(), ['15001', '15001/65537', '15001/65538', '15004', '15004/131073'])
+        self.assertEqual(self.refresh(), ['15001', '15004'])
+
+    def test_stale_state_is_fetched_again(self):
+        self.refresh()
+        self.assertEqual(self.refresh(max_age=0), ['15001', '15001/65537', '15004', '15004/131073'])
+
+    def test_removed_resources_are_dropped(self):
+        self.refresh()
+        self.transport.resources['15001'] = [65537]
+
+        self.transport.requests = []
+        cache      = TradfriInventoryCache(self.config, os.path.join(self.directory.name, 'tradfri.cache'))
+        devices, _ = cache.refresh()
+
+        self.assertEqual([device.id for device in devices], [65537])
+        self.assertEqual(sorted(cache.fetched[TradfriEndpoint.DEVICE]), ['65537'])
+
+    def test_default_path_per_gateway(self):
+        office    = TradfriInventoryCache.get_default_path(Config('10.0.0.2', 'user', 'key', name='office'))
+        warehouse = TradfriInventoryCache.get_default_path(Config('10.0.0.3', 'user', 'key', name='warehouse'))
+        default   = TradfriInventoryCache.get_default_path(Config('10.0.0.2', 'user', 'key'))
+
+        self.assertNotEqual(office, warehouse)
+        self.assertEqual(office, default)
+
+
+if __name__ == '__main__':
+    unittest.main()
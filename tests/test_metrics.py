@@ -0,0 +1,119 @@
+import json
+import unittest
+
+from coap.coap import Coap
+from coap.coap_message import CoapMessage
+from coap.coap_metrics import CoapMetrics, Histogram, record_phase
+from coap.coap_policy import CoapRequestPolicy
+from coap.coap_transport import CoapError, CoapTimeoutError
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tests.resources import CONFIG, ScriptedTransport
+
+
+class PhaseTransport(ScriptedTransport):
+    """ records a wait phase for every request like the socket transports do """
+    def request(self, method, uri, api_config, payload=None, timeout=None):
+        record_phase('wait', .001)
+        return super().request(method, uri, api_config, payload, timeout)
+
+
+class HistogramTest(unittest.TestCase):
+    def test_cumulative(self):
+        histogram = Histogram((.1, 1))
+
+        for value in (.05, .5, .5, 5):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.cumulative(), [(.1, 1), (1, 3), (float('inf'), 4)])
+        self.assertEqual(histogram.as_dict()['buckets'], {'0.1': 1, '1': 3, '+Inf': 4})
+
+
+class CoapMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics      = CoapMetrics()
+        self.previous     = Coap.get_metrics()
+        self.rate_limiter = Coap.get_rate_limiter()
+        self.policy       = Coap.get_policy()
+        self.events       = []
+
+        self.metrics.add_hook(self.events.append)
+        Coap.set_metrics(self.metrics)
+        Coap.set_rate_limiter(None)
+        Coap.set_policy(CoapRequestPolicy(backoff=.001))
+
+    def tearDown(self):
+        Coap.set_transport(None)
+        Coap.set_metrics(self.previous)
+        Coap.set_rate_limiter(self.rate_limiter)
+        Coap.set_policy(self.policy)
+
+    def requests(self):
+        return {(request['endpoint'], request['method']): request for request in self.metrics.snapshot()['requests']}
+
+    def test_successful_request(self):
+        PhaseTransport('[65537]').install()
+        Coap.get(CONFIG, TradfriEndpoint.DEVICE)
+        Coap.put('{"3311": [{"5850": 1}]}', CONFIG, TradfriEndpoint.DEVICE, 65537)
+
+        get, put = self.requests()[('device', 'get')], self.requests()[('device', 'put')]
+
+        self.assertEqual((get['outcomes'], get['bytes_in'], get['latency']['count']), ({'ok': 1}, 7, 1))
+        self.assertEqual((put['outcomes'], put['bytes_out']), ({'ok': 1}, 23))
+        self.assertEqual(sorted(self.metrics.snapshot()['phases']), ['parse', 'wait'])
+        self.assertEqual(self.metrics.snapshot()['phases']['wait']['count'], 2)
+
+    def test_every_attempt_is_counted(self):
+        rejection = CoapError('rejected', CoapMessage.CODE_SERVICE_UNAVAILABLE)
+        ScriptedTransport(CoapTimeoutError('timeout'), rejection, '', '[]').install()
+        Coap.set_policy(CoapRequestPolicy(retries=3, backoff=.001))
+        Coap.get(CONFIG, TradfriEndpoint.GROUP)
+
+        self.assertEqual(self.requests()[('group', 'get')]['outcomes'], {'timeout': 1, 'rejected': 2, 'ok': 1})
+        self.assertEqual([event.outcome for event in self.events], ['timeout', 'rejected', 'rejected', 'ok'])
+
+    def test_errors_are_counted(self):
+        ScriptedTransport(CoapError('not found', 0x84)).install()
+
+        with self.assertRaises(CoapError):
+            Coap.get(CONFIG, TradfriEndpoint.DEVICE, 65537)
+
+        self.assertEqual(self.requests()[('device', 'get')]['outcomes'], {'error': 1})
+        self.assertEqual(self.events[0].error.code, 0x84)
+
+    def test_broken_hooks_do_not_fail_requests(self):
+        def broken(event):
+            raise RuntimeError('broken')
+
+        self.metrics.add_hook(broken)
+        ScriptedTransport('[]').install()
+
+        self.assertEqual(Coap.get(CONFIG, TradfriEndpoint.DEVICE), [])
+        self.assertEqual(len(self.events), 1)
+
+    def test_exports(self):
+        ScriptedTransport('[]').install()
+        Coap.get(CONFIG, TradfriEndpoint.DEVICE)
+
+        prometheus = self.metrics.to_prometheus()
+
+        self.assertIn('tradfri_coap_requests_total{endpoint="device",method="get",outcome="ok"} 1', prometheus)
+        self.assertIn('tradfri_coap_request_duration_seconds_count{endpoint="device",method="get"} 1', prometheus)
+        self.assertEqual(json.loads(self.metrics.to_json()), self.metrics.snapshot())
+
+        self.metrics.reset()
+        self.assertEqual(self.metrics.snapshot(), {'requests': [], 'phases': {}})
+
+    def test_disabled(self):
+        Coap.set_metrics(None)
+        PhaseTransport('[]').install()
+
+        self.assertEqual(Coap.get(CONFIG, TradfriEndpoint.DEVICE), [])
+        self.assertEqual(self.events, [])
+
+        # phases recorded outside of a request are dropped
+        record_phase('wait', 1)
+        self.assertEqual(self.metrics.snapshot()['phases'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
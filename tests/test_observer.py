@@ -0,0 +1,100 @@
+import json
+import unittest
+
+from urllib.parse import urlsplit
+
+from coap.coap import Coap
+from coap.coap_transport import CoapError, CoapObservation
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_observer import TradfriObserver
+from tests.resources import CONFIG, ResourceTransport, bulb, group, inventory, wait_for
+
+
+class ObservingTransport(ResourceTransport):
+    """ a ResourceTransport which also serves observations, notify(path) sends the current state of path to its
+        observers """
+    def __init__(self, resources: dict):
+        super().__init__(resources)
+        self.observations = {}
+
+    def observe(self, uri, api_config, callback, timeout=None):
+        path = urlsplit(uri).path.strip('/')
+
+        if path not in self.resources:
+            raise CoapError(f'GET {uri} failed with 4.04', 0x84)
+
+        observation = CoapObservation(uri, callback)
+        self.observations[path] = observation
+        callback(json.dumps(self.resources[path]))
+        return observation
+
+    def notify(self, path):
+        observation = self.observations.get(path)
+
+        if observation is not None and observation.active:
+            observation.callback(json.dumps(self.resources[path]))
+
+
+class TradfriObserverTest(unittest.TestCase):
+    def setUp(self):
+        self.transport = ObservingTransport(inventory(bulb(65537), bulb(65538), group(131073, [65537, 65538])))
+        self.transport.install()
+
+        self.changes  = []
+        self.observer = TradfriObserver(CONFIG)
+        self.observer.add_listener(lambda endpoint, id, obj: self.changes.append((endpoint, id, obj)))
+        self.observer.start()
+
+    def tearDown(self):
+        self.observer.stop()
+        Coap.set_transport(None)
+
+    def test_start_populates_the_mirror(self):
+        self.assertEqual(sorted(self.observer.devices), [65537, 65538])
+        self.assertEqual(list(self.observer.groups), [131073])
+        self.assertTrue(self.observer.get_device(65537).status)
+        self.assertEqual(sorted(self.transport.observations),
+                         ['15001', '15001/65537', '15001/65538', '15004', '15004/131073'])
+
+    def test_notifications_update_the_mirror(self):
+        self.changes.clear()
+        self.transport.resources['15001/65537']['3311'][0]['5850'] = 0
+        self.transport.notify('15001/65537')
+
+        self.assertFalse(self.observer.get_device(65537).status)
+        self.assertEqual([(endpoint, id) for endpoint, id, _ in self.changes], [(TradfriEndpoint.DEVICE, 65537)])
+
+    def test_removed_resources_are_dropped(self):
+        observation = self.transport.observations['15001/65538']
+        self.changes.clear()
+
+        self.transport.resources['15001'].remove(65538)
+        self.transport.notify('15001')
+
+        self.assertIsNone(self.observer.get_device(65538))
+        self.assertFalse(observation.active)
+        self.assertEqual(self.changes, [(TradfriEndpoint.DEVICE, 65538, None)])
+
+        # a notification which was already on its way when the device was removed is ignored
+        self.observer._on_notification(TradfriEndpoint.DEVICE, 65538, self.transport.resources['15001/65538'])
+        self.assertIsNone(self.observer.get_device(65538))
+
+    def test_added_resources_are_observed(self):
+        self.transport.resources.update(inventory(bulb(65539)))
+        self.transport.resources['15001'] = [65537, 65538, 65539]
+        self.transport.notify('15001')
+
+        self.assertTrue(wait_for(lambda: self.observer.get_device(65539) is not None))
+        self.assertIn('15001/65539', self.transport.observations)
+
+    def test_lapsed_observations_are_registered_again(self):
+        lapsed = self.transport.observations['15004/131073']
+        lapsed.cancel()
+        self.observer._wakeup.set()
+
+        self.assertTrue(wait_for(lambda: self.transport.observations['15004/131073'] is not lapsed))
+        self.assertTrue(self.transport.observations['15004/131073'].active)
+
+
+if __name__ == '__main__':
+    unittest.main()
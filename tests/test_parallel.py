@@ -0,0 +1,122 @@
+import contextvars
+import threading
+import time
+import unittest
+
+from coap import coap_policy
+from coap.coap import Coap
+from common.parallel import ParallelFetcher
+from tradfri.tradfri_device import get_tradfri_devices_parallel, iter_tradfri_devices
+from tests.resources import CONFIG, ResourceTransport, bulb, inventory
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+
+
+class InFlight:
+    """ a fetch which records how many calls are running at the same time """
+    def __init__(self, delay: float=0.02):
+        self.delay   = delay
+        self.lock    = threading.Lock()
+        self.current = 0
+        self.maximum = 0
+
+    def __call__(self, id):
+        with self.lock:
+            self.current += 1
+            self.maximum  = max(self.maximum, self.current)
+
+        try:
+            time.sleep(self.delay)
+        finally:
+            with self.lock:
+                self.current -= 1
+
+        if id == 'broken':
+            raise ValueError('broken')
+
+        return None if id == 'unparsable' else id
+
+
+class ParallelFetcherTest(unittest.TestCase):
+    def test_max_in_flight_is_bounded(self):
+        fetch = InFlight()
+
+        with ParallelFetcher(2) as fetcher:
+            self.assertEqual(list(fetcher.map(fetch, range(10))), list(range(10)))
+
+        self.assertEqual(fetch.maximum, 2)
+
+    def test_imap_is_bounded(self):
+        fetch  = InFlight()
+        failed = {}
+
+        with ParallelFetcher(3) as fetcher:
+            items = list(fetcher.imap(fetch, ['broken', 'unparsable'] + list(range(12)), failed))
+
+        self.assertEqual(sorted(items), list(range(12)))
+        self.assertEqual(set(failed), {'broken', 'unparsable'})
+        self.assertLessEqual(fetch.maximum, 3)
+
+    def test_failed_fetches_are_reported(self):
+        with ParallelFetcher(2) as fetcher:
+            result = fetcher.map(InFlight(0), [1, 'broken', 2, 'unparsable'])
+
+        self.assertEqual(result.items, [1, 2])
+        self.assertIsInstance(result.failed['broken'], ValueError)
+        self.assertIsInstance(result.failed['unparsable'], ValueError)
+
+    def test_invalid_max_in_flight(self):
+        with self.assertRaises(ValueError):
+            ParallelFetcher(0)
+
+    def test_context_is_carried_to_the_threads(self):
+        fetch = lambda id: (_request_id.get(), coap_policy.remaining())
+
+        with ParallelFetcher(1) as fetcher:
+            token = _request_id.set('outer')
+
+            try:
+                with coap_policy.deadline(30):
+                    result = fetcher.map(fetch, range(4))
+            finally:
+                _request_id.reset(token)
+
+            for request_id, remaining in result:
+                self.assertEqual(request_id, 'outer')
+                self.assertTrue(0 < remaining <= 30)
+
+            # the pooled thread doesn't keep the context of the earlier fetches
+            self.assertEqual(list(fetcher.map(fetch, [0])), [(None, None)])
+
+
+class ParallelDevicesTest(unittest.TestCase):
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        resources         = inventory(bulb(65537), bulb(65538), bulb(65539))
+
+        # the gateway lists a device which can't be fetched
+        resources['15001'].append(65540)
+        self.transport = ResourceTransport(resources).install()
+
+        Coap.set_rate_limiter(None)
+
+    def tearDown(self):
+        Coap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+
+    def test_get_devices_parallel(self):
+        result = get_tradfri_devices_parallel(CONFIG, max_in_flight=2)
+
+        self.assertEqual([device.id for device in result], [65537, 65538, 65539])
+        self.assertEqual(list(result.failed), [65540])
+
+    def test_iter_devices(self):
+        failed  = {}
+        devices = list(iter_tradfri_devices(CONFIG, max_in_flight=2, failed=failed))
+
+        self.assertEqual(sorted(device.id for device in devices), [65537, 65538, 65539])
+        self.assertEqual(list(failed), [65540])
+
+
+if __name__ == '__main__':
+    unittest.main()
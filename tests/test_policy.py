@@ -0,0 +1,158 @@
+import threading
+import time
+import unittest
+
+from coap import coap_policy
+from coap.coap import Coap
+from coap.coap_policy import CoapRequestPolicy
+from coap.coap_transport import CoapTransport, CoapError, CoapTimeoutError, CoapResponseError
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tests.resources import CONFIG, ScriptedTransport
+
+
+class SlowTransport(CoapTransport):
+    """ the nth request takes delays[n] seconds (the last delay is repeated) and times out if that is longer
+        than its timeout, every request is recorded with its timeout """
+    scheme = 'coap'
+
+    def __init__(self, *delays):
+        self.delays   = list(delays)
+        self.timeouts = []
+        self.lock     = threading.Lock()
+
+    def request(self, method, uri, api_config, payload=None, timeout=None):
+        with self.lock:
+            delay = self.delays[min(len(self.timeouts), len(self.delays) - 1)]
+            self.timeouts.append(timeout)
+
+        time.sleep(min(delay, timeout))
+
+        if delay > timeout:
+            raise CoapTimeoutError(f'{method.upper()} {uri} timed out')
+
+        return f'[{delay}]'
+
+
+class CoapRequestPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        self.previous     = Coap.get_policy()
+        self.policy       = CoapRequestPolicy(backoff=.001)
+
+        Coap.set_rate_limiter(None)
+        Coap.set_policy(self.policy)
+
+    def tearDown(self):
+        self.policy.close()
+        Coap.set_transport(None)
+        Coap.set_policy(self.previous)
+        Coap.set_rate_limiter(self.rate_limiter)
+
+    def test_timeouts_are_retried(self):
+        transport = ScriptedTransport(CoapTimeoutError('timeout'), CoapTimeoutError('timeout'), '[]').install()
+
+        self.assertEqual(Coap.get(CONFIG, TradfriEndpoint.DEVICE), [])
+        self.assertEqual((len(transport.requests), self.policy.retried), (3, 2))
+
+        transport = ScriptedTransport(CoapTimeoutError('timeout')).install()
+
+        with self.assertRaises(CoapTimeoutError):
+            Coap.put('{"5850": 1}', CONFIG, TradfriEndpoint.GROUP, 131073)
+
+        self.assertEqual(len(transport.requests), 3)
+
+    def test_invalid_payloads_are_retried(self):
+        transport = ScriptedTransport('{"9003": ', '[]').install()
+
+        self.assertEqual(Coap.get(CONFIG, TradfriEndpoint.DEVICE), [])
+        self.assertEqual(len(transport.requests), 2)
+
+        Coap.set_policy(CoapRequestPolicy(retries=0))
+        ScriptedTransport('{"9003": ').install()
+
+        with self.assertRaises(CoapResponseError):
+            Coap.get(CONFIG, TradfriEndpoint.DEVICE)
+
+    def test_posts_and_errors_are_not_retried(self):
+        transport = ScriptedTransport(CoapTimeoutError('timeout'), '').install()
+
+        with self.assertRaises(CoapTimeoutError):
+            Coap.post('{"9001": "scene"}', CONFIG, TradfriEndpoint.SCENE, 131073, False)
+
+        self.assertEqual(len(transport.requests), 1)
+
+        transport = ScriptedTransport(CoapError('not found', 0x84), '[]').install()
+
+        with self.assertRaises(CoapError):
+            Coap.get(CONFIG, TradfriEndpoint.DEVICE, 65537)
+
+        self.assertEqual((len(transport.requests), self.policy.retried), (1, 0))
+
+    def test_deadline(self):
+        Coap.set_policy(CoapRequestPolicy(timeout=1, retries=100, backoff=.001))
+        transport = SlowTransport(10)
+        start     = time.monotonic()
+
+        Coap.set_transport(transport)
+
+        with self.assertRaises(CoapTimeoutError), coap_policy.deadline(.2):
+            Coap.get(CONFIG, TradfriEndpoint.DEVICE)
+
+        # the attempts share the deadline instead of getting a timeout each
+        self.assertLess(time.monotonic() - start, .5)
+        self.assertTrue(all(timeout <= .2 for timeout in transport.timeouts))
+        self.assertIsNone(coap_policy.remaining())
+
+    def test_nested_deadlines_only_shorten(self):
+        with coap_policy.deadline(10):
+            with coap_policy.deadline(60):
+                self.assertLessEqual(coap_policy.remaining(), 10)
+
+            with coap_policy.deadline(1):
+                self.assertLessEqual(coap_policy.remaining(), 1)
+
+            self.assertGreater(coap_policy.remaining(), 1)
+
+    def test_slow_gets_are_hedged(self):
+        Coap.set_policy(CoapRequestPolicy(hedge_percentile=50, hedge_min_samples=3))
+        policy = Coap.get_policy()
+
+        for _ in range(3):
+            policy.record_latency(CONFIG.hubip, .01)
+
+        transport = SlowTransport(.5, 0)
+        start     = time.monotonic()
+
+        Coap.set_transport(transport)
+
+        try:
+            self.assertEqual(Coap.get(CONFIG, TradfriEndpoint.DEVICE), [0])
+        finally:
+            policy.close()
+
+        self.assertLess(time.monotonic() - start, .4)
+        self.assertEqual((len(transport.timeouts), policy.hedged), (2, 1))
+
+    def test_hedging_needs_samples(self):
+        policy = CoapRequestPolicy(hedge_percentile=90, hedge_min_samples=2)
+        policy.record_latency(CONFIG.hubip, .2)
+
+        self.assertIsNone(policy.hedge_delay(CONFIG.hubip))
+        self.assertIsNone(CoapRequestPolicy().hedge_delay(CONFIG.hubip))
+
+        policy.record_latency(CONFIG.hubip, .3)
+        self.assertEqual(policy.hedge_delay(CONFIG.hubip), .3)
+
+    def test_backoff(self):
+        policy = CoapRequestPolicy(backoff=.1, max_backoff=.3)
+
+        for attempt in range(6):
+            self.assertTrue(0 <= policy.retry_delay(attempt) <= min(.3, .1 * 2 ** attempt))
+
+        for arguments in ({'timeout': 0}, {'retries': -1}, {'hedge_percentile': 100}):
+            with self.assertRaises(ValueError):
+                CoapRequestPolicy(**arguments)
+
+
+if __name__ == '__main__':
+    unittest.main()
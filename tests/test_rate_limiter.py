@@ -0,0 +1,46 @@
+import unittest
+
+from coap.coap_rate_limiter import CoapRateLimiter
+
+
+class CoapRateLimiterTest(unittest.TestCase):
+    def test_burst_then_wait(self):
+        limiter = CoapRateLimiter(rate=10, burst=2)
+
+        self.assertEqual(limiter.reserve('hub'), 0)
+        self.assertEqual(limiter.reserve('hub'), 0)
+        self.assertAlmostEqual(limiter.reserve('hub'), .1, delta=.01)
+        self.assertAlmostEqual(limiter.reserve('hub'), .2, delta=.01)
+
+    def test_gateways_have_their_own_bucket(self):
+        limiter = CoapRateLimiter(rate=10, burst=1)
+
+        self.assertEqual(limiter.reserve('office'), 0)
+        self.assertEqual(limiter.reserve('warehouse'), 0)
+        self.assertGreater(limiter.reserve('office'), 0)
+
+    def test_failure_halves_the_rate_and_drops_the_burst(self):
+        limiter = CoapRateLimiter(rate=10, min_rate=3, burst=4)
+        limiter.report_failure('hub')
+
+        self.assertEqual(limiter.rate('hub'), 5)
+        self.assertGreater(limiter.reserve('hub'), 0)
+
+        limiter.report_failure('hub')
+        self.assertEqual(limiter.rate('hub'), 3)
+
+    def test_success_recovers_up_to_max_rate(self):
+        limiter = CoapRateLimiter(rate=10, max_rate=10.5, recovery=.25)
+        limiter.report_failure('hub')
+        limiter.report_success('hub')
+
+        self.assertEqual(limiter.rate('hub'), 5.25)
+
+        for _ in range(100):
+            limiter.report_success('hub')
+
+        self.assertEqual(limiter.rate('hub'), 10.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
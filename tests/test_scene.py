@@ -0,0 +1,93 @@
+import json
+import unittest
+
+from coap.coap import Coap
+from tradfri.tradfri_scene import TradfriScene, get_tradfri_scenes, get_tradfri_scenes_parallel, get_light_settings
+from tests.resources import CONFIG, ResourceTransport, bulb, remote, group, inventory
+
+
+def scene(id, name: str, settings: list):
+    return {'9003': id, '9001': name, '9057': 0, '9068': 0, '15013': settings}
+
+
+class SceneTransport(ResourceTransport):
+    """ a ResourceTransport which creates a scene for a POST to a group's scene list, like the gateway """
+    def request(self, method, uri, api_config, payload=None, timeout=None):
+        if method != 'post':
+            return super().request(method, uri, api_config, payload, timeout)
+
+        path = uri.split('/', 3)[3]
+        id   = max(self.resources[path]) + 1
+        self.requests.append((method, path, json.loads(payload)))
+
+        self.resources[path].append(id)
+        self.resources[f'{path}/{id}'] = dict(json.loads(payload), **{'9003': id})
+        return ''
+
+
+class TradfriSceneTest(unittest.TestCase):
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        resources         = inventory(bulb(65537), bulb(65538, on=0, brightness=50), remote(65539),
+                                      group(131073, [65537, 65538, 65539]))
+
+        resources.update({
+            '15005':               [131073],
+            '15005/131073':        [196608],
+            '15005/131073/196608': scene(196608, 'evening', [{'9003': 65537, '5850': 1, '5851': 100}]),
+        })
+        self.transport = SceneTransport(resources).install()
+
+        Coap.set_rate_limiter(None)
+
+    def tearDown(self):
+        Coap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+
+    def test_get_scenes(self):
+        scenes = get_tradfri_scenes(CONFIG, 131073)
+
+        self.assertEqual([(scene.id, scene.group_id, scene.name, scene.device_ids) for scene in scenes],
+                         [(196608, 131073, 'evening', [65537])])
+
+        # listed but can't be read
+        self.transport.resources['15005/131073'].append(196609)
+        result = get_tradfri_scenes_parallel(CONFIG)
+
+        self.assertEqual([scene.id for scene in result], [196608])
+        self.assertEqual(list(result.failed), [(131073, 196609)])
+
+    def test_activate(self):
+        TradfriScene.activate_static(131073, 196608, CONFIG)
+
+        self.assertEqual(self.transport.requests, [('put', '15004/131073', {'5850': 1, '9039': 196608})])
+
+    def test_light_settings(self):
+        self.assertEqual(get_light_settings(CONFIG, [65537, 65538, 65539]),
+                         [{'9003': 65537, '5850': 1, '5851': 200, '5706': 'f1e0b5'},
+                          {'9003': 65538, '5850': 0, '5851': 50, '5706': 'f1e0b5'}])
+
+        with self.assertRaises(ValueError):
+            get_light_settings(CONFIG, [65537, 65540])
+
+    def test_save_updates_a_scene(self):
+        self.assertEqual(TradfriScene.save_static(131073, 'evening', CONFIG, [65538], 196608), 196608)
+
+        self.assertEqual(self.transport.requests[-1], ('put', '15005/131073/196608', {
+            '9001': 'evening', '15013': [{'9003': 65538, '5850': 0, '5851': 50, '5706': 'f1e0b5'}]
+        }))
+        self.assertEqual(self.transport.paths('post'), [])
+
+    def test_save_creates_a_scene(self):
+        id = TradfriScene.save_static(131073, 'night', CONFIG)
+
+        self.assertEqual(id, 196609)
+        self.assertEqual(self.transport.paths('post'), ['15005/131073'])
+
+        created = TradfriScene.get_scene(CONFIG, 131073, id)
+
+        self.assertEqual((created.name, created.predefined, created.device_ids), ('night', 0, [65537, 65538]))
+
+
+if __name__ == '__main__':
+    unittest.main()
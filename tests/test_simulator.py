@@ -0,0 +1,41 @@
+import unittest
+
+from coap.coap import Coap
+from coap.coap_transport import UdpTransport
+from config.config import Config
+from simulator.gateway_simulator import GatewaySimulator
+from tradfri.tradfri_device import get_tradfri_devices_parallel
+from tradfri.tradfri_group import get_tradfri_groups
+from tradfri import tradfriActions
+from tradfri.tradfri_endpoint import TradfriEndpoint
+
+
+class GatewaySimulatorTest(unittest.TestCase):
+    """ drives the framework end to end against the gateway simulator over plain UDP """
+    def setUp(self):
+        self.simulator = GatewaySimulator(bulbs=4, color_bulbs=2, remotes=1, groups=2, seed=1).start()
+        self.config    = Config('127.0.0.1', 'user', 'key')
+
+        Coap.set_transport(UdpTransport(self.simulator.port))
+
+    def tearDown(self):
+        Coap.set_transport(None)
+        self.simulator.stop()
+
+    def test_inventory(self):
+        devices = get_tradfri_devices_parallel(self.config, 4)
+        groups  = get_tradfri_groups(self.config)
+
+        self.assertEqual(devices.failed, {})
+        self.assertEqual(sorted(device.id for device in devices), self.simulator.device_ids)
+        self.assertEqual(sorted(group.id for group in groups), self.simulator.group_ids)
+
+    def test_power(self):
+        id = self.simulator.device_ids[0]
+
+        tradfriActions.tradfri_power_light(self.config.hubip, self.config.apiuser, self.config.apikey, id, 'off')
+        self.assertEqual(Coap.get(self.config, TradfriEndpoint.DEVICE, id)['3311'][0]['5850'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import unittest
+
+from coap.coap import Coap
+from coap.coap_cache import CoapCache
+from coap.coap_state_filter import CoapStateFilter, contains, skipping
+from tradfri import tradfriActions
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_scene import TradfriScene
+from tests.resources import CONFIG, ResourceTransport, bulb, remote, group, inventory
+
+
+class ContainsTest(unittest.TestCase):
+    def test_contains(self):
+        current = {'5850': 1, '3311': [{'5850': 1, '5851': 200}]}
+
+        self.assertTrue(contains(current, {'3311': [{'5851': 200}]}))
+        self.assertFalse(contains(current, {'3311': [{'5851': 100}]}))
+        self.assertFalse(contains(current, {'5712': 10}))
+        self.assertFalse(contains({'3311': []}, {'3311': [{'5850': 1}]}))
+
+    def test_dimming_a_light_which_is_off_is_a_change(self):
+        off = {'3311': [{'5850': 0, '5851': 200}]}
+
+        self.assertFalse(CoapStateFilter.is_unchanged({'3311': [{'5851': 200}]}, off))
+        self.assertTrue(CoapStateFilter.is_unchanged({'3311': [{'5850': 0, '5851': 200}]}, off))
+        self.assertFalse(CoapStateFilter.is_unchanged({'5851': 200}, {}, [off]))
+
+
+class CoapStateFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        self.state_filter = CoapStateFilter(CoapStateFilter.SOURCE_READ)
+
+        Coap.set_rate_limiter(None)
+
+    def tearDown(self):
+        Coap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+        Coap.set_cache(None)
+
+    def install(self, *resources):
+        self.transport = ResourceTransport(inventory(*resources)).install()
+
+    def put(self, payload: dict, endpoint: TradfriEndpoint, id):
+        with skipping(self.state_filter):
+            Coap.put(json.dumps(payload), CONFIG, endpoint, id, False)
+
+        return self.transport.paths('put')
+
+    def test_device(self):
+        self.install(bulb(65537, on=1))
+
+        self.assertEqual(self.put({'3311': [{'5850': 1}]}, TradfriEndpoint.DEVICE, 65537), [])
+        self.assertEqual(self.put({'3311': [{'5850': 0}]}, TradfriEndpoint.DEVICE, 65537), ['15001/65537'])
+        self.assertEqual((self.state_filter.skipped, self.state_filter.sent), (1, 1))
+
+    def test_dimming_a_light_which_is_off(self):
+        self.install(bulb(65537, on=0, brightness=200), group(131073, [65537], on=0, brightness=200))
+
+        self.assertEqual(self.put({'3311': [{'5851': 200}]}, TradfriEndpoint.DEVICE, 65537), ['15001/65537'])
+
+    def test_group_is_compared_with_its_members(self):
+        # the group still holds the last group command, its only light has been switched off since
+        self.install(bulb(65537, on=0), remote(65538), group(131073, [65537, 65538], on=1))
+
+        with skipping(self.state_filter):
+            tradfriActions.tradfri_power_group(CONFIG.hubip, CONFIG.apiuser, CONFIG.apikey, 131073, 'on')
+
+        self.assertEqual(self.transport.paths('put'), ['15004/131073'])
+
+    def test_group_is_skipped_if_all_lights_match(self):
+        self.install(bulb(65537), bulb(65538), remote(65539), group(131073, [65537, 65538, 65539], on=0))
+
+        self.assertEqual(self.put({'5850': 1}, TradfriEndpoint.GROUP, 131073), [])
+        self.assertEqual(sorted(self.transport.paths('get')),
+                         ['15001/65537', '15001/65538', '15001/65539', '15004/131073'])
+
+    def test_members_are_read_until_one_differs(self):
+        self.install(bulb(65537, on=0), bulb(65538), group(131073, [65537, 65538]))
+
+        self.assertEqual(self.put({'5850': 1}, TradfriEndpoint.GROUP, 131073), ['15004/131073'])
+        self.assertNotIn('15001/65538', self.transport.paths('get'))
+
+    def test_members_from_the_cache(self):
+        self.install(bulb(65537), group(131073, [65537]))
+        Coap.set_cache(CoapCache(default_ttl=60))
+        Coap.get(CONFIG, TradfriEndpoint.DEVICE, 65537)
+        self.transport.requests = []
+
+        self.assertEqual(self.put({'5850': 1}, TradfriEndpoint.GROUP, 131073), [])
+        self.assertEqual(self.transport.paths('get'), ['15004/131073'])
+
+    def test_scene_of_the_group_is_activated_again(self):
+        self.install(bulb(65537, on=0), group(131073, [65537], on=1, scene=196608))
+
+        with skipping(self.state_filter):
+            TradfriScene.activate_static(131073, 196608, CONFIG)
+
+        self.assertEqual(self.transport.paths('put'), ['15004/131073'])
+
+    def test_cache_source(self):
+        self.install(bulb(65537), bulb(65538), group(131073, [65537, 65538]))
+        self.state_filter = CoapStateFilter(CoapStateFilter.SOURCE_CACHE)
+        Coap.set_cache(CoapCache(default_ttl=60))
+
+        # nothing is skipped as long as a member is not cached
+        Coap.get(CONFIG, TradfriEndpoint.GROUP, 131073)
+        Coap.get(CONFIG, TradfriEndpoint.DEVICE, 65537)
+        self.assertEqual(self.put({'5850': 1}, TradfriEndpoint.GROUP, 131073), ['15004/131073'])
+
+        self.transport.requests = []
+        Coap.get(CONFIG, TradfriEndpoint.GROUP, 131073)
+        Coap.get(CONFIG, TradfriEndpoint.DEVICE, 65537)
+        Coap.get(CONFIG, TradfriEndpoint.DEVICE, 65538)
+        self.assertEqual(self.put({'5850': 1}, TradfriEndpoint.GROUP, 131073), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
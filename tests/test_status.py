@@ -0,0 +1,89 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+from coap.coap import Coap
+from config.config import Config
+from tradfri.tradfri_daemon import TradfriDaemon
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_inventory import iter_tradfri_inventory
+from tests.resources import CONFIG, ResourceTransport, bulb, remote, group, inventory, load_script
+
+
+class StatusTest(unittest.TestCase):
+    """ iter_tradfri_inventory and tradfri-status.py, directly against the gateway and through the daemon """
+    def setUp(self):
+        self.rate_limiter = Coap.get_rate_limiter()
+        resources         = inventory(bulb(65537), bulb(65538, on=0), remote(65539),
+                                      group(131073, [65537, 65538, 65539]))
+
+        # listed by the gateway but can't be read
+        resources['15001'].append(65540)
+        self.transport = ResourceTransport(resources).install()
+
+        self.directory   = tempfile.mkdtemp()
+        self.environment = mock.patch.dict(os.environ, {'TRADFRI_SOCKET': os.path.join(self.directory, 'sock')})
+        self.config      = mock.patch.object(Config, 'get_default_config', staticmethod(lambda: CONFIG))
+
+        Coap.set_rate_limiter(None)
+        self.environment.start()
+        self.config.start()
+
+        self.status = load_script('tradfri-status')
+
+    def tearDown(self):
+        self.config.stop()
+        self.environment.stop()
+        Coap.set_transport(None)
+        Coap.set_rate_limiter(self.rate_limiter)
+        shutil.rmtree(self.directory)
+
+    def run_status(self, *arguments):
+        output, errors = io.StringIO(), io.StringIO()
+
+        with mock.patch.object(sys, 'argv', ['tradfri-status.py'] + list(arguments)), \
+                contextlib.redirect_stdout(output), contextlib.redirect_stderr(errors):
+            self.status.main()
+
+        return output.getvalue().splitlines(), errors.getvalue().splitlines()
+
+    def test_iter_inventory(self):
+        failed = {}
+        items  = list(iter_tradfri_inventory(CONFIG, 2, failed))
+
+        self.assertEqual(sorted(item.id for item in items), [65537, 65538, 65539, 131073])
+        self.assertEqual(list(failed), [(TradfriEndpoint.DEVICE, 65540)])
+
+    def test_jsonl(self):
+        lines, errors = self.run_status('--jsonl')
+        items         = [json.loads(line) for line in lines]
+
+        self.assertEqual(sorted((item['kind'], item['id']) for item in items),
+                         [('bulb', 65537), ('bulb', 65538), ('group', 131073), ('remote', 65539)])
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('[-] Tradfri: could not acquire 65540: '))
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix domain sockets are not available')
+    def test_jsonl_from_daemon(self):
+        with TradfriDaemon(CONFIG, os.environ['TRADFRI_SOCKET'], refresh_interval=3600):
+            requests = len(self.transport.requests)
+            lines, _ = self.run_status('--jsonl')
+
+        items = [json.loads(line) for line in lines]
+
+        # in id order, devices first, and the daemon's mirror answers without any request
+        self.assertEqual([item['id'] for item in items], [65537, 65538, 65539, 131073])
+        self.assertEqual(items[-1]['all_on'], False)
+        self.assertEqual(len(self.transport.requests), requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from tradfri.tradfri_schema import TradfriKey, MAX_TRANSITION_TIME
+from tradfri.tradfri_transition import get_segments
+
+
+class GetSegmentsTest(unittest.TestCase):
+    def test_short_fade_is_one_segment(self):
+        target = {TradfriKey.BRIGHTNESS: 254}
+
+        self.assertEqual(get_segments({TradfriKey.BRIGHTNESS: 0}, target, 10), [(target, 100)])
+        self.assertEqual(get_segments({}, target, 0), [(target, 0)])
+
+    def test_long_fade_is_split_and_interpolated(self):
+        duration = MAX_TRANSITION_TIME / 10 * 2.5
+        segments = get_segments({TradfriKey.BRIGHTNESS: 0}, {TradfriKey.BRIGHTNESS: 240}, duration)
+
+        self.assertEqual([values[TradfriKey.BRIGHTNESS] for values, _ in segments], [80, 160, 240])
+        self.assertEqual(sum(tenths for _, tenths in segments), round(duration * 10))
+        self.assertTrue(all(tenths <= MAX_TRANSITION_TIME for _, tenths in segments))
+
+    def test_values_missing_in_start_are_set_with_the_first_segment(self):
+        target   = {TradfriKey.BRIGHTNESS: 200, TradfriKey.COLOR_X: 30000}
+        segments = get_segments({TradfriKey.BRIGHTNESS: 0}, target, MAX_TRANSITION_TIME / 10 * 2)
+
+        self.assertEqual([values for values, _ in segments],
+                         [{TradfriKey.BRIGHTNESS: 100, TradfriKey.COLOR_X: 30000}, target])
+
+
+if __name__ == '__main__':
+    unittest.main()
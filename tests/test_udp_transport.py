@@ -0,0 +1,74 @@
+import time
+import threading
+import unittest
+
+from coap.coap import Coap
+from coap.coap_policy import CoapRequestPolicy
+from coap.coap_transport import UdpTransport, CoapError, CoapConnectionError
+from common.parallel import ParallelFetcher
+from config.config import Config
+from simulator.gateway_simulator import GatewaySimulator
+from tradfri.tradfri_endpoint import TradfriEndpoint
+
+CONFIG = Config('127.0.0.1', 'user', 'key')
+
+
+class UdpTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.simulator    = GatewaySimulator(bulbs=30, seed=1).start()
+        self.transport    = UdpTransport(self.simulator.port)
+        self.policy       = Coap.get_policy()
+        self.rate_limiter = Coap.get_rate_limiter()
+
+        Coap.set_transport(self.transport)
+        Coap.set_rate_limiter(None)
+
+    def tearDown(self):
+        Coap.set_transport(None)
+        Coap.set_policy(self.policy)
+        Coap.set_rate_limiter(self.rate_limiter)
+        self.simulator.stop()
+
+    def uri(self, path: str):
+        return f'coap://127.0.0.1:{self.simulator.port}/{path}'
+
+    def test_reset_session_serves_its_pending_requests(self):
+        self.simulator.latency = .3
+        session  = self.transport.get_session('127.0.0.1', self.simulator.port, CONFIG)
+        response = []
+        request  = threading.Thread(target=lambda: response.append(
+            self.transport.request('get', self.uri('15001/65537'), CONFIG, timeout=3)))
+
+        request.start()
+        time.sleep(.1)
+        self.transport._reset('127.0.0.1', self.simulator.port, CONFIG, session)
+
+        self.assertFalse(session.closed)
+        self.assertIsNot(self.transport.get_session('127.0.0.1', self.simulator.port, CONFIG), session)
+
+        request.join()
+        self.assertEqual(len(response), 1)
+        self.assertTrue(session.closed)
+
+    def test_closed_session_raises_a_coap_error(self):
+        session = self.transport.get_session('127.0.0.1', self.simulator.port, CONFIG)
+        session.close()
+
+        with self.assertRaises(CoapConnectionError):
+            session.request('get', '15001', timeout=1)
+
+    def test_concurrent_requests_on_a_lossy_gateway(self):
+        ids = Coap.get(CONFIG, TradfriEndpoint.DEVICE)
+        self.simulator.loss = .3
+        Coap.set_policy(CoapRequestPolicy(timeout=.5, retries=4, backoff=.01))
+
+        with ParallelFetcher(8) as fetcher:
+            result = fetcher.map(lambda id: Coap.get(CONFIG, TradfriEndpoint.DEVICE, id), ids)
+
+        # lost datagrams may let a request time out for good, but must not break the others on the session
+        self.assertTrue(all(isinstance(error, CoapError) for error in result.failed.values()), result.failed)
+        self.assertGreater(len(result.items), len(ids) // 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
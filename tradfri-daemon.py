@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# file        : tradfri-daemon.py
+# purpose     : long-running owner of the gateway connection for the Ikea tradfri smart lights
+
+"""
+    tradfri-daemon.py - serving the state of the Ikea Tradfri smart lights over a Unix domain socket
+
+    While the daemon is running tradfri-status.py, tradfri-lights.py and tradfri-groups.py send their
+    queries and commands to it instead of talking to the gateway themselves. see README.md for details
+"""
+
+# pylint convention disablement:
+# C0103 -> invalid-name
+# pylint: disable=C0103
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import signal
+import argparse
+
+from coap.coap import Coap
+from coap.coap_state_filter import CoapStateFilter
+from coap.coap_transport import CoapError
+from config.config import Config
+from tradfri.tradfri_daemon import TradfriDaemon
+
+
+def parse_args():
+    """ function for getting parsed arguments """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--socket', help='path of the Unix domain socket, default next to tradfri.cfg')
+    parser.add_argument('-r', '--refresh-interval', type=float,
+                        help='seconds between full inventory refreshes (default {0})'.format(
+                            TradfriDaemon.DEFAULT_REFRESH_INTERVAL))
+    parser.add_argument('-o', '--observe', action='store_true',
+                        help='keep the state up to date with CoAP Observe instead of refreshing')
+    parser.add_argument('--skip-unchanged', action='store_true',
+                        help='read the current state first and skip commands which would not change it')
+
+    return parser.parse_args()
+
+
+def main():
+    """ main function """
+    args   = parse_args()
+    config = Config.get_default_config()
+    daemon = TradfriDaemon(config, args.socket, args.refresh_interval, args.observe)
+
+    if args.skip_unchanged:
+        Coap.set_state_filter(CoapStateFilter(CoapStateFilter.SOURCE_READ))
+
+    try:
+        daemon.start()
+    except (RuntimeError, CoapError) as e:
+        sys.stderr.write('[-] Tradfri: {0}\n'.format(e))
+        sys.exit(1)
+
+    status = daemon.status()
+    print('[+] Tradfri: daemon listening on {0} ({1} devices, {2} groups)'.format(
+        daemon.path, len(status['devices']), len(status['groups'])))
+
+    signal.signal(signal.SIGTERM, lambda *_: daemon.shutdown())
+
+    try:
+        daemon.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit(0)
@@ -31,44 +31,166 @@ import sys
 import argparse
 
 from config.config import Config
-from tradfri import tradfriActions
+from coap.coap_state_filter import CoapStateFilter
+from common.command_batch import parse_commands, run_commands, format_result
+from tradfri.tradfri_daemon_client import TradfriDaemonClient, TradfriDaemonError
+
+DAEMON_COMMANDS = {'power': 'power_group', 'brightness': 'dim_group', 'scene': 'scene_group'}
 
 
 def parse_args():
     """ function for getting parsed arguments """
     parser = argparse.ArgumentParser()
-    parser.add_argument('-a', '--action', choices=['power', 'brightness', 'color'], required=True)
-    parser.add_argument('-g', '--groupid', help='get group ID from tradfri-status.py',
-                        required=True)
+    parser.add_argument('-a', '--action', choices=['power', 'brightness', 'color', 'scene'])
+    parser.add_argument('-g', '--groupid', help='get group ID from tradfri-status.py')
     parser.add_argument('-v', '--value',
-                        help='power: on/off, brightness: 0 - 100', required=True)
+                        help='power: on/off, brightness: 0 - 100, scene: scene ID')
+    parser.add_argument('-t', '--transition', type=float,
+                        help='fade to the brightness within TRANSITION seconds')
+    parser.add_argument('-s', '--skip-unchanged', action='store_true',
+                        help='read the current state first and skip commands which would not change it')
+    parser.add_argument('-b', '--batch', metavar='FILE',
+                        help='read one "<action> <groupid> <value>" command per line from FILE (- for stdin)')
+    parser.add_argument('-n', '--max-in-flight', type=int, help='commands running at the same time in batch mode')
 
     args = parser.parse_args()
 
+    if args.batch is None and (args.action is None or args.groupid is None or args.value is None):
+        parser.error('the following arguments are required: -a/--action, -g/--groupid, -v/--value')
+
+    if args.transition is not None and (args.batch is not None or args.action != 'brightness'):
+        parser.error('-t/--transition can only be used with -a brightness')
+
     return args
 
 
-def main():
-    """ main function """
-    args = parse_args()
+def send_to_daemon(args):
+    """ hands the command to a running tradfri-daemon.py, returns False if there is none """
+    if args.action not in DAEMON_COMMANDS:
+        return False
+
+    try:
+        arguments = {'id': args.groupid, 'value': args.value}
+
+        if args.transition is not None:
+            arguments['transition'] = args.transition
+
+        state_filter = CoapStateFilter() if args.skip_unchanged else None
+        daemon_request(TradfriDaemonClient(), state_filter, DAEMON_COMMANDS[args.action], **arguments)
+    except TradfriDaemonError as e:
+        sys.stderr.write('[-] Tradfri: {0}\n'.format(e))
+        sys.exit(1)
+    except OSError:
+        return False
+
+    report_skipped(state_filter)
+    return True
+
+
+def daemon_request(client, state_filter, command, **arguments):
+    """ sends a command to the daemon, with a state filter the daemon skips commands which would not change the
+        current state and the filter counts them """
+    if state_filter is None:
+        return client.request(command, **arguments)
+
+    response = client.request(command, skip_unchanged=True, **arguments)
+    state_filter.add(response['skipped'], response['sent'])
+    return response['result']
+
+
+def group_command(config, action, groupid, value, transition=None):
+    """ sends a single command to the gateway, raises ValueError for invalid values """
+    # the framework is only loaded if there is no daemon to talk to
+    from tradfri import tradfriActions
+    from tradfri.tradfri_scene import TradfriScene
+    from tradfri.tradfri_transition import fade_group
 
-    config  = Config.get_default_config()
     hubip   = config.hubip
     apiuser = config.apiuser
     apikey  = config.apikey
 
-    if args.action == 'power':
-        if args.value == 'on' or args.value == 'off':
-            tradfriActions.tradfri_power_group(hubip, apiuser, apikey, args.groupid, args.value)
+    if action == 'power':
+        if value == 'on' or value == 'off':
+            tradfriActions.tradfri_power_group(hubip, apiuser, apikey, groupid, value)
         else:
-            sys.stderr.write('[-] Tradfri: power state can only be on/off\n')
-            sys.exit(1)
-    elif args.action == 'brightness':
-        if 0 <= int(args.value) <= 100:
-            tradfriActions.tradfri_dim_group(hubip, apiuser, apikey, args.groupid, args.value)
+            raise ValueError('power state can only be on/off')
+    elif action == 'brightness':
+        if not 0 <= int(value) <= 100:
+            raise ValueError('dim value can only be between 1 and 100')
+
+        if transition is not None:
+            fade_group(config, groupid, transition, brightness=value)
         else:
-            sys.stderr.write('[-] Tradfri: dim value can only be between 1 and 100\n')
+            tradfriActions.tradfri_dim_group(hubip, apiuser, apikey, groupid, value)
+    elif action == 'scene':
+        TradfriScene.activate_static(groupid, value, config)
+
+
+def skip_unchanged():
+    """ skips commands which would not change the current state, returns the filter counting them """
+    from coap.coap import Coap
+
+    state_filter = CoapStateFilter(CoapStateFilter.SOURCE_READ)
+    Coap.set_state_filter(state_filter)
+    return state_filter
+
+
+def report_skipped(state_filter):
+    if state_filter is not None and state_filter.skipped:
+        print('[+] Tradfri: skipped {0} of {1} commands, nothing to change'.format(
+            state_filter.skipped, state_filter.skipped + state_filter.sent))
+
+
+def run_batch(args):
+    """ runs the commands of the batch file concurrently and prints a result line per command """
+    # groups have no color, so a batch can only contain the commands the daemon knows as well
+    if args.batch == '-':
+        commands = parse_commands(sys.stdin, list(DAEMON_COMMANDS))
+    else:
+        with open(args.batch) as batch_file:
+            commands = parse_commands(batch_file, list(DAEMON_COMMANDS))
+
+    client = TradfriDaemonClient()
+
+    if client.is_running():
+        max_in_flight = args.max_in_flight
+        state_filter  = CoapStateFilter() if args.skip_unchanged else None
+        execute       = lambda action, id, value: daemon_request(client, state_filter, DAEMON_COMMANDS[action],
+                                                                 id=id, value=value)
+    else:
+        config        = Config.get_default_config()
+        max_in_flight = args.max_in_flight or config.max_in_flight
+        execute       = lambda action, id, value: group_command(config, action, id, value)
+        state_filter  = skip_unchanged() if args.skip_unchanged else None
+
+    failed = run_commands(commands, execute, max_in_flight, lambda command: print(format_result(command)))
+    report_skipped(state_filter)
+    return failed
+
+
+def main():
+    """ main function """
+    args = parse_args()
+
+    if args.batch is not None:
+        if run_batch(args):
             sys.exit(1)
+        return
+
+    if send_to_daemon(args):
+        return
+
+    from coap.coap_transport import CoapError
+
+    state_filter = skip_unchanged() if args.skip_unchanged else None
+
+    try:
+        group_command(Config.get_default_config(), args.action, args.groupid, args.value, args.transition)
+    except (ValueError, CoapError) as e:
+        sys.stderr.write('[-] Tradfri: {0}\n'.format(e))
+        sys.exit(1)
+
+    report_skipped(state_filter)
 
 
 if __name__ == "__main__":
@@ -31,48 +31,166 @@ import sys
 import argparse
 
 from config.config import Config
-from tradfri import tradfriActions
-from tradfri.tradfri_device import TradfriLightBulb
+from coap.coap_state_filter import CoapStateFilter
+from common.command_batch import parse_commands, run_commands, format_result
+from tradfri.tradfri_daemon_client import TradfriDaemonClient, TradfriDaemonError
+
+ACTIONS         = ['power', 'brightness', 'color']
+DAEMON_COMMANDS = {'power': 'power_light', 'brightness': 'dim_light', 'color': 'color_light'}
 
 
 def parse_args():
     """ function for getting parsed arguments """
     parser = argparse.ArgumentParser()
-    parser.add_argument('-a', '--action', choices=['power', 'brightness', 'color'], required=True)
-    parser.add_argument('-l', '--lightbulbid', help='lightbulbid got from tradfri-status.py',
-                        required=True)
+    parser.add_argument('-a', '--action', choices=ACTIONS)
+    parser.add_argument('-l', '--lightbulbid', help='lightbulbid got from tradfri-status.py')
     parser.add_argument('-v', '--value',
-                        help='power: on/off, brightness: 0-100, color: warm/normal/cold',
-                        required=True)
+                        help='power: on/off, brightness: 0-100, color: warm/normal/cold')
+    parser.add_argument('-t', '--transition', type=float,
+                        help='fade to the brightness or color within TRANSITION seconds')
+    parser.add_argument('-s', '--skip-unchanged', action='store_true',
+                        help='read the current state first and skip commands which would not change it')
+    parser.add_argument('-b', '--batch', metavar='FILE',
+                        help='read one "<action> <lightbulbid> <value>" command per line from FILE (- for stdin)')
+    parser.add_argument('-n', '--max-in-flight', type=int, help='commands running at the same time in batch mode')
 
     args = parser.parse_args()
 
+    if args.batch is None and (args.action is None or args.lightbulbid is None or args.value is None):
+        parser.error('the following arguments are required: -a/--action, -l/--lightbulbid, -v/--value')
+
+    if args.transition is not None and (args.batch is not None or args.action not in ('brightness', 'color')):
+        parser.error('-t/--transition can only be used with -a brightness or -a color')
+
     return args
 
 
-def main():
-    """ main function """
-    args = parse_args()
+def send_to_daemon(args):
+    """ hands the command to a running tradfri-daemon.py, returns False if there is none """
+    try:
+        arguments = {'id': args.lightbulbid, 'value': args.value}
+
+        if args.transition is not None:
+            arguments['transition'] = args.transition
+
+        state_filter = CoapStateFilter() if args.skip_unchanged else None
+        daemon_request(TradfriDaemonClient(), state_filter, DAEMON_COMMANDS[args.action], **arguments)
+    except TradfriDaemonError as e:
+        sys.stderr.write('[-] Tradfri: {0}\n'.format(e))
+        sys.exit(1)
+    except OSError:
+        return False
+
+    report_skipped(state_filter)
+    return True
+
+
+def daemon_request(client, state_filter, command, **arguments):
+    """ sends a command to the daemon, with a state filter the daemon skips commands which would not change the
+        current state and the filter counts them """
+    if state_filter is None:
+        return client.request(command, **arguments)
+
+    response = client.request(command, skip_unchanged=True, **arguments)
+    state_filter.add(response['skipped'], response['sent'])
+    return response['result']
+
+
+def light_command(config, action, lightbulbid, value, transition=None):
+    """ sends a single command to the gateway, raises ValueError for invalid values """
+    # the framework is only loaded if there is no daemon to talk to
+    from tradfri import tradfriActions
+    from tradfri.tradfri_device import TradfriLightBulb
+    from tradfri.tradfri_transition import fade_light
 
-    config  = Config.get_default_config()
     hubip   = config.hubip
     apiuser = config.apiuser
     apikey  = config.apikey
 
-    if args.action == 'power':
-        TradfriLightBulb.set_power_static(args.lightbulbid, True if args.value == 'on' else False, config)
-    elif args.action == 'brightness':
-        if 1 <= int(args.value) <= 100:
-            tradfriActions.tradfri_dim_light(hubip, apiuser, apikey, args.lightbulbid, args.value)
+    if action == 'power':
+        TradfriLightBulb.set_power_static(lightbulbid, True if value == 'on' else False, config)
+    elif action == 'brightness':
+        if not 1 <= int(value) <= 100:
+            raise ValueError('dim value can only be between 1 and 100')
+
+        if transition is not None:
+            fade_light(config, lightbulbid, transition, brightness=value)
         else:
-            sys.stderr.write('[-] Tradfri: dim value can only be between 1 and 100\n')
-            sys.exit(1)
-    elif args.action == 'color':
-        if args.value == 'warm' or args.value == 'normal' or args.value == 'cold':
-            tradfriActions.tradfri_color_light(hubip, apiuser, apikey, args.lightbulbid, args.value)
+            tradfriActions.tradfri_dim_light(hubip, apiuser, apikey, lightbulbid, value)
+    elif action == 'color':
+        if value != 'warm' and value != 'normal' and value != 'cold':
+            raise ValueError('color value can only be warm/normal/cold')
+
+        if transition is not None:
+            fade_light(config, lightbulbid, transition, color=value)
         else:
-            sys.stderr.write('[-] Tradfri: color value can only be warm/normal/cold\n')
+            tradfriActions.tradfri_color_light(hubip, apiuser, apikey, lightbulbid, value)
+
+
+def skip_unchanged():
+    """ skips commands which would not change the current state, returns the filter counting them """
+    from coap.coap import Coap
+
+    state_filter = CoapStateFilter(CoapStateFilter.SOURCE_READ)
+    Coap.set_state_filter(state_filter)
+    return state_filter
+
+
+def report_skipped(state_filter):
+    if state_filter is not None and state_filter.skipped:
+        print('[+] Tradfri: skipped {0} of {1} commands, nothing to change'.format(
+            state_filter.skipped, state_filter.skipped + state_filter.sent))
+
+
+def run_batch(args):
+    """ runs the commands of the batch file concurrently and prints a result line per command """
+    if args.batch == '-':
+        commands = parse_commands(sys.stdin, ACTIONS)
+    else:
+        with open(args.batch) as batch_file:
+            commands = parse_commands(batch_file, ACTIONS)
+
+    client = TradfriDaemonClient()
+
+    if client.is_running():
+        max_in_flight = args.max_in_flight
+        state_filter  = CoapStateFilter() if args.skip_unchanged else None
+        execute       = lambda action, id, value: daemon_request(client, state_filter, DAEMON_COMMANDS[action],
+                                                                 id=id, value=value)
+    else:
+        config        = Config.get_default_config()
+        max_in_flight = args.max_in_flight or config.max_in_flight
+        execute       = lambda action, id, value: light_command(config, action, id, value)
+        state_filter  = skip_unchanged() if args.skip_unchanged else None
+
+    failed = run_commands(commands, execute, max_in_flight, lambda command: print(format_result(command)))
+    report_skipped(state_filter)
+    return failed
+
+
+def main():
+    """ main function """
+    args = parse_args()
+
+    if args.batch is not None:
+        if run_batch(args):
             sys.exit(1)
+        return
+
+    if send_to_daemon(args):
+        return
+
+    from coap.coap_transport import CoapError
+
+    state_filter = skip_unchanged() if args.skip_unchanged else None
+
+    try:
+        light_command(Config.get_default_config(), args.action, args.lightbulbid, args.value, args.transition)
+    except (ValueError, CoapError) as e:
+        sys.stderr.write('[-] Tradfri: {0}\n'.format(e))
+        sys.exit(1)
+
+    report_skipped(state_filter)
 
 
 if __name__ == "__main__":
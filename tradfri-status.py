@@ -28,23 +28,114 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import sys
-import time
+import json
+import argparse
 
-from tradfri.tradfri_device import *
-from tradfri.tradfri_group import *
+from tradfri.tradfri_daemon_client import TradfriDaemonClient, TradfriDaemonError
+
+
+def parse_args():
+    """ function for getting parsed arguments """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jsonl', action='store_true',
+                        help='print one JSON object per device and group as soon as it has been read')
+    parser.add_argument('-d', '--deadline', type=float,
+                        help='give up on devices and groups which could not be read within DEADLINE seconds')
+    parser.add_argument('--hedge', type=float, metavar='PERCENTILE',
+                        help='send a second request once a request takes longer than PERCENTILE of the '
+                             'recent latencies')
+    parser.add_argument('--group-state', action='store_true',
+                        help='also print whether any light of a group is on and their mean brightness')
+    parser.add_argument('--max-age', type=float,
+                        help='read the state of lights and groups again once the cached state is older than '
+                             'MAX_AGE seconds (default 10, 0 reads all of them)')
+
+    return parser.parse_args()
+
+
+def request_policy(args):
+    """ returns the deadline of the gateway requests as context manager, --hedge replaces the request policy """
+    from contextlib import nullcontext
+    from coap.coap import Coap
+    from coap.coap_policy import CoapRequestPolicy, deadline
+
+    if args.hedge is not None:
+        Coap.set_policy(CoapRequestPolicy(hedge_percentile=args.hedge))
+
+    return deadline(args.deadline) if args.deadline is not None else nullcontext()
+
+
+def stream_status(args):
+    """ yields the devices and groups as dicts as soon as they are known """
+    try:
+        status = TradfriDaemonClient().request('status')
+        yield from status['devices'] + status['groups']
+        return
+    except (OSError, TradfriDaemonError):
+        pass
+
+    from config.config import Config
+    from coap.coap_transport import CoapError
+    from tradfri.tradfri_daemon import as_dict
+    from tradfri.tradfri_inventory import iter_tradfri_inventory
+
+    config = Config.get_default_config()
+    failed = {}
+
+    try:
+        with request_policy(args):
+            for item in iter_tradfri_inventory(config, config.max_in_flight, failed):
+                yield as_dict(item)
+    except CoapError as e:
+        sys.stderr.write('[-] Tradfri: {0}\n'.format(e))
+        sys.exit(1)
+
+    for (_, id), error in failed.items():
+        sys.stderr.write('[-] Tradfri: could not acquire {0}: {1}\n'.format(id, error))
+
+
+def get_status(args):
+    """ returns the devices and groups as dicts, from a running tradfri-daemon.py or the gateway itself """
+    try:
+        status = TradfriDaemonClient().request('status')
+        return status['devices'], status['groups']
+    except (OSError, TradfriDaemonError):
+        pass
+
+    # the framework is only loaded if there is no daemon to talk to
+    from config.config import Config
+    from coap.coap_transport import CoapError
+    from tradfri.tradfri_daemon import as_dict
+    from tradfri.tradfri_index import TradfriInventoryIndex
+    from tradfri.tradfri_inventory_cache import TradfriInventoryCache
+
+    config = Config.get_default_config()
+
+    try:
+        with request_policy(args):
+            devices, groups = TradfriInventoryCache(config).refresh(config.max_in_flight, args.max_age)
+    except CoapError as e:
+        sys.stderr.write('[-] Tradfri: {0}\n'.format(e))
+        sys.exit(1)
+
+    for id, error in list(devices.failed.items()) + list(groups.failed.items()):
+        sys.stderr.write('[-] Tradfri: could not acquire {0}: {1}\n'.format(id, error))
+
+    index = TradfriInventoryIndex(devices, groups)
+    return [as_dict(device, index) for device in devices], [as_dict(group, index) for group in groups]
 
 
 def main():
     """ main function """
-    config = Config.get_default_config()
+    args = parse_args()
 
-    print('[ ] Tradfri: acquiring all Tradfri devices, please wait ...')
-    devices = get_tradfri_devices(config)
-    groups  = get_tradfri_groups(config)
+    if args.jsonl:
+        for item in stream_status(args):
+            print(json.dumps(item), flush=True)
+        return
 
-    # sometimes the request are to fast, the will decline the request (flood security)
-    # in this case you could increse the sleep timer
-    time.sleep(.5)
+    print('[ ] Tradfri: acquiring all Tradfri devices, please wait ...')
+    devices, groups = get_status(args)
 
     print('[+] Tradfri: device information gathered')
     print('===========================================================\n')
@@ -52,20 +143,18 @@ def main():
     for device in devices:
         device_string = None
 
-        if isinstance(device, TradfriLightBulb) or \
-           isinstance(device, TradfriColorLightBulb):
-
+        if device['kind'] == 'bulb' or device['kind'] == 'color_bulb':
             device_string = 'bulb ID {0:>7}, name: {1: <35}, brightness: {2: >6}%, color: {3: >16}, state: {4}'\
-                .format(device.id,
-                        device.name,
-                        device.brightness,
-                        device.color_description,
-                        device.status)
+                .format(device['id'],
+                        device['name'],
+                        device['brightness'],
+                        device['color_description'],
+                        device['status'])
 
-        elif isinstance(device, TradfriRemote):
+        elif device['kind'] == 'remote':
             device_string = 'remote ID {0:<5}, name: {1: <35}' \
-                .format(device.id,
-                        device.name)
+                .format(device['id'],
+                        device['name'])
 
         if device_string is not None:
             print(device_string)
@@ -73,7 +162,15 @@ def main():
     print('\n')
 
     for group in groups:
-        print('group ID: {0:<5}, name: {1: <16}, state: {2}'.format(group.id, group.name, group.state))
+        group_string = 'group ID: {0:<5}, name: {1: <16}, state: {2}'.format(group['id'], group['name'],
+                                                                          group['state'])
+
+        if args.group_state:
+            # groups without a known member light have no brightness
+            brightness    = '-' if group['mean_brightness'] is None else '{0}%'.format(group['mean_brightness'])
+            group_string += ', lights on: {0}, brightness: {1}'.format(group['any_on'], brightness)
+
+        print(group_string)
 
 
 if __name__ == "__main__":
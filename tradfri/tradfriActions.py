@@ -15,114 +15,108 @@
 """
     tradfri/tradfriActions.py - controlling the Ikea tradfri smart lights
 
-    This module requires libcoap with dTLS compiled, at this moment there is no python coap module
-    that supports coap with dTLS. see ../bin/README how to compile libcoap with dTLS support
+    Requests are sent through the active Coap transport, which is the in-process DTLS client if the
+    DTLSSocket module is installed and libcoap's coap-client otherwise. see ../README.md for details
 """
 
 # pylint convention disablement:
 # C0103 -> invalid-name
 # pylint: disable=C0103
 
-import sys
-import os
+from coap.coap import Coap
+from coap.async_coap import AsyncCoap
+from config.config import Config
+from tradfri.tradfri_endpoint import TradfriEndpoint
 
-global coap
-coap = '/usr/local/bin/coap-client'
+_COLOR_XY = {
+    'warm':   (33135, 27211),
+    'normal': (30140, 26909),
+    'cold':   (24930, 24684),
+}
+
+
+def _power_light_payload(value):
+    """ builds the payload for power on/off a tradfri lightbulb """
+    return '{ "3311": [{ "5850": %d }] }' % (1 if value == 'on' else 0)
+
+
+def _dim_light_payload(value):
+    """ builds the payload for dimming a tradfri lightbulb (value 0 - 100) """
+    return '{ "3311" : [{ "5851" : %s }] }' % int(float(value) * 2.55)
 
-def tradfri_power_light(hubip, apiuser, apikey, lightbulbid, value):
-    """ function for power on/off tradfri lightbulb """
-    tradfriHub = 'coaps://{}:5684/15001/{}' .format(hubip, lightbulbid)
 
-    if value == 'on':
-        payload = '{ "3311": [{ "5850": 1 }] }'
-    else:
-        payload = '{ "3311": [{ "5850": 0 }] }'
+def _color_light_payload(value):
+    """ builds the payload for the color temperature of a tradfri lightbulb """
+    x, y = _COLOR_XY[value]
+    return '{ "3311" : [{ "5709" : %s, "5710": %s }] }' % (x, y)
 
-    api = '{} -m put -u "{}" -k "{}" -e \'{}\' "{}"' .format(coap, apiuser, apikey,
-                                                                          payload, tradfriHub)
 
-    if os.path.exists(coap):
-        os.popen(api)
-    else:
-        sys.stderr.write('[-] libcoap: could not find libcoap\n')
-        sys.exit(1)
+def _power_group_payload(value):
+    """ builds the payload for power on/off a tradfri group """
+    return '{ "5850" : %d }' % (1 if value == 'on' else 0)
 
+
+def _dim_group_payload(value):
+    """ builds the payload for dimming a tradfri group (value 0 - 100) """
+    return '{ "5851" : %s }' % int(float(value) * 2.55)
+
+
+def tradfri_power_light(hubip, apiuser, apikey, lightbulbid, value):
+    """ function for power on/off tradfri lightbulb """
+    Coap.put(_power_light_payload(value), Config(hubip, apiuser, apikey), TradfriEndpoint.DEVICE, lightbulbid, False)
     return True
 
 
 def tradfri_dim_light(hubip, apiuser, apikey, lightbulbid, value):
     """ function for dimming tradfri lightbulb """
-    dim = float(value) * 2.55
-    tradfriHub = 'coaps://{}:5684/15001/{}'.format(hubip, lightbulbid)
-    payload = '{ "3311" : [{ "5851" : %s }] }' % int(dim)
+    return Coap.put(_dim_light_payload(value), Config(hubip, apiuser, apikey), TradfriEndpoint.DEVICE, lightbulbid,
+                    False)
 
-    api = '{} -m put -u "{}" -k "{}" -e \'{}\' "{}"'.format(coap, apiuser, apikey,
-                                                                         payload, tradfriHub)
-
-    if os.path.exists(coap):
-        result = os.popen(api)
-    else:
-        sys.stderr.write('[-] libcoap: could not find libcoap\n')
-        sys.exit(1)
-
-    return result
 
 def tradfri_color_light(hubip, apiuser, apikey, lightbulbid, value):
     """ function for color temperature tradfri lightbulb """
-    tradfriHub = 'coaps://{}:5684/15001/{}'.format(hubip, lightbulbid)
+    return Coap.put(_color_light_payload(value), Config(hubip, apiuser, apikey), TradfriEndpoint.DEVICE, lightbulbid,
+                    False)
 
-    if value == 'warm':
-        payload = '{ "3311" : [{ "5709" : %s, "5710": %s }] }' % ("33135", "27211")
-    elif value == 'normal':
-        payload = '{ "3311" : [{ "5709" : %s, "5710": %s }] }' % ("30140", "26909")
-    elif value == 'cold':
-        payload = '{ "3311" : [{ "5709" : %s, "5710": %s }] }' % ("24930", "24684")
 
-    api = '{} -m put -u "{}" -k "{}" -e \'{}\' "{}"'.format(coap, apiuser, apikey,
-                                                                         payload, tradfriHub)
+def tradfri_power_group(hubip, apiuser, apikey, groupid, value):
+    """ function for power on/off tradfri lightbulb """
+    return Coap.put(_power_group_payload(value), Config(hubip, apiuser, apikey), TradfriEndpoint.GROUP, groupid,
+                    False)
 
-    if os.path.exists(coap):
-        result = os.popen(api)
-    else:
-        sys.stderr.write('[-] libcoap: could not find libcoap\n')
-        sys.exit(1)
 
-    return result
+def tradfri_dim_group(hubip, apiuser, apikey, groupid, value):
+    """ function for dimming tradfri lightbulb """
+    return Coap.put(_dim_group_payload(value), Config(hubip, apiuser, apikey), TradfriEndpoint.GROUP, groupid,
+                    False)
 
-def tradfri_power_group(hubip, apiuser, apikey, groupid, value):
-    """ function for power on/off tradfri lightbulb """
-    tradfriHub = 'coaps://{}:5684/15004/{}' .format(hubip, groupid)
 
-    if value == 'on':
-        payload = '{ "5850" : 1 }'
-    else:
-        payload = '{ "5850" : 0 }'
+async def tradfri_power_light_async(hubip, apiuser, apikey, lightbulbid, value, timeout=None):
+    """ function for power on/off tradfri lightbulb without blocking the event loop """
+    await AsyncCoap.put(_power_light_payload(value), Config(hubip, apiuser, apikey), TradfriEndpoint.DEVICE,
+                        lightbulbid, False, timeout)
+    return True
 
-    api = '{} -m put -u "{}" -k "{}" -e \'{}\' "{}"' .format(coap, apiuser, apikey,
-                                                                          payload, tradfriHub)
 
-    if os.path.exists(coap):
-        result = os.popen(api)
-    else:
-        sys.stderr.write('[-] libcoap: could not find libcoap\n')
-        sys.exit(1)
+async def tradfri_dim_light_async(hubip, apiuser, apikey, lightbulbid, value, timeout=None):
+    """ function for dimming tradfri lightbulb without blocking the event loop """
+    return await AsyncCoap.put(_dim_light_payload(value), Config(hubip, apiuser, apikey), TradfriEndpoint.DEVICE,
+                               lightbulbid, False, timeout)
 
-    return result
 
+async def tradfri_color_light_async(hubip, apiuser, apikey, lightbulbid, value, timeout=None):
+    """ function for color temperature tradfri lightbulb without blocking the event loop """
+    return await AsyncCoap.put(_color_light_payload(value), Config(hubip, apiuser, apikey), TradfriEndpoint.DEVICE,
+                               lightbulbid, False, timeout)
 
-def tradfri_dim_group(hubip, apiuser, apikey, groupid, value):
-    """ function for dimming tradfri lightbulb """
-    tradfriHub = 'coaps://{}:5684/15004/{}'.format(hubip, groupid)
-    dim = float(value) * 2.55
-    payload = '{ "5851" : %s }' % int(dim)
 
-    api = '{} -m put -u "{}" -k "{}" -e \'{}\' "{}"'.format(coap, apiuser, apikey,
-                                                                         payload, tradfriHub)
+async def tradfri_power_group_async(hubip, apiuser, apikey, groupid, value, timeout=None):
+    """ function for power on/off tradfri group without blocking the event loop """
+    return await AsyncCoap.put(_power_group_payload(value), Config(hubip, apiuser, apikey), TradfriEndpoint.GROUP,
+                               groupid, False, timeout)
 
-    if os.path.exists(coap):
-        result = os.popen(api)
-    else:
-        sys.stderr.write('[-] libcoap: could not find libcoap\n')
-        sys.exit(1)
 
-    return result
+async def tradfri_dim_group_async(hubip, apiuser, apikey, groupid, value, timeout=None):
+    """ function for dimming tradfri group without blocking the event loop """
+    return await AsyncCoap.put(_dim_group_payload(value), Config(hubip, apiuser, apikey), TradfriEndpoint.GROUP,
+                               groupid, False, timeout)
@@ -0,0 +1,120 @@
+import json
+
+from coap.coap import Coap
+from config.config import Config
+from common.parallel import ParallelFetcher
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_device import TradfriLightBulb
+from tradfri.tradfri_group import get_tradfri_groups_parallel
+from tradfri.tradfri_index import TradfriInventoryIndex
+from tradfri.tradfri_schema import TradfriKey, MAX_BRIGHTNESS
+
+
+class BatchResult:
+    def __init__(self, device_id, success: bool, group_id=None, error: Exception=None):
+        self.device_id = device_id
+        self.success   = success
+        self.group_id  = group_id
+        self.error     = error
+
+    def __repr__(self):
+        via = f' via group {self.group_id}' if self.group_id is not None else ''
+        return f'BatchResult({self.device_id}, {"ok" if self.success else self.error!r}{via})'
+
+
+def _state(on: bool=None, brightness=None):
+    state = {}
+
+    if on is not None:
+        state[TradfriKey.STATE] = int(on)
+
+    if brightness is not None:
+        state[TradfriKey.BRIGHTNESS] = int(float(brightness) * MAX_BRIGHTNESS / 100)
+
+    if not state:
+        raise ValueError('either on or brightness has to be set')
+
+    return state
+
+
+def _covering_groups(device_ids: set, groups: list, devices: list=None):
+    """ returns the groups whose (switchable) members are all part of device_ids, largest groups first. a group
+        with a member which is not in devices (unknown or failed to fetch) is never used, its PUT could switch
+        lights which are not part of the batch """
+    known = None
+
+    if devices is not None:
+        known = {str(device.id): isinstance(device, TradfriLightBulb) for device in devices}
+
+    remaining = set(device_ids)
+    covering  = []
+
+    for group in sorted(groups, key=lambda group: len(group.device_ids), reverse=True):
+        members = {str(id) for id in group.device_ids}
+
+        if known is not None:
+            if not members <= set(known):
+                continue
+
+            # remotes and other non-lights are group members as well, they don't need to be in the batch
+            members = {member for member in members if known[member]}
+
+        if members and members <= remaining:
+            covering.append((group, members))
+            remaining -= members
+
+    return covering, remaining
+
+
+def set_devices_state(config: Config, device_ids, on: bool=None, brightness=None, groups: list=None,
+                      devices: list=None, max_in_flight: int=None, index: TradfriInventoryIndex=None):
+    """ sets power and/or brightness (0 - 100) of many devices, whole groups are switched with one group PUT
+        and the remaining devices with parallel device PUTs; returns a BatchResult per device id.
+        groups are fetched if not given, devices (optional) allow to ignore non-light group members.
+        an index provides both without any request """
+    if index is not None:
+        groups  = list(index.groups.values()) if groups is None else groups
+        devices = list(index.devices.values()) if devices is None else devices
+
+    state          = _state(on, brightness)
+    device_payload = json.dumps({TradfriKey.LIGHT: [state]})
+    group_payload  = json.dumps(state)
+    ids            = {str(id): id for id in device_ids}
+
+    if groups is None:
+        groups = get_tradfri_groups_parallel(config, max_in_flight).items
+
+    covering, remaining = _covering_groups(set(ids), groups, devices)
+    results             = {}
+
+    def put_device(id):
+        Coap.put(device_payload, config, TradfriEndpoint.DEVICE, id, False)
+        return True
+
+    def put_group(group):
+        Coap.put(group_payload, config, TradfriEndpoint.GROUP, group.id, False)
+        return True
+
+    with ParallelFetcher(max_in_flight) as fetcher:
+        group_futures  = fetcher.submit(put_group, [group for group, _ in covering])
+        device_futures = fetcher.submit(put_device, sorted(remaining))
+
+        for (group, future), (_, members) in zip(group_futures, covering):
+            try:
+                future.result()
+            except Exception:
+                # fall back to switching the members one by one
+                device_futures += fetcher.submit(put_device, sorted(members))
+                continue
+
+            for member in members:
+                results[ids[member]] = BatchResult(ids[member], True, group.id)
+
+        for id, future in device_futures:
+            try:
+                future.result()
+                results[ids[id]] = BatchResult(ids[id], True)
+            except Exception as e:
+                results[ids[id]] = BatchResult(ids[id], False, error=e)
+
+    return results
@@ -0,0 +1,194 @@
+import colorsys
+
+try:
+    import numpy
+except ImportError:
+    # the batched conversions fall back to plain python without numpy
+    numpy = None
+
+
+MAX_XY = 65535
+
+WHITE_SPECTRUM_COLORS = {
+    'f5faf6': 'White',
+    'f1e0b5': 'Warm',
+    'efd275': 'Glow',
+}
+
+COLORS = {
+    '4a418a': 'Blue',
+    '6c83ba': 'Light Blue',
+    '8f2686': 'Saturated Purple',
+    'a9d62b': 'Lime',
+    'c984bb': 'Light Purple',
+    'd6e44b': 'Yellow',
+    'd9337c': 'Saturated Pink',
+    'da5d41': 'Dark Peach',
+    'dc4b31': 'Saturated Red',
+    'dcf0f8': 'Cold sky',
+    'e491af': 'Pink',
+    'e57345': 'Peach',
+    'e78834': 'Warm Amber',
+    'e8bedd': 'Light Pink',
+    'eaf6fb': 'Cool daylight',
+    'ebb63e': 'Candlelight',
+    'efd275': 'Warm glow',
+    'f1e0b5': 'Warm white',
+    'f2eccf': 'Sunrise',
+    'f5faf6': 'Cool white',
+}
+
+
+def hex_to_rgb(value: str):
+    return int(value[0:2], 16) / 255, int(value[2:4], 16) / 255, int(value[4:6], 16) / 255
+
+
+def rgb_to_hex(r, g, b):
+    return f'{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}'
+
+
+def hsv_to_hex(hue, saturation, brightness):
+    """ hue 0 - 360, saturation and brightness 0 - 100 like the TradfriColorLightBulb attributes """
+    return rgb_to_hex(*colorsys.hsv_to_rgb(hue / 360, saturation / 100, brightness / 100))
+
+
+def _linear(channel):
+    # sRGB gamma expansion
+    return channel / 12.92 if channel <= 0.04045 else ((channel + 0.055) / 1.055) ** 2.4
+
+
+def rgb_to_xy(r, g, b):
+    """ converts sRGB (0 - 1) into CIE 1931 chromaticity, black maps to the D65 white point """
+    r, g, b = _linear(r), _linear(g), _linear(b)
+
+    x = 0.4124 * r + 0.3576 * g + 0.1805 * b
+    y = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    z = 0.0193 * r + 0.1192 * g + 0.9505 * b
+
+    total = x + y + z
+
+    if total == 0:
+        return 0.3127, 0.3290
+
+    return x / total, y / total
+
+
+def hs_to_xy(hue, saturation):
+    return rgb_to_xy(*colorsys.hsv_to_rgb(hue / 360, saturation / 100, 1))
+
+
+def is_hex_color(value):
+    if not isinstance(value, str) or len(value) != 6:
+        return False
+
+    try:
+        int(value, 16)
+    except ValueError:
+        return False
+
+    return True
+
+
+class ColorIndex:
+    """ precomputed chromaticities of named colours for nearest-name lookups, the brightness is ignored """
+    def __init__(self, colors: dict):
+        self.exact  = dict(colors)
+        self.names  = list(colors.values())
+        self.points = [rgb_to_xy(*hex_to_rgb(value)) for value in colors]
+
+        self._array = numpy.array(self.points) if numpy is not None else None
+
+    def nearest_xy(self, x: float, y: float):
+        """ returns the name of the closest colour to the chromaticity x, y (0 - 1) """
+        best, best_distance = None, None
+
+        for name, (point_x, point_y) in zip(self.names, self.points):
+            distance = (point_x - x) ** 2 + (point_y - y) ** 2
+
+            if best_distance is None or distance < best_distance:
+                best, best_distance = name, distance
+
+        return best
+
+    def from_gateway_xy(self, x: int, y: int):
+        """ looks up the gateway's colour values 5709/5710 (0 - 65535) """
+        return self.nearest_xy(x / MAX_XY, y / MAX_XY)
+
+    def from_hs(self, hue: float, saturation: float):
+        """ hue 0 - 360, saturation 0 - 100 """
+        return self.nearest_xy(*hs_to_xy(hue, saturation))
+
+    def from_hex(self, value: str):
+        """ returns the name of a hex colour, values which are no hex colour are returned unchanged """
+        name = self.exact.get(value)
+
+        if name is not None:
+            return name
+
+        if not is_hex_color(value):
+            return value
+
+        return self.nearest_xy(*rgb_to_xy(*hex_to_rgb(value)))
+
+    def from_hs_batch(self, hues, saturations):
+        """ nearest names for many hue (0 - 360) / saturation (0 - 100) pairs like from_hs, vectorized if numpy is
+            available """
+        if self._array is None:
+            return [self.from_hs(hue, saturation) for hue, saturation in zip(hues, saturations)]
+
+        xy        = _hs_to_xy_array(numpy.asarray(hues, dtype=float) / 360, numpy.asarray(saturations, dtype=float) / 100)
+        distances = ((xy[:, numpy.newaxis, :] - self._array[numpy.newaxis, :, :]) ** 2).sum(axis=2)
+
+        return [self.names[index] for index in distances.argmin(axis=1)]
+
+
+def _hs_to_xy_array(hues, saturations):
+    """ numpy version of hs_to_xy, hues and saturations 0 - 1 """
+    rgb = _hsv_to_rgb_array(hues, saturations, numpy.ones_like(hues))
+    rgb = numpy.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = rgb @ numpy.array([[0.4124, 0.2126, 0.0193],
+                             [0.3576, 0.7152, 0.1192],
+                             [0.1805, 0.0722, 0.9505]])
+
+    total = xyz.sum(axis=1, keepdims=True)
+    total = numpy.where(total == 0, 1, total)
+
+    return xyz[:, :2] / total
+
+
+def _hsv_to_rgb_array(hues, saturations, values):
+    """ numpy version of colorsys.hsv_to_rgb, all arguments 0 - 1 """
+    i = numpy.floor(hues * 6.0)
+    f = hues * 6.0 - i
+    p = values * (1.0 - saturations)
+    q = values * (1.0 - saturations * f)
+    t = values * (1.0 - saturations * (1.0 - f))
+    i = i.astype(int) % 6
+
+    r = numpy.choose(i, [values, q, p, p, t, values])
+    g = numpy.choose(i, [t, values, values, q, p, p])
+    b = numpy.choose(i, [p, p, t, values, values, q])
+
+    # colorsys returns the value unchanged for grey
+    grey = saturations == 0
+    r, g, b = numpy.where(grey, values, r), numpy.where(grey, values, g), numpy.where(grey, values, b)
+
+    return numpy.stack([r, g, b], axis=1)
+
+
+def hsv_to_hex_batch(hues, saturations, brightnesses):
+    """ hex colours for many bulbs (hue 0 - 360, saturation and brightness 0 - 100), vectorized if numpy is
+        available """
+    if numpy is None:
+        return [hsv_to_hex(hue, saturation, brightness)
+                for hue, saturation, brightness in zip(hues, saturations, brightnesses)]
+
+    rgb = _hsv_to_rgb_array(numpy.asarray(hues, dtype=float) / 360, numpy.asarray(saturations, dtype=float) / 100,
+                            numpy.asarray(brightnesses, dtype=float) / 100)
+    rgb = (rgb * 255).astype(int)
+
+    return [f'{r:02x}{g:02x}{b:02x}' for r, g, b in rgb.tolist()]
+
+
+WHITE_SPECTRUM_INDEX = ColorIndex(WHITE_SPECTRUM_COLORS)
+COLOR_INDEX          = ColorIndex(COLORS)
@@ -0,0 +1,143 @@
+import json
+import time
+import threading
+
+from coap.coap import Coap
+from config.config import Config
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_schema import TradfriKey, MAX_BRIGHTNESS
+
+
+class TradfriCommandQueue:
+    """ per-resource write queue, pending writes to the same device or group are merged (last value wins)
+        and sent every flush_interval. failed writes are never dropped, they stay pending (merged with newer
+        values) and are sent again with exponential backoff; closing the queue delivers the final state """
+    DEFAULT_FLUSH_INTERVAL = .1
+    DEFAULT_CLOSE_TIMEOUT  = 10
+    MAX_BACKOFF            = 5
+
+    def __init__(self, api_config: Config, flush_interval: float=None):
+        self.api_config     = api_config
+        self.flush_interval = flush_interval if flush_interval is not None else TradfriCommandQueue.DEFAULT_FLUSH_INTERVAL
+        self.submitted      = 0
+        self.sent           = 0
+        self.errors         = {}
+
+        self._pending  = {}
+        self._retry_at = {}
+        self._lock     = threading.Lock()
+        self._flushing = threading.Lock()
+        self._closed   = threading.Event()
+        self._wakeup   = threading.Event()
+        self._worker   = threading.Thread(target=self._run, name='tradfri-command-queue', daemon=True)
+        self._worker.start()
+
+    def submit(self, endpoint: TradfriEndpoint, id, changes: dict):
+        """ queues changes (light keys for devices, group keys for groups), overriding pending values """
+        if self._closed.is_set():
+            raise RuntimeError('command queue has been closed')
+
+        with self._lock:
+            self._pending.setdefault((endpoint, str(id)), {}).update(changes)
+            self.submitted += 1
+
+    def power_light(self, id, on: bool):
+        self.submit(TradfriEndpoint.DEVICE, id, {TradfriKey.STATE: int(on)})
+
+    def dim_light(self, id, value):
+        self.submit(TradfriEndpoint.DEVICE, id, {TradfriKey.BRIGHTNESS: int(float(value) * MAX_BRIGHTNESS / 100)})
+
+    def power_group(self, id, on: bool):
+        self.submit(TradfriEndpoint.GROUP, id, {TradfriKey.STATE: int(on)})
+
+    def dim_group(self, id, value):
+        self.submit(TradfriEndpoint.GROUP, id, {TradfriKey.BRIGHTNESS: int(float(value) * MAX_BRIGHTNESS / 100)})
+
+    @property
+    def merged(self):
+        """ number of submitted writes which never had to be sent because a later one replaced them """
+        with self._lock:
+            return self.submitted - self.sent - len(self._pending)
+
+    def flush(self):
+        """ sends all pending writes which are not waiting for a retry, returns True if nothing is pending """
+        with self._flushing:
+            now = time.monotonic()
+
+            with self._lock:
+                due = {key: changes for key, changes in self._pending.items()
+                       if key not in self._retry_at or self._retry_at[key][1] <= now}
+
+                for key in due:
+                    del self._pending[key]
+
+            for (endpoint, id), changes in due.items():
+                if endpoint == TradfriEndpoint.DEVICE:
+                    payload = json.dumps({TradfriKey.LIGHT: [changes]})
+                else:
+                    payload = json.dumps(changes)
+
+                try:
+                    Coap.put(payload, self.api_config, endpoint, id, False)
+                except Exception as e:
+                    self._requeue(endpoint, id, changes, e)
+                    continue
+
+                with self._lock:
+                    self.sent += 1
+                    self._retry_at.pop((endpoint, id), None)
+                    self.errors.pop((endpoint, id), None)
+
+        with self._lock:
+            return len(self._pending) == 0
+
+    def _requeue(self, endpoint: TradfriEndpoint, id, changes: dict, error: Exception):
+        key = (endpoint, id)
+
+        with self._lock:
+            attempts, _ = self._retry_at.get(key, (0, 0))
+            delay       = min(TradfriCommandQueue.MAX_BACKOFF, self.flush_interval * 2 ** attempts)
+
+            self._retry_at[key] = (attempts + 1, time.monotonic() + delay)
+            self.errors[key]    = error
+
+            # newer writes which have been queued during the flush win over the failed ones
+            merged = dict(changes)
+            merged.update(self._pending.get(key, {}))
+            self._pending[key] = merged
+
+    def close(self, timeout: float=None):
+        """ stops the worker and delivers everything which is still pending, failed writes are retried for up to
+            timeout seconds; raises RuntimeError naming the writes which could not be delivered """
+        self._closed.set()
+        self._wakeup.set()
+        self._worker.join()
+
+        expires = time.monotonic() + (timeout if timeout is not None else TradfriCommandQueue.DEFAULT_CLOSE_TIMEOUT)
+
+        while not self.flush():
+            with self._lock:
+                retry_at = min((self._retry_at[key][1] for key in self._pending if key in self._retry_at),
+                               default=time.monotonic())
+
+            if retry_at > expires:
+                with self._lock:
+                    failed = [f'{endpoint.name.lower()} {id} ({self.errors.get((endpoint, id))})'
+                              for endpoint, id in self._pending]
+
+                raise RuntimeError(f'could not deliver the pending writes to {", ".join(failed)}')
+
+            time.sleep(max(0, retry_at - time.monotonic()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wakeup.wait(self.flush_interval)
+
+            if not self._closed.is_set():
+                self.flush()
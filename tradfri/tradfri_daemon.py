@@ -0,0 +1,400 @@
+import os
+import json
+import time
+import threading
+import socketserver
+
+from coap.coap import Coap
+from coap.coap_state_filter import CoapStateFilter, skipping
+from config.config import Config
+from tradfri import tradfriActions
+from tradfri.tradfri_daemon_client import TradfriDaemonClient
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_device import get_tradfri_device, TradfriProductInfo, TradfriLightBulb, TradfriColorLightBulb, \
+                                   TradfriRemote
+from tradfri.tradfri_group import TradfriGroup
+from tradfri.tradfri_index import TradfriInventoryIndex
+from tradfri.tradfri_inventory import get_tradfri_inventory_parallel
+from tradfri.tradfri_observer import TradfriObserver
+from tradfri.tradfri_scene import TradfriScene, get_tradfri_scenes
+from tradfri.tradfri_transition import fade_light, fade_group
+
+
+def as_dict(obj, index: TradfriInventoryIndex=None):
+    """ converts a device, group or scene into a JSON serializable dict, 'kind' is bulb, color_bulb, remote,
+        device, group or scene. with an index devices get the ids of their groups and groups the state derived
+        from their members """
+    if isinstance(obj, TradfriColorLightBulb):
+        kind = 'color_bulb'
+    elif isinstance(obj, TradfriLightBulb):
+        kind = 'bulb'
+    elif isinstance(obj, TradfriRemote):
+        kind = 'remote'
+    elif isinstance(obj, TradfriGroup):
+        kind = 'group'
+    elif isinstance(obj, TradfriScene):
+        kind = 'scene'
+    else:
+        kind = 'device'
+
+    fields = {'kind': kind}
+
+    for cls in reversed(type(obj).__mro__):
+        for name in getattr(cls, '__slots__', ()):
+            if name == 'api_config':
+                continue
+
+            value = getattr(obj, name, None)
+
+            if isinstance(value, TradfriProductInfo):
+                value = {'description': value.description, 'manufacturer': value.manufacturer,
+                         'version': value.version}
+
+            fields[name] = value
+
+    if index is not None and kind == 'group':
+        # the group's own state is only the last group command, the state of the members is known already
+        fields.update(index.group_state(obj.id).as_dict())
+    elif index is not None and kind != 'scene':
+        fields['groups'] = index.groups_of(obj.id)
+
+    return fields
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # one JSON request per line, the connection may be reused for several requests
+        for line in self.rfile:
+            try:
+                request  = json.loads(line.decode('utf-8'))
+                response = {'ok': True, 'result': self.server.daemon.handle(request.pop('command'), **request)}
+            except Exception as e:
+                response = {'ok': False, 'error': str(e) or type(e).__name__}
+
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TradfriDaemon:
+    """ owns the gateway connection and a mirror of all devices and groups and serves status queries and
+        commands over a Unix domain socket. the mirror is refreshed every refresh_interval seconds and the
+        resources touched by a command are read again in the background; with observe the mirror is kept
+        up to date by CoAP Observe notifications instead """
+    DEFAULT_REFRESH_INTERVAL = 60
+
+    def __init__(self, config: Config, path: str=None, refresh_interval: float=None, observe: bool=False):
+        self.config           = config
+        self.path             = path if path is not None else TradfriDaemonClient.default_path()
+        self.refresh_interval = refresh_interval if refresh_interval is not None else \
+                                TradfriDaemon.DEFAULT_REFRESH_INTERVAL
+        self.devices          = {}
+        self.groups           = {}
+        self.updated          = None
+        self.index            = TradfriInventoryIndex()
+
+        self._observer  = TradfriObserver(config) if observe else None
+        self._lock      = threading.Lock()
+        self._stop_lock = threading.Lock()
+        self._stale     = set()
+        self._wakeup    = threading.Event()
+        self._stopped   = threading.Event()
+        self._server    = None
+        self._threads   = []
+        self._commands  = {
+            'ping':        lambda: 'pong',
+            'status':      self.status,
+            'device':      self.device,
+            'group':       self.group,
+            'refresh':     self.refresh,
+            'metrics':     self.metrics,
+            'power_light': self.power_light,
+            'dim_light':   self.dim_light,
+            'color_light': self.color_light,
+            'power_group': self.power_group,
+            'dim_group':   self.dim_group,
+            'scenes':      self.scenes,
+            'scene_group': self.scene_group,
+            'shutdown':    self.shutdown,
+        }
+
+    def start(self):
+        """ loads the inventory and starts listening, raises RuntimeError if another daemon owns the socket """
+        if os.path.exists(self.path):
+            if TradfriDaemonClient(self.path, 1).is_running():
+                raise RuntimeError(f'a daemon is already listening on {self.path}')
+
+            # left behind by a daemon which has not been stopped properly
+            os.unlink(self.path)
+
+        if self._observer is not None:
+            self._observer.start()
+            self.index.add_to(self._observer)
+        else:
+            self.refresh()
+
+        self._stopped.clear()
+
+        umask        = os.umask(0o177)
+        self._server = _Server(self.path, _Handler)
+        os.umask(umask)
+
+        self._server.daemon = self
+        self._threads       = [threading.Thread(target=self._server.serve_forever, name='tradfri-daemon', daemon=True)]
+
+        if self._observer is None:
+            self._threads.append(threading.Thread(target=self._refresh_loop, name='tradfri-daemon-refresh',
+                                                  daemon=True))
+
+        for thread in self._threads:
+            thread.start()
+
+        return self
+
+    def stop(self):
+        with self._stop_lock:
+            if self._server is None:
+                return
+
+            self._stopped.set()
+            self._wakeup.set()
+
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+            for thread in self._threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+
+            if self._observer is not None:
+                self._observer.stop()
+
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def wait(self):
+        """ blocks until the daemon is stopped (e.g. by the shutdown command) """
+        while not self._stopped.wait(1):
+            pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def handle(self, command: str, skip_unchanged: bool=False, **arguments):
+        """ runs a command, with skip_unchanged its PUTs are only sent if they change the current state and the
+            result is {'result': ..., 'skipped': n, 'sent': n} """
+        handler = self._commands.get(command)
+
+        if handler is None:
+            raise ValueError(f'unknown command {command!r}')
+
+        if not skip_unchanged:
+            return handler(**arguments)
+
+        with skipping(CoapStateFilter(CoapStateFilter.SOURCE_READ)) as state_filter:
+            result = handler(**arguments)
+
+        return {'result': result, 'skipped': state_filter.skipped, 'sent': state_filter.sent}
+
+    def _mirror(self):
+        if self._observer is not None:
+            return self._observer.devices, self._observer.groups
+
+        return self.devices, self.groups
+
+    def status(self):
+        devices, groups = self._mirror()
+
+        with self._lock:
+            # the observer updates its mirror on other threads, so the items are copied first
+            return {
+                'devices': [as_dict(device, self.index) for _, device in sorted(list(devices.items()))],
+                'groups':  [as_dict(group, self.index) for _, group in sorted(list(groups.items()))],
+                'updated': self.updated,
+            }
+
+    def device(self, id):
+        device = self._mirror()[0].get(int(id))
+
+        if device is None:
+            raise ValueError(f'unknown device {id}')
+
+        return as_dict(device, self.index)
+
+    def group(self, id):
+        group = self._mirror()[1].get(int(id))
+
+        if group is None:
+            raise ValueError(f'unknown group {id}')
+
+        return as_dict(group, self.index)
+
+    def refresh(self):
+        """ reads all devices and groups from the gateway, resources which fail keep their last state """
+        if self._observer is not None:
+            return self.status()
+
+        devices, groups = get_tradfri_inventory_parallel(self.config, self.config.max_in_flight)
+
+        with self._lock:
+            self.devices = dict(self._merge(self.devices, devices))
+            self.groups  = dict(self._merge(self.groups, groups))
+            self.updated = time.time()
+
+            for id in set(self.index.devices) - set(self.devices):
+                self.index.remove_device(id)
+
+            for id in set(self.index.groups) - set(self.groups):
+                self.index.remove_group(id)
+
+            for device in self.devices.values():
+                self.index.update_device(device)
+
+            for group in self.groups.values():
+                self.index.update_group(group)
+
+        return self.status()
+
+    @staticmethod
+    def _merge(previous: dict, result):
+        for item in result:
+            yield item.id, item
+
+        for id in result.failed:
+            id = int(id)
+
+            if id in previous:
+                yield id, previous[id]
+
+    def metrics(self, format: str='prometheus'):
+        metrics = Coap.get_metrics()
+
+        if metrics is None:
+            return None
+
+        return metrics.to_prometheus() if format == 'prometheus' else metrics.snapshot()
+
+    def power_light(self, id, value):
+        if value not in ('on', 'off'):
+            raise ValueError('power state can only be on/off')
+
+        tradfriActions.tradfri_power_light(self.config.hubip, self.config.apiuser, self.config.apikey, id, value)
+        self._invalidate(device_ids=[id])
+        return True
+
+    def dim_light(self, id, value, transition=None):
+        if not 1 <= int(value) <= 100:
+            raise ValueError('dim value can only be between 1 and 100')
+
+        if transition is not None:
+            # chained fades go on in the background, the answer does not wait for them
+            fade_light(self.config, id, float(transition), brightness=value, wait=False)
+        else:
+            tradfriActions.tradfri_dim_light(self.config.hubip, self.config.apiuser, self.config.apikey, id, value)
+        self._invalidate(device_ids=[id])
+        return True
+
+    def color_light(self, id, value, transition=None):
+        if value not in ('warm', 'normal', 'cold'):
+            raise ValueError('color value can only be warm/normal/cold')
+
+        if transition is not None:
+            fade_light(self.config, id, float(transition), color=value, wait=False)
+        else:
+            tradfriActions.tradfri_color_light(self.config.hubip, self.config.apiuser, self.config.apikey, id, value)
+        self._invalidate(device_ids=[id])
+        return True
+
+    def power_group(self, id, value):
+        if value not in ('on', 'off'):
+            raise ValueError('power state can only be on/off')
+
+        tradfriActions.tradfri_power_group(self.config.hubip, self.config.apiuser, self.config.apikey, id, value)
+        self._invalidate(group_ids=[id])
+        return True
+
+    def dim_group(self, id, value, transition=None):
+        if not 0 <= int(value) <= 100:
+            raise ValueError('dim value can only be between 0 and 100')
+
+        if transition is not None:
+            fade_group(self.config, id, float(transition), brightness=value, wait=False)
+        else:
+            tradfriActions.tradfri_dim_group(self.config.hubip, self.config.apiuser, self.config.apikey, id, value)
+        self._invalidate(group_ids=[id])
+        return True
+
+    def scenes(self, id):
+        return [as_dict(scene) for scene in get_tradfri_scenes(self.config, id)]
+
+    def scene_group(self, id, value):
+        TradfriScene.activate_static(id, value, self.config)
+        self._invalidate(group_ids=[id])
+        return True
+
+    def shutdown(self):
+        threading.Thread(target=self.stop, name='tradfri-daemon-shutdown').start()
+        return True
+
+    def _invalidate(self, device_ids=(), group_ids=()):
+        """ schedules the resources changed by a command to be read again, group commands change the members """
+        if self._observer is not None:
+            return
+
+        with self._lock:
+            self._stale.update(('device', int(id)) for id in device_ids)
+
+            for id in group_ids:
+                self._stale.add(('group', int(id)))
+                self._stale.update(('device', device_id) for device_id in self.index.devices_of(id))
+
+        self._wakeup.set()
+
+    def _refresh_loop(self):
+        deadline = time.monotonic() + self.refresh_interval
+
+        while not self._stopped.is_set():
+            self._wakeup.wait(max(0.0, deadline - time.monotonic()))
+            self._wakeup.clear()
+
+            if self._stopped.is_set():
+                break
+
+            try:
+                if time.monotonic() >= deadline:
+                    deadline = time.monotonic() + self.refresh_interval
+
+                    with self._lock:
+                        self._stale.clear()
+
+                    self.refresh()
+                else:
+                    self._refresh_stale()
+            except Exception:
+                # gateway not reachable, the mirror keeps its last state until the next attempt
+                pass
+
+    def _refresh_stale(self):
+        with self._lock:
+            stale       = self._stale
+            self._stale = set()
+
+        for kind, id in sorted(stale):
+            if kind == 'device':
+                obj = get_tradfri_device(self.config, id)
+            else:
+                obj = TradfriGroup.get_group(self.config, id)
+
+            if obj is not None:
+                with self._lock:
+                    (self.devices if kind == 'device' else self.groups)[id] = obj
+                    self.index.update(TradfriEndpoint.DEVICE if kind == 'device' else TradfriEndpoint.GROUP, id, obj)
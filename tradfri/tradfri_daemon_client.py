@@ -0,0 +1,57 @@
+import os
+import json
+import socket
+
+from config.config import Config
+
+
+class TradfriDaemonError(Exception):
+    """ the daemon is running but could not execute the command """
+    pass
+
+
+class TradfriDaemonClient:
+    """ client of the TradfriDaemon's Unix domain socket, only depends on the standard library (and Config for
+        the default path) so the CLI scripts can use it without loading the framework """
+    SOCKET_NAME     = 'tradfri.sock'
+    DEFAULT_TIMEOUT = 30
+
+    def __init__(self, path: str=None, timeout: float=None):
+        self.path    = path if path is not None else TradfriDaemonClient.default_path()
+        self.timeout = timeout if timeout is not None else TradfriDaemonClient.DEFAULT_TIMEOUT
+
+    @staticmethod
+    def default_path():
+        """ the socket lives next to tradfri.cfg unless TRADFRI_SOCKET says otherwise """
+        return os.environ.get('TRADFRI_SOCKET') or os.path.join(Config.get_default_dir(), TradfriDaemonClient.SOCKET_NAME)
+
+    def is_running(self):
+        try:
+            return self.request('ping') == 'pong'
+        except (OSError, TradfriDaemonError):
+            return False
+
+    def request(self, command: str, **arguments):
+        """ sends one command and returns its result, raises OSError if the daemon is not reachable """
+        if not hasattr(socket, 'AF_UNIX') or not os.path.exists(self.path):
+            raise ConnectionRefusedError(f'no daemon listening on {self.path}')
+
+        request = dict(arguments, command=command)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(self.timeout)
+            connection.connect(self.path)
+            connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+            with connection.makefile('rb') as stream:
+                line = stream.readline()
+
+        if not line:
+            raise ConnectionResetError('daemon closed the connection')
+
+        response = json.loads(line.decode('utf-8'))
+
+        if not response.get('ok'):
+            raise TradfriDaemonError(response.get('error', 'unknown error'))
+
+        return response.get('result')
@@ -1,43 +1,160 @@
-import colorsys
+import asyncio
 
 from coap.coap import Coap
+from coap.async_coap import AsyncCoap
 from config.config import Config
 from tradfri.tradfri_endpoint import TradfriEndpoint
 from common.helper import json_helper
+from common.parallel import ParallelFetcher
+from tradfri.tradfri_color import WHITE_SPECTRUM_INDEX, COLOR_INDEX, hsv_to_hex, hsv_to_hex_batch
+from tradfri.tradfri_schema import TradfriKey, TradfriDecodeError, DEVICE_PRODUCT_INFO_SCHEMA, DEVICE_SCHEMA, \
+                                   LIGHT_BULB_SCHEMA, COLOR_LIGHT_BULB_SCHEMA, REMOTE_SCHEMA
 
 
 def get_tradfri_devices(config: Config):
+    """ fetches all devices one after the other, the colours of all color light bulbs are converted in one batch;
+        devices which can't be parsed are left out """
     devices_ids = Coap.get(config, TradfriEndpoint.DEVICE)
-    devices     = []
+    return parse_tradfri_devices([Coap.get(config, TradfriEndpoint.DEVICE, device_id) for device_id in devices_ids])
 
-    for device_id in devices_ids:
-        # try if device is a color light bulb
-        device = TradfriColorLightBulb.get_device(config, device_id)
 
-        # if device is no color light bulb, try if it is a usual light bulb
-        if device is None:
-            device = TradfriLightBulb.get_device(config, device_id)
+def get_tradfri_devices_parallel(config: Config, max_in_flight: int=None, fetcher: ParallelFetcher=None):
+    """ fetches all devices concurrently, returns a ParallelResult with the devices in id order and failed ids """
+    devices_ids = Coap.get(config, TradfriEndpoint.DEVICE)
+
+    if fetcher is not None:
+        return fetcher.map(lambda id: get_tradfri_device(config, id), devices_ids)
+
+    with ParallelFetcher(max_in_flight) as fetcher:
+        return fetcher.map(lambda id: get_tradfri_device(config, id), devices_ids)
+
+
+def iter_tradfri_devices(config: Config, max_in_flight: int=None, failed: dict=None):
+    """ yields the devices as soon as they are decoded (in completion order), memory stays bounded for any
+        number of devices; ids which could not be fetched or parsed are put in failed (if given) """
+    devices_ids = Coap.get(config, TradfriEndpoint.DEVICE)
+
+    with ParallelFetcher(max_in_flight) as fetcher:
+        yield from fetcher.imap(lambda id: get_tradfri_device(config, id), devices_ids, failed)
+
+
+def get_tradfri_device(config: Config, id):
+    """ fetches a device once and returns it as instance of the most specific device class """
+    json = Coap.get(config, TradfriEndpoint.DEVICE, id)
+    return parse_tradfri_device(json)
+
+
+async def get_tradfri_devices_async(config: Config, max_in_flight: int=None, timeout=None):
+    """ fetches all devices concurrently on the event loop, timeout applies to every single request """
+    devices_ids = await AsyncCoap.get(config, TradfriEndpoint.DEVICE, timeout=timeout)
+    semaphore   = asyncio.Semaphore(max_in_flight if max_in_flight is not None else ParallelFetcher.DEFAULT_MAX_IN_FLIGHT)
+
+    async def fetch(device_id):
+        async with semaphore:
+            return await AsyncCoap.get(config, TradfriEndpoint.DEVICE, device_id, timeout)
+
+    # all responses are there at once, so they are parsed in one batch
+    return parse_tradfri_devices(await asyncio.gather(*[fetch(device_id) for device_id in devices_ids]))
+
+
+async def get_tradfri_device_async(config: Config, id, timeout=None):
+    json = await AsyncCoap.get(config, TradfriEndpoint.DEVICE, id, timeout)
+    return parse_tradfri_device(json)
+
+
+def parse_tradfri_device(json, api_config: Config=None):
+    """ creates an instance of the most specific device class based on the keys in the JSON response """
+    try:
+        json_temp = json_helper(json)
+    except ValueError:
+        return None
+
+    classes = [TradfriDevice]
+
+    if isinstance(json_temp, dict):
+        light_bulb_entries = json_temp.get(TradfriLightBulb._JSON_KEY_BULB)
+
+        if isinstance(light_bulb_entries, list) and light_bulb_entries:
+            # only color light bulbs report a hue, usual light bulbs are parsed otherwise
+            if isinstance(light_bulb_entries[0], dict) and TradfriColorLightBulb._JSON_KEY_BULB_HUE in light_bulb_entries[0]:
+                classes = [TradfriColorLightBulb, TradfriLightBulb, TradfriDevice]
+            else:
+                classes = [TradfriLightBulb, TradfriDevice]
 
-        # if device is no usual light bulb, try if it is a remote control
-        if device is None:
-            device = TradfriRemote.get_device(config, device_id)
+        elif TradfriRemote._JSON_KEY_SUB_LINKS in json_temp:
+            classes = [TradfriRemote, TradfriDevice]
 
-        # if device is no remote control, just parse it as device
-        if device is None:
-            device = TradfriDevice.get_device(config, device_id)
+    # fall back to the next generic class if a specific one can't parse the response
+    for cls in classes:
+        device = cls.from_json(json_temp, api_config)
 
-        # if device has been parsed successfully, add it to the devices list
         if device is not None:
-            devices.append(device)
+            return device
+
+    return None
+
+
+def parse_tradfri_devices(jsons, api_config: Config=None):
+    """ parses many device responses (e.g. a whole inventory), the colours of all color light bulbs are converted
+        in one batch which is vectorized if numpy is installed; unparsable responses are skipped """
+    devices = []
+    colored = []
+
+    for json in jsons:
+        try:
+            json_temp = json_helper(json)
+        except ValueError:
+            continue
+
+        fields = None
+
+        if isinstance(json_temp, dict):
+            light_bulb_entries = json_temp.get(TradfriLightBulb._JSON_KEY_BULB)
+
+            if isinstance(light_bulb_entries, list) and light_bulb_entries and \
+               isinstance(light_bulb_entries[0], dict) and \
+               TradfriColorLightBulb._JSON_KEY_BULB_HUE in light_bulb_entries[0]:
+                try:
+                    fields = COLOR_LIGHT_BULB_SCHEMA.decode(json_temp)
+                except TradfriDecodeError:
+                    pass
+
+        if fields is not None:
+            colored.append((len(devices), fields))
+            devices.append(None)
+        else:
+            device = parse_tradfri_device(json_temp, api_config)
+
+            if device is not None:
+                devices.append(device)
+
+    if colored:
+        hues         = [round(fields['hue'], 2) for _, fields in colored]
+        saturations  = [round(fields['saturation'], 2) for _, fields in colored]
+        colors       = hsv_to_hex_batch(hues, saturations, [fields['brightness'] for _, fields in colored])
+        descriptions = COLOR_INDEX.from_hs_batch(hues, saturations)
+
+        for (index, fields), color, description in zip(colored, colors, descriptions):
+            description = TradfriColorLightBulb._gateway_color_name(fields) or COLOR_INDEX.exact.get(color, description)
+
+            devices[index] = TradfriColorLightBulb(fields['id'], fields['name'], fields['hue'], fields['saturation'],
+                                                   fields['brightness'], fields['status'], fields['creation_date'],
+                                                   TradfriProductInfo._from_fields(fields['product_info']),
+                                                   api_config, color, description)
 
     return devices
 
 
 class TradfriProductInfo:
-    __JSON_KEY_PRODUCT_INFO              = '3'
-    __JSON_KEY_PRODUCT_INFO_DESCRIPTION  = '1'
-    __JSON_KEY_PRODUCT_INFO_MANUFACTURER = '0'
-    __JSON_KEY_PRODUCT_INFO_VERSION      = '3'
+    __JSON_KEY_PRODUCT_INFO              = TradfriKey.PRODUCT_INFO
+    __JSON_KEY_PRODUCT_INFO_DESCRIPTION  = TradfriKey.PRODUCT_INFO_DESCRIPTION
+    __JSON_KEY_PRODUCT_INFO_MANUFACTURER = TradfriKey.PRODUCT_INFO_MANUFACTURER
+    __JSON_KEY_PRODUCT_INFO_VERSION      = TradfriKey.PRODUCT_INFO_VERSION
+
+    __slots__ = ('description', 'manufacturer', 'version')
+
+    # identical devices share one instance, see intern
+    __interned = {}
 
     def __init__(self, description, manufacturer, version):
         self.description  = description
@@ -47,27 +164,38 @@ class TradfriProductInfo:
     @staticmethod
     def from_json(json):
         """ creates a TradfriProductInfo instance out of a valid TRADFRI coap-client JSON response """
-        product_info = None
-
         try:
-            json_temp = json_helper(json)
+            fields = DEVICE_PRODUCT_INFO_SCHEMA.decode(json)
+        except TradfriDecodeError:
+            return None
 
-            product_info_entry = json_temp[TradfriProductInfo.__JSON_KEY_PRODUCT_INFO]
-            product_info       = TradfriProductInfo(product_info_entry[TradfriProductInfo.__JSON_KEY_PRODUCT_INFO_DESCRIPTION ],
-                                                    product_info_entry[TradfriProductInfo.__JSON_KEY_PRODUCT_INFO_MANUFACTURER],
-                                                    product_info_entry[TradfriProductInfo.__JSON_KEY_PRODUCT_INFO_VERSION     ])
+        return TradfriProductInfo._from_fields(fields['product_info'])
 
-        except Exception as e:
-            # neither valid JSON string nor JSON object
-            pass
+    @staticmethod
+    def intern(description, manufacturer, version):
+        """ returns the shared TradfriProductInfo instance for these values, it must not be modified """
+        key          = (description, manufacturer, version)
+        product_info = TradfriProductInfo.__interned.get(key)
+
+        if product_info is None:
+            product_info = TradfriProductInfo.__interned.setdefault(key, TradfriProductInfo(*key))
 
         return product_info
 
+    @staticmethod
+    def _from_fields(fields):
+        if fields is None:
+            return None
+
+        return TradfriProductInfo.intern(fields['description'], fields['manufacturer'], fields['version'])
+
 
 class TradfriDevice:
-    __JSON_KEY_INSTANCE_ID   = '9003'
-    __JSON_KEY_CREATION_DATE = '9002'
-    __JSON_KEY_NAME          = '9001'
+    __JSON_KEY_INSTANCE_ID   = TradfriKey.INSTANCE_ID
+    __JSON_KEY_CREATION_DATE = TradfriKey.CREATION_DATE
+    __JSON_KEY_NAME          = TradfriKey.NAME
+
+    __slots__ = ('id', 'name', 'creation_date', 'product_info', 'api_config')
 
     def __init__(self, id, name, creation_date, product_info: TradfriProductInfo=None, api_config: Config=None):
         self.id            = id
@@ -81,24 +209,21 @@ class TradfriDevice:
         payload = '{ "3311": [{ "5850": ' + str(int(on)) + ' }] }'
         Coap.put(payload, api_config, TradfriEndpoint.DEVICE, id, False)
 
+    @staticmethod
+    async def set_power_static_async(id: int, on: bool, api_config: Config, timeout=None):
+        payload = '{ "3311": [{ "5850": ' + str(int(on)) + ' }] }'
+        await AsyncCoap.put(payload, api_config, TradfriEndpoint.DEVICE, id, False, timeout)
+
     @staticmethod
     def from_json(json, api_config: Config=None):
         """ creates a TradfriDevice instance out of a valid TRADFRI coap-client JSON response """
-        device = None
-
         try:
-            json_temp    = json_helper(json)
-            product_info = TradfriProductInfo.from_json(json)
-
-            device = TradfriDevice(json_temp[TradfriDevice.__JSON_KEY_INSTANCE_ID  ],
-                                   json_temp[TradfriDevice.__JSON_KEY_NAME         ],
-                                   json_temp[TradfriDevice.__JSON_KEY_CREATION_DATE], product_info, api_config)
+            fields = DEVICE_SCHEMA.decode(json)
+        except TradfriDecodeError:
+            return None
 
-        except Exception as e:
-            # neither valid JSON string nor JSON object
-            pass
-
-        return device
+        return TradfriDevice(fields['id'], fields['name'], fields['creation_date'],
+                             TradfriProductInfo._from_fields(fields['product_info']), api_config)
 
     @staticmethod
     def get_device(config: Config, id):
@@ -107,16 +232,16 @@ class TradfriDevice:
 
 
 class TradfriLightBulb(TradfriDevice):
-    __JSON_KEY_BULB                 = '3311'
-    __JSON_KEY_BULB_STATE           = '5850'
-    __JSON_KEY_BULB_BRIGHTNESS      = '5851'
-    __JSON_KEY_BULB_COLOR           = '5706'
-    __JSON_KEY_BULB_COLOR_X         = '5709'
-    __JSON_KEY_BULB_COLOR_Y         = '5710'
-    __JSON_KEY_BULB_TEMPERATURE     = '5711'
-    __JSON_KEY_BULB_TRANSITION_TIME = '5712'
+    _JSON_KEY_BULB                  = TradfriKey.LIGHT
+    __JSON_KEY_BULB_STATE           = TradfriKey.STATE
+    __JSON_KEY_BULB_BRIGHTNESS      = TradfriKey.BRIGHTNESS
+    __JSON_KEY_BULB_COLOR           = TradfriKey.COLOR
+    __JSON_KEY_BULB_COLOR_X         = TradfriKey.COLOR_X
+    __JSON_KEY_BULB_COLOR_Y         = TradfriKey.COLOR_Y
+    __JSON_KEY_BULB_TEMPERATURE     = TradfriKey.TEMPERATURE
+    __JSON_KEY_BULB_TRANSITION_TIME = TradfriKey.TRANSITION_TIME
 
-    __MAX_BRIGHTNESS = 255
+    __slots__ = ('brightness', 'color', 'color_description', 'status')
 
     def __init__(self, id, name, brightness=0, color=0, status=False, creation_date=0, product_info: TradfriProductInfo=None, api_config: Config=None):
         super().__init__(id, name, creation_date, product_info, api_config)
@@ -129,29 +254,14 @@ class TradfriLightBulb(TradfriDevice):
     @staticmethod
     def from_json(json, api_config: Config=None):
         """ creates a TradfriLightBulb instance out of a valid TRADFRI coap-client JSON response """
-        light_bulb = None
-
         try:
-            json_temp = json_helper(json)
-            device    = TradfriDevice.from_json(json_temp)
-
-            light_bulb_entry = json_temp[TradfriLightBulb.__JSON_KEY_BULB][0]
-            brightness       = round((light_bulb_entry[TradfriLightBulb.__JSON_KEY_BULB_BRIGHTNESS] / TradfriLightBulb.__MAX_BRIGHTNESS) * 100, 2)
-            status           = light_bulb_entry[TradfriLightBulb.__JSON_KEY_BULB_STATE]
-
-            if TradfriLightBulb.__JSON_KEY_BULB_COLOR in light_bulb_entry:
-                color = light_bulb_entry[TradfriLightBulb.__JSON_KEY_BULB_COLOR]
-            else:
-                color = 'Standard'
-
-            light_bulb = TradfriLightBulb(device.id, device.name, brightness, color, status, device.creation_date,
-                                          device.product_info, api_config)
-
-        except Exception as e:
-            # neither valid JSON string nor JSON object
-            pass
+            fields = LIGHT_BULB_SCHEMA.decode(json)
+        except TradfriDecodeError:
+            return None
 
-        return light_bulb
+        return TradfriLightBulb(fields['id'], fields['name'], fields['brightness'], fields['color'], fields['status'],
+                                fields['creation_date'], TradfriProductInfo._from_fields(fields['product_info']),
+                                api_config)
 
     @staticmethod
     def get_device(config: Config, id):
@@ -160,72 +270,46 @@ class TradfriLightBulb(TradfriDevice):
 
     @staticmethod
     def _map_color_value(color_value):
-        color_map =\
-        {
-            "f5faf6": "White",
-            "f1e0b5": "Warm",
-            "efd275": "Glow",
-        }
-
-        for value, description in color_map.items():
-            if value == color_value:
-                color_value = description
-                break
-
-        return color_value
+        """ returns the name of the nearest white spectrum preset, values which are no hex colour are kept """
+        return WHITE_SPECTRUM_INDEX.from_hex(color_value)
 
 
 class TradfriColorLightBulb(TradfriLightBulb):
-    __JSON_KEY_BULB            = '3311'
-    __JSON_KEY_BULB_HUE        = '5707'
-    __JSON_KEY_BULB_SATURATION = '5708'
+    _JSON_KEY_BULB             = TradfriKey.LIGHT
+    _JSON_KEY_BULB_HUE         = TradfriKey.HUE
+    __JSON_KEY_BULB_SATURATION = TradfriKey.SATURATION
 
-    __MAX_HUE        = 65536
-    __MAX_SATURATION = 65536
+    __slots__ = ('hue', 'saturation')
 
-    def __init__(self, id, name, hue=0, saturation=0, brightness=0, status=False, creation_date=0, product_info: TradfriProductInfo=None, api_config: Config=None):
+    def __init__(self, id, name, hue=0, saturation=0, brightness=0, status=False, creation_date=0, product_info: TradfriProductInfo=None, api_config: Config=None, color=None, color_description=None):
         super().__init__(id, name, brightness, 0, status, creation_date, product_info, api_config)
 
         self.hue        = round(hue, 2)
         self.saturation = round(saturation, 2)
 
-        r, g, b = colorsys.hsv_to_rgb(self.hue / 360, self.saturation / 100, self.brightness / 100)
-
-        r *= 255
-        g *= 255
-        b *= 255
-
-        self.color             = f'{int(r):02x}{int(g):02x}{int(b):02x}'
-        self.color_description = TradfriColorLightBulb._map_color_value(self.color)
+        # parse_tradfri_devices converts the colours of a whole inventory at once and passes them in
+        self.color             = color if color is not None else hsv_to_hex(self.hue, self.saturation, self.brightness)
+        self.color_description = color_description if color_description is not None else \
+                                 TradfriColorLightBulb._map_color_value(self.color, self.hue, self.saturation)
 
     @staticmethod
     def from_json(json, api_config: Config=None):
         """ creates a TradfriColorLightBulb instance out of a valid TRADFRI coap-client JSON response """
-        color_light_bulb = None
-
         try:
-            light_bulb = TradfriLightBulb.from_json(json)
-            json_temp  = json_helper(json)
-
-            color_light_bulb_entry = json_temp[TradfriColorLightBulb.__JSON_KEY_BULB][0]
-            hue                    = (color_light_bulb_entry[TradfriColorLightBulb.__JSON_KEY_BULB_HUE] / TradfriColorLightBulb.__MAX_HUE) * 360
-            saturation             = (color_light_bulb_entry[TradfriColorLightBulb.__JSON_KEY_BULB_SATURATION] / TradfriColorLightBulb.__MAX_SATURATION) * 100
-
-            color_light_bulb = TradfriColorLightBulb(light_bulb.id           ,
-                                                     light_bulb.name         ,
-                                                     hue                     ,
-                                                     saturation              ,
-                                                     light_bulb.brightness   ,
-                                                     light_bulb.status       ,
-                                                     light_bulb.creation_date,
-                                                     light_bulb.product_info ,
-                                                     api_config              )
-
-        except Exception as e:
-            # neither valid JSON string nor JSON object
-            pass
-
-        return color_light_bulb
+            fields = COLOR_LIGHT_BULB_SCHEMA.decode(json)
+        except TradfriDecodeError:
+            return None
+
+        return TradfriColorLightBulb(fields['id']           ,
+                                     fields['name']         ,
+                                     fields['hue']          ,
+                                     fields['saturation']   ,
+                                     fields['brightness']   ,
+                                     fields['status']       ,
+                                     fields['creation_date'],
+                                     TradfriProductInfo._from_fields(fields['product_info']),
+                                     api_config             ,
+                                     color_description=TradfriColorLightBulb._gateway_color_name(fields))
 
     @staticmethod
     def get_device(config: Config, id):
@@ -233,41 +317,32 @@ class TradfriColorLightBulb(TradfriLightBulb):
         return TradfriColorLightBulb.from_json(json)
 
     @staticmethod
-    def _map_color_value(color_value):
-        color_map =\
-        {
-            "4a418a": "Blue",
-            "6c83ba": "Light Blue",
-            "8f2686": "Saturated Purple",
-            "a9d62b": "Lime",
-            "c984bb": "Light Purple",
-            "d6e44b": "Yellow",
-            "d9337c": "Saturated Pink",
-            "da5d41": "Dark Peach",
-            "dc4b31": "Saturated Red",
-            "dcf0f8": "Cold sky",
-            "e491af": "Pink",
-            "e57345": "Peach",
-            "e78834": "Warm Amber",
-            "e8bedd": "Light Pink",
-            "eaf6fb": "Cool daylight",
-            "ebb63e": "Candlelight",
-            "efd275": "Warm glow",
-            "f1e0b5": "Warm white",
-            "f2eccf": "Sunrise",
-            "f5faf6": "Cool white"
-        }
-
-        for value, description in color_map.items():
-            if value == color_value:
-                color_value = description
-                break
-
-        return color_value
+    def _gateway_color_name(fields: dict):
+        """ returns the name of the colour the gateway reports, its preset (5706) or else the nearest name to its
+            xy values (5709/5710); None if it reports neither """
+        name = COLOR_INDEX.exact.get(fields['color'])
+
+        if name is None and fields['x'] is not None and fields['y'] is not None:
+            name = COLOR_INDEX.from_gateway_xy(fields['x'], fields['y'])
+
+        return name
+
+    @staticmethod
+    def _map_color_value(color_value, hue=None, saturation=None):
+        """ returns the name of the nearest colour preset, hue and saturation are preferred over the hex colour
+            because the latter includes the brightness """
+        name = COLOR_INDEX.exact.get(color_value)
+
+        if name is None and hue is not None and saturation is not None:
+            name = COLOR_INDEX.from_hs(hue, saturation)
+
+        return name if name is not None else COLOR_INDEX.from_hex(color_value)
 
 
 class TradfriRemote(TradfriDevice):
-    _JSON_KEY_SUB_LINKS = '15009'
+    _JSON_KEY_SUB_LINKS = TradfriKey.SUB_LINKS
+
+    __slots__ = ()
 
     def __init__(self, id, name, creation_date=0, product_info: TradfriProductInfo=None, api_config: Config=None):
         super().__init__(id, name, creation_date, product_info, api_config)
@@ -275,20 +350,13 @@ class TradfriRemote(TradfriDevice):
     @staticmethod
     def from_json(json, api_config: Config=None):
         """ creates a TradfriRemote instance out of a valid TRADFRI coap-client JSON response """
-        remote = None
-
         try:
-            json_temp = json_helper(json)
-
-            if TradfriRemote._JSON_KEY_SUB_LINKS in json_temp:
-                device = TradfriDevice.from_json(json_temp)
-                remote = TradfriRemote(device.id, device.name, device.creation_date, device.product_info, api_config)
-
-        except Exception as e:
-            # neither valid JSON string nor JSON object
-            pass
+            fields = REMOTE_SCHEMA.decode(json)
+        except TradfriDecodeError:
+            return None
 
-        return remote
+        return TradfriRemote(fields['id'], fields['name'], fields['creation_date'],
+                             TradfriProductInfo._from_fields(fields['product_info']), api_config)
 
     @staticmethod
     def get_device(config: Config, id):
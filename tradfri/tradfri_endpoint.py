@@ -4,3 +4,4 @@ from enum import Enum
 class TradfriEndpoint(Enum):
     DEVICE = 0
     GROUP  = 1
+    SCENE  = 2
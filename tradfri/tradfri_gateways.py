@@ -0,0 +1,185 @@
+import contextvars
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from config.config import Config
+from coap.coap_policy import deadline
+from common.parallel import ParallelFetcher
+from tradfri import tradfriActions
+from tradfri.tradfri_device import get_tradfri_devices_parallel
+from tradfri.tradfri_group import get_tradfri_groups_parallel
+from tradfri.tradfri_inventory import get_tradfri_inventory_parallel
+
+
+class GatewayResult:
+    """ merged result of several gateways, items and failed are keyed by (gateway, id). a gateway which failed
+        as a whole (unreachable, no answer within the timeout) is reported as (gateway, None) """
+    def __init__(self, items: dict=None, failed: dict=None):
+        self.items  = items if items is not None else {}
+        self.failed = failed if failed is not None else {}
+
+    def __iter__(self):
+        return iter(self.items.values())
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, key):
+        return self.items[key]
+
+    def failed_gateways(self):
+        return sorted(gateway for gateway, id in self.failed if id is None)
+
+    def add(self, gateway: str, result):
+        """ adds the ParallelResult of one gateway """
+        for item in result:
+            self.items[(gateway, item.id)] = item
+
+        for id, error in result.failed.items():
+            self.failed[(gateway, id)] = error
+
+
+def _map_gateways(configs: dict, call, timeout: float=None):
+    """ runs call(name, config) for every gateway on its own thread and returns (name, future) tuples once all
+        futures are done or the timeout has passed. threads of gateways which are still busy are left behind,
+        so a slow gateway does not delay the results of the others; the timeout is their Coap deadline as well,
+        so they give up instead of sending further requests """
+    executor = ThreadPoolExecutor(max_workers=max(1, len(configs)), thread_name_prefix='tradfri-gateway')
+
+    def submit(name, config):
+        return name, executor.submit(contextvars.copy_context().run, call, name, config)
+
+    if timeout is not None:
+        with deadline(timeout):
+            futures = [submit(name, config) for name, config in configs.items()]
+    else:
+        futures = [submit(name, config) for name, config in configs.items()]
+
+    executor.shutdown(wait=False)
+
+    wait([future for _, future in futures], timeout)
+    return futures
+
+
+def _outcome(name: str, future):
+    """ returns (result, error) of a gateway's future """
+    if not future.done():
+        return None, TimeoutError(f'gateway {name} did not answer in time')
+
+    error = future.exception()
+    return (None, error) if error is not None else (future.result(), None)
+
+
+def _max_in_flight(config: Config, max_in_flight: int=None):
+    return max_in_flight if max_in_flight is not None else config.max_in_flight
+
+
+def _fetch_all(fetch, configs: dict, max_in_flight: int=None, timeout: float=None):
+    """ runs fetch(config, max_in_flight) for all gateways, returns (name, result, error) tuples """
+    futures = _map_gateways(configs, lambda name, config: fetch(config, _max_in_flight(config, max_in_flight)),
+                            timeout)
+    return [(name,) + _outcome(name, future) for name, future in futures]
+
+
+def get_tradfri_devices_all(configs: dict, max_in_flight: int=None, timeout: float=None):
+    """ fetches the devices of all gateways in parallel, max_in_flight applies to every gateway on its own;
+        returns a GatewayResult keyed by (gateway, device id) """
+    result = GatewayResult()
+
+    for name, devices, error in _fetch_all(get_tradfri_devices_parallel, configs, max_in_flight, timeout):
+        if error is not None:
+            result.failed[(name, None)] = error
+        else:
+            result.add(name, devices)
+
+    return result
+
+
+def get_tradfri_groups_all(configs: dict, max_in_flight: int=None, timeout: float=None):
+    """ fetches the groups of all gateways in parallel, returns a GatewayResult keyed by (gateway, group id) """
+    result = GatewayResult()
+
+    for name, groups, error in _fetch_all(get_tradfri_groups_parallel, configs, max_in_flight, timeout):
+        if error is not None:
+            result.failed[(name, None)] = error
+        else:
+            result.add(name, groups)
+
+    return result
+
+
+def get_tradfri_inventory_all(configs: dict, max_in_flight: int=None, timeout: float=None):
+    """ fetches devices and groups of all gateways in parallel, returns a tuple of GatewayResults
+        (devices, groups) """
+    devices = GatewayResult()
+    groups  = GatewayResult()
+
+    for name, inventory, error in _fetch_all(get_tradfri_inventory_parallel, configs, max_in_flight, timeout):
+        if error is not None:
+            devices.failed[(name, None)] = error
+            groups.failed[(name, None)]  = error
+        else:
+            devices.add(name, inventory[0])
+            groups.add(name, inventory[1])
+
+    return devices, groups
+
+
+def _send(action, configs: dict, keys, value, max_in_flight: int=None, timeout: float=None):
+    """ runs action(hubip, apiuser, apikey, id, value) for all (gateway, id) keys, the gateways in parallel;
+        returns a GatewayResult with True per successful key """
+    ids = {}
+
+    for gateway, id in keys:
+        if gateway not in configs:
+            raise ValueError(f'unknown gateway {gateway}')
+
+        ids.setdefault(gateway, []).append(id)
+
+    def send(name, config):
+        def put(id):
+            action(config.hubip, config.apiuser, config.apikey, id, value)
+            return True
+
+        with ParallelFetcher(_max_in_flight(config, max_in_flight)) as fetcher:
+            return fetcher.map(put, ids[name])
+
+    result = GatewayResult()
+
+    for name, future in _map_gateways({name: configs[name] for name in ids}, send, timeout):
+        sent, error = _outcome(name, future)
+
+        if error is not None:
+            for id in ids[name]:
+                result.failed[(name, id)] = error
+            continue
+
+        for id, future_error in sent.failed.items():
+            result.failed[(name, id)] = future_error
+
+        for id in ids[name]:
+            if id not in sent.failed:
+                result.items[(name, id)] = True
+
+    return result
+
+
+def power_lights(configs: dict, keys, value, max_in_flight: int=None, timeout: float=None):
+    """ switches the lights (gateway, id) on or off, value is on/off """
+    return _send(tradfriActions.tradfri_power_light, configs, keys, value, max_in_flight, timeout)
+
+
+def dim_lights(configs: dict, keys, value, max_in_flight: int=None, timeout: float=None):
+    return _send(tradfriActions.tradfri_dim_light, configs, keys, value, max_in_flight, timeout)
+
+
+def color_lights(configs: dict, keys, value, max_in_flight: int=None, timeout: float=None):
+    return _send(tradfriActions.tradfri_color_light, configs, keys, value, max_in_flight, timeout)
+
+
+def power_groups(configs: dict, keys, value, max_in_flight: int=None, timeout: float=None):
+    return _send(tradfriActions.tradfri_power_group, configs, keys, value, max_in_flight, timeout)
+
+
+def dim_groups(configs: dict, keys, value, max_in_flight: int=None, timeout: float=None):
+    return _send(tradfriActions.tradfri_dim_group, configs, keys, value, max_in_flight, timeout)
@@ -1,7 +1,11 @@
+import asyncio
+
 from coap.coap import Coap
+from coap.async_coap import AsyncCoap
 from config.config import Config
 from tradfri.tradfri_endpoint import TradfriEndpoint
-from common.helper import json_helper
+from common.parallel import ParallelFetcher
+from tradfri.tradfri_schema import TradfriKey, TradfriDecodeError, GROUP_SCHEMA
 
 
 def get_tradfri_groups(config: Config):
@@ -19,15 +23,49 @@ def get_tradfri_groups(config: Config):
     return groups
 
 
+def get_tradfri_groups_parallel(config: Config, max_in_flight: int=None, fetcher: ParallelFetcher=None):
+    """ fetches all groups concurrently, returns a ParallelResult with the groups in id order and failed ids """
+    group_ids = Coap.get(config, TradfriEndpoint.GROUP)
+
+    if fetcher is not None:
+        return fetcher.map(lambda id: TradfriGroup.get_group(config, id), group_ids)
+
+    with ParallelFetcher(max_in_flight) as fetcher:
+        return fetcher.map(lambda id: TradfriGroup.get_group(config, id), group_ids)
+
+
+def iter_tradfri_groups(config: Config, max_in_flight: int=None, failed: dict=None):
+    """ yields the groups as soon as they are decoded (in completion order), see iter_tradfri_devices """
+    group_ids = Coap.get(config, TradfriEndpoint.GROUP)
+
+    with ParallelFetcher(max_in_flight) as fetcher:
+        yield from fetcher.imap(lambda id: TradfriGroup.get_group(config, id), group_ids, failed)
+
+
+async def get_tradfri_groups_async(config: Config, max_in_flight: int=None, timeout=None):
+    """ fetches all groups concurrently on the event loop, timeout applies to every single request """
+    group_ids = await AsyncCoap.get(config, TradfriEndpoint.GROUP, timeout=timeout)
+    semaphore = asyncio.Semaphore(max_in_flight if max_in_flight is not None else ParallelFetcher.DEFAULT_MAX_IN_FLIGHT)
+
+    async def fetch(group_id):
+        async with semaphore:
+            return await TradfriGroup.get_group_async(config, group_id, timeout)
+
+    groups = await asyncio.gather(*[fetch(group_id) for group_id in group_ids])
+    return [group for group in groups if group is not None]
+
+
 class TradfriGroup:
-    __JSON_KEY_INSTANCE_ID     = '9003'
-    __JSON_KEY_CREATION_DATE   = '9002'
-    __JSON_KEY_NAME            = '9001'
-    __JSON_KEY_REMOTES         = '9018'
-    __JSON_KEY_REMOTE_ENDPOINT = '15002'
-    __JSON_KEY_STATE           = '5850'
-    __JSON_KEY_BRIGHTNESS      = '5851'
-    __JSON_KEY_SCENE_ID        = '9039'
+    __JSON_KEY_INSTANCE_ID     = TradfriKey.INSTANCE_ID
+    __JSON_KEY_CREATION_DATE   = TradfriKey.CREATION_DATE
+    __JSON_KEY_NAME            = TradfriKey.NAME
+    __JSON_KEY_REMOTES         = TradfriKey.GROUP_MEMBERS
+    __JSON_KEY_REMOTE_ENDPOINT = TradfriKey.GROUP_MEMBERS_ENDPOINT
+    __JSON_KEY_STATE           = TradfriKey.STATE
+    __JSON_KEY_BRIGHTNESS      = TradfriKey.BRIGHTNESS
+    __JSON_KEY_SCENE_ID        = TradfriKey.SCENE_ID
+
+    __slots__ = ('id', 'name', 'creation_date', 'state', 'brightness', 'device_ids', 'api_config')
 
     def __init__(self, id, name, creation_date, state, brightness, device_ids: [], api_config: Config=None):
         self.id            = id
@@ -41,27 +79,25 @@ class TradfriGroup:
     @staticmethod
     def from_json(json, api_config: Config=None):
         """ creates a TradfriGroup instance out of a valid TRADFRI coap-client JSON response """
-        device = None
-
         try:
-            json_temp  = json_helper(json)
-            device_ids = json_temp[TradfriGroup.__JSON_KEY_REMOTES][TradfriGroup.__JSON_KEY_REMOTE_ENDPOINT][TradfriGroup.__JSON_KEY_INSTANCE_ID]
+            fields = GROUP_SCHEMA.decode(json)
+        except TradfriDecodeError:
+            return None
 
-            device = TradfriGroup(json_temp[TradfriGroup.__JSON_KEY_INSTANCE_ID  ],
-                                  json_temp[TradfriGroup.__JSON_KEY_NAME         ],
-                                  json_temp[TradfriGroup.__JSON_KEY_CREATION_DATE],
-                                  json_temp[TradfriGroup.__JSON_KEY_STATE        ],
-                                  json_temp[TradfriGroup.__JSON_KEY_BRIGHTNESS   ],
-                                  device_ids                                      ,
-                                  api_config                                      )
-
-        except Exception as e:
-            # neither valid JSON string nor JSON object
-            pass
-
-        return device
+        return TradfriGroup(fields['id'           ],
+                            fields['name'         ],
+                            fields['creation_date'],
+                            fields['state'        ],
+                            fields['brightness'   ],
+                            fields['device_ids'   ],
+                            api_config             )
 
     @staticmethod
     def get_group(config: Config, id):
         json = Coap.get(config, TradfriEndpoint.GROUP, id)
         return TradfriGroup.from_json(json)
+
+    @staticmethod
+    async def get_group_async(config: Config, id, timeout=None):
+        json = await AsyncCoap.get(config, TradfriEndpoint.GROUP, id, timeout)
+        return TradfriGroup.from_json(json)
@@ -0,0 +1,128 @@
+import threading
+
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_device import TradfriLightBulb
+
+
+class TradfriGroupState:
+    """ group state derived from the known states of the member lights, members which are not known (yet) are
+        counted in unknown. mean_brightness (0 - 100) is None if no member light is known """
+    __slots__ = ('any_on', 'all_on', 'mean_brightness', 'lights', 'unknown')
+
+    def __init__(self, any_on: bool, all_on: bool, mean_brightness, lights: int, unknown: int):
+        self.any_on          = any_on
+        self.all_on          = all_on
+        self.mean_brightness = mean_brightness
+        self.lights          = lights
+        self.unknown         = unknown
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in TradfriGroupState.__slots__}
+
+
+class TradfriInventoryIndex:
+    """ devices and groups by id with device -> groups and group -> devices maps, which are updated incrementally
+        with every changed device or group. add_to(observer) keeps the index in sync with a TradfriObserver """
+    def __init__(self, devices=(), groups=()):
+        self.devices = {}
+        self.groups  = {}
+
+        self._device_groups = {}
+        self._group_devices = {}
+        self._lock          = threading.RLock()
+
+        for device in devices:
+            self.update_device(device)
+
+        for group in groups:
+            self.update_group(group)
+
+    def update_device(self, device):
+        with self._lock:
+            self.devices[int(device.id)] = device
+
+    def remove_device(self, id):
+        # the device stays a member of its groups until the groups are updated, like on the gateway
+        with self._lock:
+            self.devices.pop(int(id), None)
+
+    def update_group(self, group):
+        """ adds or replaces a group, only the memberships which changed are touched """
+        id      = int(group.id)
+        members = {int(device_id) for device_id in group.device_ids}
+
+        with self._lock:
+            previous = self._group_devices.get(id, set())
+
+            for device_id in previous - members:
+                self._unlink(device_id, id)
+
+            for device_id in members - previous:
+                self._device_groups.setdefault(device_id, set()).add(id)
+
+            self.groups[id]         = group
+            self._group_devices[id] = members
+
+    def remove_group(self, id):
+        id = int(id)
+
+        with self._lock:
+            for device_id in self._group_devices.pop(id, set()):
+                self._unlink(device_id, id)
+
+            self.groups.pop(id, None)
+
+    def _unlink(self, device_id, group_id):
+        group_ids = self._device_groups.get(device_id)
+
+        if group_ids is not None:
+            group_ids.discard(group_id)
+
+            if not group_ids:
+                del self._device_groups[device_id]
+
+    def update(self, endpoint: TradfriEndpoint, id, obj):
+        """ applies a change, obj is None if the resource has been removed (TradfriObserver listener signature) """
+        if endpoint == TradfriEndpoint.DEVICE and obj is None:
+            self.remove_device(id)
+        elif endpoint == TradfriEndpoint.DEVICE:
+            self.update_device(obj)
+        elif obj is None:
+            self.remove_group(id)
+        else:
+            self.update_group(obj)
+
+    def add_to(self, observer):
+        """ fills the index from the observer's mirror and follows its changes """
+        with self._lock:
+            observer.add_listener(self.update)
+
+            for device in list(observer.devices.values()):
+                self.update_device(device)
+
+            for group in list(observer.groups.values()):
+                self.update_group(group)
+
+        return self
+
+    def groups_of(self, device_id):
+        """ returns the ids of the groups containing the device """
+        with self._lock:
+            return sorted(self._device_groups.get(int(device_id), ()))
+
+    def devices_of(self, group_id):
+        with self._lock:
+            return sorted(self._group_devices.get(int(group_id), ()))
+
+    def group_state(self, group_id):
+        """ derives the group state from the member lights which are known, without any request """
+        with self._lock:
+            members = [self.devices.get(device_id) for device_id in self._group_devices.get(int(group_id), ())]
+
+        lights  = [member for member in members if isinstance(member, TradfriLightBulb)]
+        unknown = sum(1 for member in members if member is None)
+        on      = [bool(light.status) for light in lights]
+
+        return TradfriGroupState(any(on), bool(on) and all(on),
+                                 round(sum(light.brightness for light in lights) / len(lights), 2) if lights else None,
+                                 len(lights), unknown)
@@ -0,0 +1,40 @@
+from coap.coap import Coap
+from config.config import Config
+from common.parallel import ParallelFetcher
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_device import get_tradfri_device
+from tradfri.tradfri_group import TradfriGroup
+
+
+def get_tradfri_inventory_parallel(config: Config, max_in_flight: int=None):
+    """ fetches devices and groups with overlapping requests sharing one in-flight limit,
+        returns a tuple of ParallelResults (devices, groups) """
+    with ParallelFetcher(max_in_flight) as fetcher:
+        id_lists = fetcher.submit(lambda endpoint: Coap.get(config, endpoint),
+                                  [TradfriEndpoint.DEVICE, TradfriEndpoint.GROUP])
+
+        device_ids = id_lists[0][1].result()
+        devices    = fetcher.submit(lambda id: get_tradfri_device(config, id), device_ids)
+        group_ids  = id_lists[1][1].result()
+        groups     = fetcher.submit(lambda id: TradfriGroup.get_group(config, id), group_ids)
+
+        return ParallelFetcher.collect(devices), ParallelFetcher.collect(groups)
+
+
+def iter_tradfri_inventory(config: Config, max_in_flight: int=None, failed: dict=None):
+    """ yields devices and groups as soon as they are decoded, both share one in-flight limit; failed is keyed
+        by (endpoint, id) """
+    def fetch(key):
+        endpoint, id = key
+
+        if endpoint == TradfriEndpoint.DEVICE:
+            return get_tradfri_device(config, id)
+
+        return TradfriGroup.get_group(config, id)
+
+    with ParallelFetcher(max_in_flight) as fetcher:
+        id_lists = fetcher.submit(lambda endpoint: Coap.get(config, endpoint),
+                                  [TradfriEndpoint.DEVICE, TradfriEndpoint.GROUP])
+        keys     = ((endpoint, id) for endpoint, future in id_lists for id in future.result())
+
+        yield from fetcher.imap(fetch, keys, failed)
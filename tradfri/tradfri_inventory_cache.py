@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import time
+
+from coap.coap import Coap
+from config.config import Config
+from common.parallel import ParallelFetcher, ParallelResult
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_device import parse_tradfri_device
+from tradfri.tradfri_group import TradfriGroup
+from tradfri.tradfri_schema import TradfriKey
+
+
+class TradfriInventoryCache:
+    """ persistent cache of the gateway responses next to tradfri.cfg, one file per gateway. on refresh new
+        resources are fetched, static devices (remotes, sensors) are taken from the cache and the resources
+        which carry state (lights, plugs, blinds and groups) are fetched again once they are older than max_age """
+    __VERSION   = 2
+    __FILE_NAME = 'tradfri.{0}.cache'
+
+    __VOLATILE_KEYS = (TradfriKey.LIGHT, TradfriKey.PLUG, TradfriKey.BLIND)
+
+    DEFAULT_MAX_AGE = 10
+
+    def __init__(self, config: Config, path: str=None):
+        self.config  = config
+        self.path    = path if path is not None else TradfriInventoryCache.get_default_path(config)
+        self.devices = {}
+        self.groups  = {}
+        self.fetched = {TradfriEndpoint.DEVICE: {}, TradfriEndpoint.GROUP: {}}
+        self.loaded  = False
+
+    @staticmethod
+    def get_default_path(config: Config):
+        """ returns the cache file of the gateway, keyed by its address so all configs of a gateway share it """
+        key = re.sub(r'[^A-Za-z0-9.-]', '_', str(config.hubip))
+        return os.path.join(Config.get_default_dir(), TradfriInventoryCache.__FILE_NAME.format(key))
+
+    def load(self):
+        """ reads the cache file, a missing, outdated or foreign (other gateway) cache is treated as empty """
+        self.devices = {}
+        self.groups  = {}
+        self.fetched = {TradfriEndpoint.DEVICE: {}, TradfriEndpoint.GROUP: {}}
+        self.loaded  = True
+
+        try:
+            with open(self.path, 'r') as cache_file:
+                content = json.load(cache_file)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(content, dict) or content.get('version') != TradfriInventoryCache.__VERSION or \
+           content.get('hubip') != self.config.hubip:
+            return False
+
+        self.devices = content.get('devices', {})
+        self.groups  = content.get('groups', {})
+        self.fetched = {TradfriEndpoint.DEVICE: content.get('fetched', {}).get('devices', {}),
+                        TradfriEndpoint.GROUP:  content.get('fetched', {}).get('groups', {})}
+        return True
+
+    def save(self):
+        """ writes the cache file atomically, a read-only location is silently ignored """
+        content = {
+            'version': TradfriInventoryCache.__VERSION,
+            'hubip':   self.config.hubip,
+            'devices': self.devices,
+            'groups':  self.groups,
+            'fetched': {'devices': self.fetched[TradfriEndpoint.DEVICE],
+                        'groups':  self.fetched[TradfriEndpoint.GROUP]},
+        }
+        temp_path = self.path + '.tmp'
+
+        try:
+            with open(temp_path, 'w') as cache_file:
+                json.dump(content, cache_file, separators=(',', ':'))
+
+            os.replace(temp_path, self.path)
+        except OSError:
+            return False
+
+        return True
+
+    @staticmethod
+    def is_volatile(json_obj):
+        return any(key in json_obj for key in TradfriInventoryCache.__VOLATILE_KEYS)
+
+    def _is_stale(self, endpoint: TradfriEndpoint, entries: dict, id, max_age: float, now: float):
+        if id not in entries:
+            return True
+
+        # groups always carry state, devices only if they are lights, plugs or blinds
+        if endpoint == TradfriEndpoint.DEVICE and not self.is_volatile(entries[id]):
+            return False
+
+        return now - self.fetched[endpoint].get(id, 0) >= max_age
+
+    def refresh(self, max_in_flight: int=None, max_age: float=None):
+        """ reconciles the cache with the id lists of the gateway, fetches new resources and those whose state
+            is older than max_age seconds (0 fetches all of them) and returns a tuple of ParallelResults
+            (devices, groups) like get_tradfri_inventory_parallel """
+        max_age = max_age if max_age is not None else TradfriInventoryCache.DEFAULT_MAX_AGE
+
+        if not self.loaded:
+            self.load()
+
+        with ParallelFetcher(max_in_flight) as fetcher:
+            id_lists = fetcher.submit(lambda endpoint: Coap.get(self.config, endpoint),
+                                      [TradfriEndpoint.DEVICE, TradfriEndpoint.GROUP])
+
+            now        = time.time()
+            device_ids = [str(id) for id in id_lists[0][1].result()]
+            group_ids  = [str(id) for id in id_lists[1][1].result()]
+
+            stale_devices = [id for id in device_ids
+                             if self._is_stale(TradfriEndpoint.DEVICE, self.devices, id, max_age, now)]
+            stale_groups  = [id for id in group_ids
+                             if self._is_stale(TradfriEndpoint.GROUP, self.groups, id, max_age, now)]
+
+            devices = fetcher.submit(lambda id: Coap.get(self.config, TradfriEndpoint.DEVICE, id), stale_devices)
+            groups  = fetcher.submit(lambda id: Coap.get(self.config, TradfriEndpoint.GROUP, id), stale_groups)
+
+            device_failed = self._update(TradfriEndpoint.DEVICE, self.devices, device_ids, devices, now)
+            group_failed  = self._update(TradfriEndpoint.GROUP, self.groups, group_ids, groups, now)
+
+        self.save()
+
+        return self._build(self.devices, device_ids, device_failed, parse_tradfri_device), \
+               self._build(self.groups, group_ids, group_failed, TradfriGroup.from_json)
+
+    def _update(self, endpoint: TradfriEndpoint, entries: dict, ids: list, futures: list, now: float):
+        fetched = self.fetched[endpoint]
+
+        # resources which have been removed from the gateway are dropped
+        for id in set(entries) - set(ids):
+            del entries[id]
+            fetched.pop(id, None)
+
+        failed = {}
+
+        for id, future in futures:
+            try:
+                entries[id] = future.result()
+                fetched[id] = now
+            except Exception as e:
+                failed[id] = e
+
+        return failed
+
+    def _build(self, entries: dict, ids: list, failed: dict, from_json):
+        items = []
+
+        for id in ids:
+            if id in failed:
+                continue
+
+            item = from_json(entries[id], self.config)
+
+            if item is None:
+                failed[id] = ValueError(f'could not parse resource {id}')
+            else:
+                items.append(item)
+
+        return ParallelResult(items, failed)
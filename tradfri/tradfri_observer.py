@@ -0,0 +1,157 @@
+import threading
+
+from coap.coap import Coap
+from coap.coap_transport import CoapError
+from config.config import Config
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfri_device import parse_tradfri_device
+from tradfri.tradfri_group import TradfriGroup
+
+
+class TradfriObserver:
+    """ keeps an in-memory mirror of all devices and groups which is updated by CoAP Observe notifications """
+    __CHECK_INTERVAL = 5
+
+    def __init__(self, api_config: Config):
+        self.api_config = api_config
+        self.devices    = {}
+        self.groups     = {}
+
+        self._lock         = threading.RLock()
+        self._wanted       = set()
+        self._observations = {}
+        self._listeners    = []
+        self._stopped      = threading.Event()
+        self._wakeup       = threading.Event()
+        self._watchdog     = None
+
+    def add_listener(self, listener):
+        """ listener(endpoint, id, obj) is called for every change, obj is None if the resource has been removed """
+        self._listeners.append(listener)
+
+    def get_device(self, id):
+        return self.devices.get(id)
+
+    def get_group(self, id):
+        return self.groups.get(id)
+
+    def start(self):
+        """ observes the device and group lists and all of their members, returns once the mirror is populated """
+        self._stopped.clear()
+
+        with self._lock:
+            self._wanted.update({(TradfriEndpoint.DEVICE, None), (TradfriEndpoint.GROUP, None)})
+
+        # the id lists first, their notifications add the members to the wanted observations
+        self._register_lapsed([(TradfriEndpoint.DEVICE, None), (TradfriEndpoint.GROUP, None)])
+        self._register_lapsed()
+
+        self._watchdog = threading.Thread(target=self._watch, name='tradfri-observer', daemon=True)
+        self._watchdog.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+        if self._watchdog is not None:
+            self._watchdog.join()
+
+        with self._lock:
+            for observation in self._observations.values():
+                observation.cancel()
+
+            self._observations.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _watch(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(TradfriObserver.__CHECK_INTERVAL)
+            self._wakeup.clear()
+
+            if not self._stopped.is_set():
+                self._register_lapsed()
+
+    def _register_lapsed(self, keys=None):
+        """ (re-)registers all wanted observations which are missing or have lapsed """
+        with self._lock:
+            keys = list(self._wanted) if keys is None else keys
+            keys = [key for key in keys if key not in self._observations or self._observations[key].lapsed]
+
+        for endpoint, id in keys:
+            if self._stopped.is_set():
+                break
+
+            with self._lock:
+                previous = self._observations.pop((endpoint, id), None)
+
+            if previous is not None:
+                previous.cancel()
+
+            try:
+                observation = Coap.observe(self.api_config, endpoint, id,
+                                           lambda json, endpoint=endpoint, id=id: self._on_notification(endpoint, id, json))
+            except (CoapError, ValueError):
+                # gateway not reachable, the next check tries again
+                continue
+
+            with self._lock:
+                if (endpoint, id) in self._wanted:
+                    self._observations[(endpoint, id)] = observation
+                else:
+                    observation.cancel()
+
+    def _on_notification(self, endpoint: TradfriEndpoint, id, json):
+        # called on the transport's receiver thread, requests must not be issued from here
+        if id is None:
+            self._reconcile(endpoint, json)
+            return
+
+        if endpoint == TradfriEndpoint.DEVICE:
+            obj, mirror = parse_tradfri_device(json, self.api_config), self.devices
+        else:
+            obj, mirror = TradfriGroup.from_json(json, self.api_config), self.groups
+
+        if obj is None:
+            return
+
+        with self._lock:
+            if (endpoint, id) not in self._wanted:
+                return
+
+            mirror[id] = obj
+
+        self._notify_listeners(endpoint, id, obj)
+
+    def _reconcile(self, endpoint: TradfriEndpoint, ids):
+        mirror = self.devices if endpoint == TradfriEndpoint.DEVICE else self.groups
+        ids    = set(ids)
+
+        with self._lock:
+            known   = {key[1] for key in self._wanted if key[0] == endpoint and key[1] is not None}
+            removed = known - ids
+
+            self._wanted.update((endpoint, id) for id in ids - known)
+
+            for id in removed:
+                self._wanted.discard((endpoint, id))
+                mirror.pop(id, None)
+                observation = self._observations.pop((endpoint, id), None)
+
+                if observation is not None:
+                    observation.cancel()
+
+        for id in removed:
+            self._notify_listeners(endpoint, id, None)
+
+        if ids - known:
+            self._wakeup.set()
+
+    def _notify_listeners(self, endpoint: TradfriEndpoint, id, obj):
+        for listener in self._listeners:
+            listener(endpoint, id, obj)
@@ -0,0 +1,158 @@
+import json
+
+from coap.coap import Coap
+from config.config import Config
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from common.parallel import ParallelFetcher
+from tradfri.tradfri_schema import TradfriKey, TradfriDecodeError, SCENE_SCHEMA
+
+# the light state a scene stores per device
+_LIGHT_SETTING_KEYS = (TradfriKey.STATE, TradfriKey.BRIGHTNESS, TradfriKey.COLOR, TradfriKey.HUE,
+                       TradfriKey.SATURATION, TradfriKey.COLOR_X, TradfriKey.COLOR_Y, TradfriKey.TEMPERATURE)
+
+
+def get_tradfri_scenes(config: Config, group_id):
+    """ fetches the scenes (moods) stored for a group """
+    scene_ids = Coap.get(config, TradfriEndpoint.SCENE, group_id)
+    scenes    = []
+
+    for scene_id in scene_ids:
+        scene = TradfriScene.get_scene(config, group_id, scene_id)
+
+        if scene is not None:
+            scenes.append(scene)
+
+    return scenes
+
+
+def get_tradfri_scenes_parallel(config: Config, group_ids=None, max_in_flight: int=None):
+    """ fetches the scenes of the groups (all groups with scenes if None) concurrently, returns a ParallelResult
+        with failed keyed by (group id, scene id) or (group id, None) if the scene list failed """
+    if group_ids is None:
+        group_ids = Coap.get(config, TradfriEndpoint.SCENE)
+
+    with ParallelFetcher(max_in_flight) as fetcher:
+        id_lists = fetcher.submit(lambda group_id: Coap.get(config, TradfriEndpoint.SCENE, group_id), group_ids)
+        keys     = []
+        failed   = {}
+
+        for group_id, future in id_lists:
+            try:
+                keys += [(group_id, scene_id) for scene_id in future.result()]
+            except Exception as e:
+                failed[(group_id, None)] = e
+
+        result = fetcher.map(lambda key: TradfriScene.get_scene(config, *key), keys)
+
+    result.failed.update(failed)
+    return result
+
+
+def get_light_settings(config: Config, device_ids, max_in_flight: int=None):
+    """ reads the current state of the lights for a scene, devices which are no lights are left out """
+    def fetch(id):
+        light = Coap.get(config, TradfriEndpoint.DEVICE, id).get(TradfriKey.LIGHT)
+
+        if not light:
+            return {}
+
+        setting = {key: light[0][key] for key in _LIGHT_SETTING_KEYS if key in light[0]}
+        setting[TradfriKey.INSTANCE_ID] = int(id)
+        return setting
+
+    with ParallelFetcher(max_in_flight) as fetcher:
+        result = fetcher.map(fetch, device_ids)
+
+    if result.failed:
+        id, error = next(iter(result.failed.items()))
+        raise ValueError(f'could not read the state of device {id}: {error}')
+
+    return [setting for setting in result if setting]
+
+
+class TradfriScene:
+    """ a scene (mood) of a group, light_settings holds the stored light state per device in gateway format """
+    __JSON_KEY_INSTANCE_ID    = TradfriKey.INSTANCE_ID
+    __JSON_KEY_NAME           = TradfriKey.NAME
+    __JSON_KEY_INDEX          = TradfriKey.SCENE_INDEX
+    __JSON_KEY_PREDEFINED     = TradfriKey.SCENE_PREDEFINED
+    __JSON_KEY_LIGHT_SETTINGS = TradfriKey.SCENE_LIGHT_SETTINGS
+
+    __slots__ = ('id', 'group_id', 'name', 'creation_date', 'index', 'predefined', 'light_settings', 'api_config')
+
+    def __init__(self, id, group_id, name, creation_date=None, index=None, predefined=0, light_settings: []=None,
+                 api_config: Config=None):
+        self.id             = id
+        self.group_id       = group_id
+        self.name           = name
+        self.creation_date  = creation_date
+        self.index          = index
+        self.predefined     = predefined
+        self.light_settings = list(light_settings) if light_settings is not None else []
+        self.api_config     = api_config
+
+    @property
+    def device_ids(self):
+        return [setting.get(TradfriKey.INSTANCE_ID) for setting in self.light_settings]
+
+    @staticmethod
+    def from_json(json, group_id, api_config: Config=None):
+        """ creates a TradfriScene instance out of a valid TRADFRI coap-client JSON response """
+        try:
+            fields = SCENE_SCHEMA.decode(json)
+        except TradfriDecodeError:
+            return None
+
+        return TradfriScene(fields['id'            ],
+                            group_id,
+                            fields['name'          ],
+                            fields['creation_date' ],
+                            fields['index'         ],
+                            fields['predefined'    ],
+                            fields['light_settings'],
+                            api_config              )
+
+    @staticmethod
+    def get_scene(config: Config, group_id, id):
+        json = Coap.get(config, TradfriEndpoint.SCENE, f'{group_id}/{id}')
+        return TradfriScene.from_json(json, group_id, config)
+
+    @staticmethod
+    def activate_static(group_id, id, api_config: Config):
+        """ switches the group on and applies the scene to all of its lights with a single group PUT """
+        payload = json.dumps({TradfriKey.STATE: 1, TradfriKey.SCENE_ID: int(id)})
+        Coap.put(payload, api_config, TradfriEndpoint.GROUP, group_id, False)
+
+    def activate(self):
+        TradfriScene.activate_static(self.group_id, self.id, self.api_config)
+
+    @staticmethod
+    def save_static(group_id, name: str, api_config: Config, device_ids=None, id=None, max_in_flight: int=None):
+        """ stores the current state of the lights (the group members if device_ids is None) as scene name,
+            updates the scene id or creates a new one; returns the id of the scene (None if the gateway did
+            not list a new scene) """
+        if device_ids is None:
+            group      = Coap.get(api_config, TradfriEndpoint.GROUP, group_id)
+            device_ids = group[TradfriKey.GROUP_MEMBERS][TradfriKey.GROUP_MEMBERS_ENDPOINT][TradfriKey.INSTANCE_ID]
+
+        scene = {
+            TradfriKey.NAME:                 name,
+            TradfriKey.SCENE_LIGHT_SETTINGS: get_light_settings(api_config, device_ids, max_in_flight),
+        }
+
+        if id is not None:
+            Coap.put(json.dumps(scene), api_config, TradfriEndpoint.SCENE, f'{group_id}/{id}', False)
+            return id
+
+        # the gateway answers a POST without the id of the new scene, it is the one which was not listed before
+        known = set(Coap.get(api_config, TradfriEndpoint.SCENE, group_id))
+
+        scene[TradfriKey.SCENE_PREDEFINED] = 0
+        Coap.post(json.dumps(scene), api_config, TradfriEndpoint.SCENE, group_id, False)
+
+        created = set(Coap.get(api_config, TradfriEndpoint.SCENE, group_id)) - known
+        return max(created) if created else None
+
+    def save(self, max_in_flight: int=None):
+        """ stores the current state of the scene's lights in the scene """
+        TradfriScene.save_static(self.group_id, self.name, self.api_config, self.device_ids, self.id, max_in_flight)
@@ -0,0 +1,202 @@
+from common.helper import json_helper
+
+
+class TradfriKey:
+    """ LwM2M/IPSO numeric keys used by the TRADFRI gateway """
+    PRODUCT_INFO              = '3'
+    PRODUCT_INFO_MANUFACTURER = '0'
+    PRODUCT_INFO_DESCRIPTION  = '1'
+    PRODUCT_INFO_VERSION      = '3'
+
+    NAME          = '9001'
+    CREATION_DATE = '9002'
+    INSTANCE_ID   = '9003'
+
+    LIGHT           = '3311'
+    STATE           = '5850'
+    BRIGHTNESS      = '5851'
+    COLOR           = '5706'
+    HUE             = '5707'
+    SATURATION      = '5708'
+    COLOR_X         = '5709'
+    COLOR_Y         = '5710'
+    TEMPERATURE     = '5711'
+    TRANSITION_TIME = '5712'
+
+    PLUG  = '3312'
+    BLIND = '15015'
+
+    SUB_LINKS = '15009'
+
+    GROUP_MEMBERS          = '9018'
+    GROUP_MEMBERS_ENDPOINT = '15002'
+    SCENE_ID               = '9039'
+
+    SCENES               = '15005'
+    SCENE_INDEX          = '9057'
+    SCENE_PREDEFINED     = '9068'
+    SCENE_LIGHT_SETTINGS = '15013'
+
+
+MAX_BRIGHTNESS      = 255
+MAX_HUE             = 65536
+MAX_SATURATION      = 65536
+MAX_TRANSITION_TIME = 65535  # tenths of a second, 5712 is an unsigned 16 bit value
+
+
+class TradfriDecodeError(ValueError):
+    """ raised by schema decoders, path holds the keys leading to the offending value """
+    def __init__(self, schema: str, path: tuple, reason: str):
+        super().__init__(f'{schema}: {"/".join(str(key) for key in path) or "<root>"}: {reason}')
+        self.schema = schema
+        self.path   = path
+        self.reason = reason
+
+
+class Field:
+    """ maps the value at path (keys and list indexes) to name, optionally converting it """
+    def __init__(self, name: str, path: tuple, required: bool=True, default=None, convert=None):
+        self.name     = name
+        self.path     = path
+        self.required = required
+        self.default  = default
+        self.convert  = convert
+
+    @property
+    def key(self):
+        return self.path[-1]
+
+
+class Schema:
+    """ declarative description of a TRADFRI payload which gets compiled into a single-pass decoder """
+    __LOOKUP_ERRORS  = (KeyError, IndexError, TypeError)
+    __CONVERT_ERRORS = (ValueError, TypeError, ArithmeticError)
+
+    def __init__(self, name: str, fields: list, base: 'Schema'=None):
+        self.name   = name
+        self.fields = (base.fields if base is not None else ()) + tuple(fields)
+        self.decode = self._compile()
+
+    def field(self, name: str) -> Field:
+        for field in self.fields:
+            if field.name == name:
+                return field
+
+        raise KeyError(name)
+
+    def key(self, name: str):
+        """ returns the JSON key of the field name """
+        return self.field(name).key
+
+    def _compile(self):
+        """ generates the source of a decoder function which reads every field exactly once """
+        namespace = {
+            'json_helper':        json_helper,
+            'TradfriDecodeError': TradfriDecodeError,
+            '_LOOKUP_ERRORS':     Schema.__LOOKUP_ERRORS,
+            '_CONVERT_ERRORS':    Schema.__CONVERT_ERRORS,
+            '_SCHEMA':            self.name,
+        }
+        lines = [
+            'def decode(json_obj):',
+            '    try:',
+            '        obj = json_helper(json_obj)',
+            '    except ValueError as e:',
+            '        raise TradfriDecodeError(_SCHEMA, (), f"invalid JSON: {e}")',
+            '    if not isinstance(obj, dict):',
+            '        raise TradfriDecodeError(_SCHEMA, (), "expected a JSON object")',
+            '    result = {}',
+        ]
+
+        for index, field in enumerate(self.fields):
+            namespace[f'_path_{index}']    = field.path
+            namespace[f'_default_{index}'] = field.default
+            namespace[f'_convert_{index}'] = field.convert
+
+            lines += [
+                '    try:',
+                '        value = obj' + ''.join(f'[{key!r}]' for key in field.path),
+                '    except _LOOKUP_ERRORS:',
+            ]
+
+            if field.required:
+                lines.append(f'        raise TradfriDecodeError(_SCHEMA, _path_{index}, "missing")')
+            else:
+                lines.append(f'        value = _default_{index}')
+
+            if field.convert is not None:
+                lines += [
+                    '    else:',
+                    '        try:',
+                    f'            value = _convert_{index}(value)',
+                    '        except _CONVERT_ERRORS as e:',
+                ]
+
+                if field.required:
+                    lines.append(f'            raise TradfriDecodeError(_SCHEMA, _path_{index}, f"invalid value: {{e}}")')
+                else:
+                    lines.append(f'            value = _default_{index}')
+
+            lines.append(f'    result[{field.name!r}] = value')
+
+        lines.append('    return result')
+
+        exec(compile('\n'.join(lines), f'<tradfri schema {self.name}>', 'exec'), namespace)
+        return namespace['decode']
+
+
+PRODUCT_INFO_SCHEMA = Schema('product_info', [
+    Field('description',  (TradfriKey.PRODUCT_INFO_DESCRIPTION, )),
+    Field('manufacturer', (TradfriKey.PRODUCT_INFO_MANUFACTURER,)),
+    Field('version',      (TradfriKey.PRODUCT_INFO_VERSION,     )),
+])
+
+# the product info as part of a device response
+DEVICE_PRODUCT_INFO_SCHEMA = Schema('device_product_info', [
+    Field('product_info', (TradfriKey.PRODUCT_INFO,), convert=PRODUCT_INFO_SCHEMA.decode),
+])
+
+DEVICE_SCHEMA = Schema('device', [
+    Field('id',            (TradfriKey.INSTANCE_ID,  )),
+    Field('name',          (TradfriKey.NAME,         )),
+    Field('creation_date', (TradfriKey.CREATION_DATE,)),
+    # a broken product info does not invalidate the device itself
+    Field('product_info',  (TradfriKey.PRODUCT_INFO, ), required=False, convert=PRODUCT_INFO_SCHEMA.decode),
+])
+
+LIGHT_BULB_SCHEMA = Schema('light_bulb', [
+    Field('brightness', (TradfriKey.LIGHT, 0, TradfriKey.BRIGHTNESS),
+          convert=lambda value: round((value / MAX_BRIGHTNESS) * 100, 2)),
+    Field('status',     (TradfriKey.LIGHT, 0, TradfriKey.STATE     )),
+    Field('color',      (TradfriKey.LIGHT, 0, TradfriKey.COLOR     ), required=False, default='Standard'),
+], DEVICE_SCHEMA)
+
+COLOR_LIGHT_BULB_SCHEMA = Schema('color_light_bulb', [
+    Field('hue',        (TradfriKey.LIGHT, 0, TradfriKey.HUE       ), convert=lambda value: (value / MAX_HUE) * 360),
+    Field('saturation', (TradfriKey.LIGHT, 0, TradfriKey.SATURATION), convert=lambda value: (value / MAX_SATURATION) * 100),
+    Field('x',          (TradfriKey.LIGHT, 0, TradfriKey.COLOR_X   ), required=False),
+    Field('y',          (TradfriKey.LIGHT, 0, TradfriKey.COLOR_Y   ), required=False),
+], LIGHT_BULB_SCHEMA)
+
+REMOTE_SCHEMA = Schema('remote', [
+    Field('sub_links', (TradfriKey.SUB_LINKS,)),
+], DEVICE_SCHEMA)
+
+GROUP_SCHEMA = Schema('group', [
+    Field('id',            (TradfriKey.INSTANCE_ID,  )),
+    Field('name',          (TradfriKey.NAME,         )),
+    Field('creation_date', (TradfriKey.CREATION_DATE,)),
+    Field('state',         (TradfriKey.STATE,        )),
+    Field('brightness',    (TradfriKey.BRIGHTNESS,   )),
+    Field('device_ids',    (TradfriKey.GROUP_MEMBERS, TradfriKey.GROUP_MEMBERS_ENDPOINT, TradfriKey.INSTANCE_ID)),
+    Field('scene_id',      (TradfriKey.SCENE_ID,     ), required=False),
+])
+
+SCENE_SCHEMA = Schema('scene', [
+    Field('id',             (TradfriKey.INSTANCE_ID,         )),
+    Field('name',           (TradfriKey.NAME,                )),
+    Field('creation_date',  (TradfriKey.CREATION_DATE,       ), required=False),
+    Field('index',          (TradfriKey.SCENE_INDEX,         ), required=False),
+    Field('predefined',     (TradfriKey.SCENE_PREDEFINED,    ), required=False, default=0),
+    Field('light_settings', (TradfriKey.SCENE_LIGHT_SETTINGS,), required=False, default=[], convert=list),
+])
@@ -0,0 +1,144 @@
+import json
+import math
+import time
+import threading
+
+from coap.coap import Coap
+from config.config import Config
+from tradfri.tradfri_endpoint import TradfriEndpoint
+from tradfri.tradfriActions import _COLOR_XY
+from tradfri.tradfri_schema import TradfriKey, MAX_BRIGHTNESS, MAX_TRANSITION_TIME
+
+# values which are interpolated if a fade needs more than one segment
+_FADE_KEYS = (TradfriKey.BRIGHTNESS, TradfriKey.COLOR_X, TradfriKey.COLOR_Y)
+
+
+def _target(brightness=None, color=None):
+    """ returns the gateway values of a fade, brightness 0 - 100 and color warm/normal/cold or (x, y) """
+    target = {}
+
+    if brightness is not None:
+        if not 0 <= float(brightness) <= 100:
+            raise ValueError('dim value can only be between 0 and 100')
+
+        target[TradfriKey.BRIGHTNESS] = int(float(brightness) * MAX_BRIGHTNESS / 100)
+
+    if color is not None:
+        if isinstance(color, str):
+            if color not in _COLOR_XY:
+                raise ValueError('color value can only be warm/normal/cold')
+
+            color = _COLOR_XY[color]
+
+        target[TradfriKey.COLOR_X], target[TradfriKey.COLOR_Y] = (int(value) for value in color)
+
+    if not target:
+        raise ValueError('either brightness or color has to be set')
+
+    return target
+
+
+def get_segments(start: dict, target: dict, duration: float):
+    """ splits a fade of duration seconds into the fewest segments the gateway can do, values in between are
+        interpolated linearly from start (values missing in start are set with the first segment);
+        returns a list of (values, transition time in tenths of a second) """
+    tenths = max(0, round(duration * 10))
+    count  = max(1, math.ceil(tenths / MAX_TRANSITION_TIME))
+    result = []
+
+    for index in range(1, count + 1):
+        values = {}
+
+        for key, value in target.items():
+            if key in start and index < count:
+                values[key] = round(start[key] + (value - start[key]) * index / count)
+            else:
+                values[key] = value
+
+        result.append((values, tenths * index // count - tenths * (index - 1) // count))
+
+    return result
+
+
+def _current_light(api_config: Config, id):
+    light = Coap.get(api_config, TradfriEndpoint.DEVICE, id).get(TradfriKey.LIGHT) or [{}]
+    return {key: light[0][key] for key in _FADE_KEYS if key in light[0]}
+
+
+def _current_group(api_config: Config, id):
+    group = Coap.get(api_config, TradfriEndpoint.GROUP, id)
+    start = {TradfriKey.BRIGHTNESS: group[TradfriKey.BRIGHTNESS]} if TradfriKey.BRIGHTNESS in group else {}
+
+    # groups do not report a colour, the first member which has one stands for the group
+    for member in group[TradfriKey.GROUP_MEMBERS][TradfriKey.GROUP_MEMBERS_ENDPOINT][TradfriKey.INSTANCE_ID]:
+        light = _current_light(api_config, member)
+
+        if TradfriKey.COLOR_X in light and TradfriKey.COLOR_Y in light:
+            start[TradfriKey.COLOR_X] = light[TradfriKey.COLOR_X]
+            start[TradfriKey.COLOR_Y] = light[TradfriKey.COLOR_Y]
+            break
+
+    return start
+
+
+def _sleep(seconds: float, stop: threading.Event=None):
+    """ returns True if stop has been set in the meantime """
+    if stop is not None:
+        return stop.wait(seconds)
+
+    time.sleep(seconds)
+    return False
+
+
+def _fade(endpoint: TradfriEndpoint, api_config: Config, id, duration: float, target: dict, wait: bool, stop):
+    segments = [(target, max(0, round(duration * 10)))]
+
+    if segments[0][1] > MAX_TRANSITION_TIME:
+        # the values in between are only needed if the fade has to be chained
+        if endpoint == TradfriEndpoint.DEVICE:
+            start = _current_light(api_config, id)
+        else:
+            start = _current_group(api_config, id)
+
+        segments = get_segments(start, target, duration)
+
+    def send(values, tenths):
+        changes = dict(values, **{TradfriKey.TRANSITION_TIME: tenths})
+        payload = json.dumps({TradfriKey.LIGHT: [changes]} if endpoint == TradfriEndpoint.DEVICE else changes)
+        Coap.put(payload, api_config, endpoint, id, False)
+
+    def run():
+        for (_, previous), (values, tenths) in zip(segments, segments[1:]):
+            # the next segment starts once the gateway has finished the previous one
+            if _sleep(previous / 10, stop):
+                return
+
+            send(values, tenths)
+
+    # the first segment is sent right away, so invalid ids and unreachable gateways raise here
+    send(*segments[0])
+
+    if len(segments) == 1:
+        return None
+
+    if wait:
+        run()
+        return None
+
+    thread = threading.Thread(target=run, name='tradfri-fade', daemon=True)
+    thread.start()
+    return thread
+
+
+def fade_light(api_config: Config, id, duration: float, brightness=None, color=None, wait: bool=True,
+               stop: threading.Event=None):
+    """ fades a light to brightness (0 - 100) and/or color (warm/normal/cold or (x, y)) within duration seconds,
+        the gateway interpolates with 5712. fades longer than the gateway's maximum are chained from the fewest
+        segments; without wait they continue on a thread which is returned, setting stop cancels them """
+    return _fade(TradfriEndpoint.DEVICE, api_config, id, duration, _target(brightness, color), wait, stop)
+
+
+def fade_group(api_config: Config, id, duration: float, brightness=None, color=None, wait: bool=True,
+               stop: threading.Event=None):
+    """ fades all lights of a group like fade_light with a single group PUT per segment """
+    return _fade(TradfriEndpoint.GROUP, api_config, id, duration, _target(brightness, color), wait, stop)